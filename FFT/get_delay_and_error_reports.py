@@ -1,3 +1,4 @@
+from multiprocessing import Pool, cpu_count
 from pathlib import Path
 
 import click
@@ -7,37 +8,36 @@ import pandas as pd
 from utils import LibaiRecordUtils
 
 
+DELAY_LENGTH = 20  # seconds
+
+
+def get_common_index(polar_timestamps: np.ndarray,
+                     target_timestamps: np.ndarray) -> tuple:
+    """Rows of the first sample of every timestamp found in both, in order"""
+    polar_unique, polar_first = np.unique(polar_timestamps,
+                                          return_index=True)
+    target_unique, target_first = np.unique(target_timestamps,
+                                            return_index=True)
+    polar_index = np.sort(polar_first[np.isin(polar_unique, target_unique)])
+    target_index = np.sort(target_first[np.isin(target_unique,
+                                                polar_unique)])
+    return polar_index, target_index
+
+
 def get_point_wise_error(polar_heartrates: np.ndarray,
                          target_heartrates: np.ndarray) -> tuple:
     error_return = (None, None, None, None, None)
-    timestamp_set = set(polar_heartrates[:, 0]) & set(target_heartrates[:, 0])
-    if len(timestamp_set) == 0:
+    polar_index, target_index = get_common_index(polar_heartrates[:, 0],
+                                                 target_heartrates[:, 0])
+    if len(polar_index) == 0:
         print('NO same timestamp')
         return error_return
 
-    polar_mask = [False] * len(polar_heartrates)
-    timestamp_visited = set()
-    for i, timestamp in enumerate(polar_heartrates[:, 0]):
-        if timestamp in timestamp_set and timestamp not in timestamp_visited:
-            polar_mask[i] = True
-            timestamp_visited.add(timestamp)
-
-    target_mask = [False] * len(target_heartrates)
-    timestamp_visited.clear()
-    for i, timestamp in enumerate(target_heartrates[:, 0]):
-        if timestamp in timestamp_set and timestamp not in timestamp_visited:
-            target_mask[i] = True
-            timestamp_visited.add(timestamp)
-
-    polar_heartrate = polar_heartrates[polar_mask][:, 1]
-    target_heartrate = target_heartrates[target_mask][:, 1]
+    polar_heartrate = polar_heartrates[polar_index, 1]
+    target_heartrate = target_heartrates[target_index, 1]
 
     error = np.abs(target_heartrate - polar_heartrate)
 
-    if len(error) == 0:
-        print('Empty error')
-        return error_return
-
     error_mean = error.mean()
     error_max = error.max()
     error_20 = np.percentile(error, 20)
@@ -47,38 +47,82 @@ def get_point_wise_error(polar_heartrates: np.ndarray,
     return (error_mean, error_20, error_50, error_80, error_max)
 
 
-def get_best_delay_error(polar_heartrates: np.ndarray,
-                         target_heartrates: np.ndarray) -> tuple:
-    error_return = (None, None)
-    if polar_heartrates is None or target_heartrates is None:
-        return error_return
+def get_shifted_mean_errors(polar_heartrates: np.ndarray,
+                            target_heartrates: np.ndarray,
+                            shifts: np.ndarray) -> np.ndarray:
+    """Mean point-wise error with target timestamps moved by every shift
+
+    Polar heartrates are put on a 1 s grid, keeping the first sample of
+    every second like get_point_wise_error, so every shift is one lookup
+    of the target timestamps. NaN where no timestamps are in common.
+    """
+    polar_timestamps, polar_first = np.unique(polar_heartrates[:, 0],
+                                              return_index=True)
+    target_timestamps, target_first = np.unique(target_heartrates[:, 0],
+                                                return_index=True)
+    target_heartrate = target_heartrates[target_first, 1]
+
+    start = polar_timestamps[0]
+    grid_len = polar_timestamps[-1] - start + 1
+    polar_grid = np.zeros(grid_len, dtype=polar_heartrates.dtype)
+    polar_valid = np.zeros(grid_len, dtype=bool)
+    polar_grid[polar_timestamps - start] = polar_heartrates[polar_first, 1]
+    polar_valid[polar_timestamps - start] = True
+
+    errors = np.full(len(shifts), np.nan)
+    for i, shift in enumerate(shifts):
+        pos = target_timestamps + (shift - start)
+        matched = (pos >= 0) & (pos < grid_len)
+        matched[matched] = polar_valid[pos[matched]]
+        if not matched.any():
+            continue
+        error = np.abs(target_heartrate[matched] - polar_grid[pos[matched]])
+        errors[i] = error.mean()
+    return errors
 
-    delay_length = 20
 
-    best_delay = 0
-    min_mean_error = np.inf
-    for i in range(-delay_length, delay_length + 1, 1):
-        target_heartrates_adjust = target_heartrates.copy()
-        target_heartrates_adjust[:, 0] -= i
-        point_wise_error = get_point_wise_error(polar_heartrates,
-                                                target_heartrates_adjust)
-        if point_wise_error is None or point_wise_error[0] is None:
-            continue
+def refine_delay(delays: np.ndarray, errors: np.ndarray, best: int) -> float:
+    """Sub-second delay from a parabola through the errors around the best"""
+    if 0 < best < len(delays) - 1:
+        error_before, error, error_after = errors[best - 1:best + 2]
+        curvature = error_before - 2 * error + error_after
+        if np.isfinite(curvature) and curvature > 0:
+            return float(delays[best] + 0.5 *
+                         (error_before - error_after) / curvature)
+    return float(delays[best])
+
 
-        if point_wise_error[0] < min_mean_error:
-            best_delay = i
-            min_mean_error = point_wise_error[0]
+def get_best_delay_error(polar_heartrates: np.ndarray,
+                         target_heartrates: np.ndarray,
+                         delay_length=DELAY_LENGTH) -> tuple:
+    """Delay of target in seconds with the least mean point-wise error
+
+    Returns
+    -------
+    tuple
+        (best_delay, min_mean_error, refined_delay), the first best delay
+        from -delay_length, refined_delay is interpolated to sub-second
+    """
+    error_return = (None, None, None)
+    if polar_heartrates is None or target_heartrates is None:
+        return error_return
 
-    if min_mean_error == np.inf:
+    delays = np.arange(-delay_length, delay_length + 1)
+    errors = get_shifted_mean_errors(polar_heartrates, target_heartrates,
+                                     -delays)
+    if np.all(np.isnan(errors)):
         return error_return
 
-    return (best_delay, min_mean_error)
+    best = int(np.nanargmin(errors))
+    return (int(delays[best]), errors[best],
+            refine_delay(delays, errors, best))
 
 
-def get_delay_and_error_report(libai_record: Path):
+def get_delay_and_error_report(libai_record: Path,
+                               delay_length=DELAY_LENGTH):
     libai_record = Path(libai_record)
 
-    error_return = (libai_record.name, None, None, None, None, None, None)
+    error_return = (libai_record.name, ) + (None, ) * 8
 
     libai_record_utils = LibaiRecordUtils(libai_record)
 
@@ -92,59 +136,76 @@ def get_delay_and_error_report(libai_record: Path):
     lifeq_error = None
     lifeq_best_delay = None
     lifeq_error_min = None
+    lifeq_refined_delay = None
     if lifeq_heartrates is not None:
         lifeq_point_wise_error = get_point_wise_error(polar_heartrates,
                                                       lifeq_heartrates)
         lifeq_error = lifeq_point_wise_error[0]
 
-        lifeq_best_delay, lifeq_error_min = get_best_delay_error(
-            polar_heartrates, lifeq_heartrates)
+        (lifeq_best_delay, lifeq_error_min,
+         lifeq_refined_delay) = get_best_delay_error(polar_heartrates,
+                                                     lifeq_heartrates,
+                                                     delay_length)
 
     garmin_heartrates = libai_record_utils.get_garmin_heartrates()
     garmin_error = None
     garmin_best_delay = None
     garmin_error_min = None
+    garmin_refined_delay = None
     if garmin_heartrates is not None:
         garmin_point_wise_error = get_point_wise_error(polar_heartrates,
                                                        garmin_heartrates)
         garmin_error = garmin_point_wise_error[0]
 
-        garmin_best_delay, garmin_error_min = get_best_delay_error(
-            polar_heartrates, garmin_heartrates)
+        (garmin_best_delay, garmin_error_min,
+         garmin_refined_delay) = get_best_delay_error(polar_heartrates,
+                                                      garmin_heartrates,
+                                                      delay_length)
 
     report = (libai_record.name, lifeq_error, lifeq_best_delay,
               lifeq_error_min, garmin_error, garmin_best_delay,
-              garmin_error_min)
+              garmin_error_min, lifeq_refined_delay, garmin_refined_delay)
     return report
 
 
-def get_delay_and_error_reports(libai_record_dir: Path) -> pd.DataFrame:
+def get_delay_and_error_report_task(task):
+    """Process pool task"""
+    return get_delay_and_error_report(*task)
+
+
+def get_delay_and_error_reports(libai_record_dir: Path,
+                                delay_length=DELAY_LENGTH,
+                                workers=None) -> pd.DataFrame:
     libai_record_dir = Path(libai_record_dir)
 
     libai_records = [
         libai_record for libai_record in libai_record_dir.iterdir()
     ]
 
+    tasks = [(libai_record, delay_length) for libai_record in libai_records]
     reports = []
-    for i, libai_record in enumerate(libai_records):
-        print(f'Processing {i + 1} / {len(libai_records)}: '
-              f'{libai_record.name}')
-        report = get_delay_and_error_report(libai_record)
-        reports.append(report)
+    with Pool(workers) as pool:
+        for i, report in enumerate(
+                pool.imap(get_delay_and_error_report_task, tasks)):
+            print(f'Processed {i + 1} / {len(libai_records)}: {report[0]}')
+            reports.append(report)
 
     report_columns = [
         'libai_record', 'lifeq_error', 'lifeq_best_delay', 'lifeq_error_min',
-        'garmin_error', 'garmin_best_delay', 'garmin_error_min'
+        'garmin_error', 'garmin_best_delay', 'garmin_error_min',
+        'lifeq_refined_delay', 'garmin_refined_delay'
     ]
     report_df = pd.DataFrame(reports, columns=report_columns)
     return report_df
 
 
-def run(libai_path: str, is_dir: bool):
+def run(libai_path: str, is_dir: bool, delay_length=DELAY_LENGTH,
+        workers=None):
     libai_path = Path(libai_path)
 
     if is_dir:
-        report_df = get_delay_and_error_reports(libai_path)
+        report_df = get_delay_and_error_reports(libai_path, delay_length,
+                                                workers)
         report_path = Path(__file__).parent / (libai_path.name +
                                                '_delay_reports.csv')
 
@@ -153,15 +214,21 @@ def run(libai_path: str, is_dir: bool):
         print(f'Saved: {report_path.absolute()}')
 
     else:
-        report = get_delay_and_error_report(libai_path)
+        report = get_delay_and_error_report(libai_path, delay_length)
         print(f'report = {report}')
 
 
 @click.command()
 @click.argument('libai-path')
 @click.option('-d', '--is-dir', is_flag=True)
-def main(libai_path: str, is_dir: bool):
-    run(libai_path, is_dir)
+@click.option('-l',
+              '--delay-length',
+              type=int,
+              default=DELAY_LENGTH,
+              help='Search delays in [-l, l] seconds')
+@click.option('-j', '--workers', type=int, default=cpu_count())
+def main(libai_path: str, is_dir: bool, delay_length: int, workers: int):
+    run(libai_path, is_dir, delay_length, workers)
 
 
 if __name__ == '__main__':
@@ -1,15 +1,18 @@
 from datetime import datetime, timedelta
 from pathlib import Path
+import sys
 
 import PySimpleGUI as sg
 import click
-import fitparse
 from matplotlib import ticker
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from scipy import signal
 
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'xiaomi'))
+from fit_cache import get_fit_heartrates
+
 LIBAI_PREFIX = 'libai_'
 LIFEQ_HEARTRATE_SUFFIX = '-heartrate-xHZ.csv'
 ACC_PPG_MERGED_SUFFIX = '-accel-ppg-merged-52HZ.csv'
@@ -93,24 +96,7 @@ class LibaiRecordUtils:
             print(f'No garmin file in {self._libai_record.name}')
             return None
 
-        garmin_heartrate_file = str(garmin_heartrate_file)
-
-        garmin_fit_file = fitparse.FitFile(garmin_heartrate_file)
-
-        records = []
-        for i, fields in enumerate(garmin_fit_file.get_messages('record')):
-            timestamp, heartrate = None, None
-            for data in fields:
-                name, value = data.name, data.value
-                if name == 'timestamp':
-                    value += GARMIN_UTC_OFFSET
-                    value = value.timestamp()
-                    timestamp = value
-                elif name == 'heart_rate':
-                    heartrate = value
-            if timestamp is not None and heartrate is not None:
-                records.append((timestamp, heartrate))
-
+        records = get_fit_heartrates(garmin_heartrate_file, GARMIN_UTC_OFFSET)
         garmin_df = pd.DataFrame(records, columns=['timestamp', 'heartrate'])
 
         return garmin_df.values.astype(np.int)
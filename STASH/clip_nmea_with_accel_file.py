@@ -1,6 +1,10 @@
 import os
 import click
 from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'xiaomi'))
+from time_range_probe import probe_time_range
 
 NMEA_FILE_HEADER = 'CurrentTimeMillis,EventTimestamp(ms),NMEA,IndoorOutdoor\n'
 
@@ -11,35 +15,6 @@ SOURCE_BASE = 'source_nmea'
 CLIPED_BASE = 'cliped_nmea'
 
 
-# 1) read tail from accel file
-def read_tail(input_file: Path, tail=5):
-    file_size = Path(input_file).stat().st_size
-    blocksize = 1024
-    data_file = open(input_file, 'r')
-    if file_size > blocksize:
-        maxseekpoint = (file_size // blocksize)
-        data_file.seek((maxseekpoint - 1) * blocksize)
-    elif file_size:
-        data_file.seek(0, 0)
-    lines = data_file.readlines()
-    last_lines = []
-    if lines:
-        for line in lines[-tail:]:
-            last_lines.append(line.strip())
-    data_file.close()
-    return last_lines
-
-
-# 2) read head from accel file
-def read_head(input_file: Path, head=5):
-    head_lines = []
-    with Path(input_file).open('r') as f:
-        for i in range(head):
-            line = f.readline().strip()
-            head_lines.append(line)
-    return head_lines
-
-
 # 3) get accel file path from nmea file path
 def get_accel_file_path_from_nmea_file_path(nmea_file_path: Path, accel_dir):
     nmea_file_path = Path(nmea_file_path)
@@ -65,19 +40,12 @@ def get_timerange_from_accel_file(accel_file_path: Path) -> tuple:
         return
     accel_file_path = Path(accel_file_path)
 
-    head_lines = read_head(accel_file_path)
-    last_lines = read_tail(accel_file_path)
-
-    head_meta_ts = head_lines[1].split(',')[0]  # skip the header
-    last_meta_ts = last_lines[-1].split(',')[0]  # CurrentTimeMillis
-    begin_ts, end_ts = -1, -1
-    try:
-        begin_ts = int(head_meta_ts)
-        end_ts = int(last_meta_ts)
-    except ValueError:
-        print(f'Can not convert ({begin_ts}, {end_ts}) to int')
-        return (begin_ts, end_ts)
-    return (begin_ts, end_ts)
+    # CurrentTimeMillis of the first and last rows, after the header
+    timerange = probe_time_range(accel_file_path, header_lines=1)
+    if None in timerange:
+        print(f'No timestamp in {accel_file_path.name}')
+        return (-1, -1)
+    return timerange
 
 
 # 5) clip and saveas nmea file with timerange from accel file path
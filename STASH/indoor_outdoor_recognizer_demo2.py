@@ -7,7 +7,6 @@ Description:
     process a nmea file, and report its result
 '''
 import multiprocessing
-from multiprocessing import Pool
 
 import shutil
 import click
@@ -22,6 +21,7 @@ import matplotlib.ticker as ticker
 from pathlib import Path
 
 from indoor_outdoor_recognizer import IndoorOutdoorRecognizer
+from indoor_outdoor_recognizer_process import run_nmea_dir
 
 HEADER_LINES_TO_SKIP = 2
 
@@ -249,8 +249,12 @@ def process_nmea_file(nmea_file_path: Path,
               '--is_clear_summary',
               is_flag=True,
               help='clear summary file')
+@click.option('-j',
+              '--workers',
+              default=multiprocessing.cpu_count(),
+              help='Processes for a directory')
 def main(nmea_path, is_plot, is_save_plt, is_raw_nmea_file, is_report_cm,
-         is_write_cm, is_clear_summary):
+         is_write_cm, is_clear_summary, workers):
     nmea_path = Path(nmea_path)
     if is_clear_summary and INDOOR_OUTDOOR_RECOGNIZATION_REPORT_DIR.exists():
         shutil.rmtree(INDOOR_OUTDOOR_RECOGNIZATION_REPORT_DIR)
@@ -259,23 +263,20 @@ def main(nmea_path, is_plot, is_save_plt, is_raw_nmea_file, is_report_cm,
         pass
 
     if nmea_path.is_file():
-        process_nmea_file(nmea_path=nmea_path,
+        process_nmea_file(nmea_file_path=nmea_path,
                           is_plot=is_plot,
                           is_save_plt=is_save_plt,
                           is_raw_nmea_file=is_raw_nmea_file,
                           is_report_cm=is_report_cm,
                           is_write_cm=is_write_cm)
     elif nmea_path.is_dir():
-        nmea_file_paths = [path for path in nmea_path.rglob(NMEA_FILE_PATTERN)]
-        cpu_cnt = multiprocessing.cpu_count()
-        p = Pool(cpu_cnt)
-        for i, nmea_file_path in enumerate(nmea_file_paths):
-            p.apply_async(process_nmea_file,
-                          args=(nmea_file_path, is_plot, is_save_plt,
-                                is_raw_nmea_file, is_report_cm, is_write_cm,
-                                i + 1))
-        p.close()
-        p.join()
+        nmea_file_paths = sorted(nmea_path.rglob(NMEA_FILE_PATTERN))
+        run_nmea_dir(nmea_file_paths,
+                     is_raw_nmea_file=is_raw_nmea_file,
+                     is_save_plt=is_plot,
+                     is_write_cm=is_write_cm,
+                     workers=workers,
+                     recognize=nmea_file_recognization)
 
 
 if __name__ == "__main__":
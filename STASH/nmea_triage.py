@@ -0,0 +1,278 @@
+'''
+Author: Tianzw
+Date: 2021-03-20 10:12:31
+LastEditTime: 2021-03-20 16:40:05
+LastEditors: Tianzw
+Description:
+    Classify NMEA files in one early-exit pass: the problem type of
+    nmea_problems_distribution and the validity of remove_unvalid_nmea_file.
+    Results of a directory are cached in a manifest, keyed by file size and
+    modification time.
+'''
+import json
+import multiprocessing
+import os
+from enum import IntEnum, unique
+from multiprocessing import Pool
+from pathlib import Path
+
+import click
+
+NMEA_FILE_LINES_LEAST = 2
+NMEA_FILE_PATTERN = '*.csv'
+
+BLOCK_SIZE = 1 << 16
+GPGSV_PATTERN = '$GPGSV'
+MANIFEST_FILE_NAME = '.nmea_triage_manifest.json'
+MANIFEST_VERSION = 1
+
+
+@unique
+class NmeaFileProblemType(IntEnum):
+    NoNmeaSignal = 0  # 没有 nmea 信号，可直接判断
+    NoGpgsvSentence = 1  # 没有 GPGSV 信号，延后判断
+    EmptyGpgsvSentence = 2  #
+    EmptySnr = 3
+    ZeroSnr = 4
+    NormalNmea = 5
+
+
+def split_nmea_sentence(line: str) -> list:
+    """Fields of the NMEA sentence in a raw or preprocessed line
+
+    Raw lines are 'ts,ets,$GPGSV,...', preprocessed ones quote the sentence
+    and have the label after it: 'ts,ets,"$GPGSV,...",0'.
+    """
+    metas = line.rstrip('\r\n').split(',', 2)
+    if len(metas) < 3:
+        return []
+    sentence = metas[2]
+    if sentence.startswith('"'):
+        sentence = sentence[1:].split('"', 1)[0]
+    return sentence.split(',')
+
+
+class NmeaTriage():
+    """Classification state of one file, fed with its GPGSV sentences"""
+    def __init__(self) -> None:
+        self.is_exists_gpgsv = False
+        self.is_empty_gpgsv = True
+        self.is_empty_snr = True
+        self.is_zero_snr = False
+        self.is_positive_snr = False
+
+    def feed(self, fields: list) -> bool:
+        """Update with the fields of a GPGSV sentence, True once final"""
+        self.is_exists_gpgsv = True
+        if len(fields) <= 5:
+            return False
+        self.is_empty_gpgsv = False
+        # Every 4th field from the 8th is an SNR, the last one may carry the
+        # checksum
+        for snr in fields[7::4]:
+            snr = snr.split('*', 1)[0]
+            if not snr.isdigit():
+                continue
+            self.is_empty_snr = False
+            if int(snr) > 0:
+                self.is_positive_snr = True
+                return True
+            self.is_zero_snr = True
+        return False
+
+    def problem_type(self, lines: int) -> NmeaFileProblemType:
+        if lines <= NMEA_FILE_LINES_LEAST:
+            return NmeaFileProblemType.NoNmeaSignal
+        if self.is_positive_snr:
+            return NmeaFileProblemType.NormalNmea
+        if not self.is_exists_gpgsv:
+            return NmeaFileProblemType.NoGpgsvSentence
+        if self.is_empty_gpgsv:
+            return NmeaFileProblemType.EmptyGpgsvSentence
+        if self.is_empty_snr:
+            return NmeaFileProblemType.EmptySnr
+        if self.is_zero_snr:
+            return NmeaFileProblemType.ZeroSnr
+        return NmeaFileProblemType.NormalNmea
+
+
+def scan_nmea_file(nmea_file_path: Path, block_size=BLOCK_SIZE) -> dict:
+    """Problem type and validity of a NMEA file in one pass
+
+    The file is read block by block, only lines with a GPGSV sentence are
+    parsed, and reading stops at the first positive SNR after the first
+    NMEA_FILE_LINES_LEAST lines. A file is valid if it has a GPGSV sentence.
+
+    Returns
+    -------
+    dict
+        problem_type, valid and bytes_read
+    """
+    triage = NmeaTriage()
+    lines = 0  # Complete lines before `data`
+    bytes_read = 0
+    done = False
+    data = b''
+    with Path(nmea_file_path).open('rb') as f:
+        while not done:
+            block = f.read(block_size)
+            bytes_read += len(block)
+            if len(block) == 0:
+                break
+            data += block
+            end = data.rfind(b'\n') + 1
+            # Line breaks never occur inside a multi-byte character, the
+            # complete lines are decoded at once
+            block_lines = data[:end].decode('utf-8',
+                                            errors='replace').split('\n')[:-1]
+            data = data[end:]
+            for i, line in enumerate(block_lines):
+                if GPGSV_PATTERN not in line:
+                    continue
+                fields = split_nmea_sentence(line)
+                if len(fields) > 0 and fields[0] == GPGSV_PATTERN:
+                    if (triage.feed(fields)
+                            and lines + i >= NMEA_FILE_LINES_LEAST):
+                        done = True
+                        break
+            lines += len(block_lines)
+            if triage.is_positive_snr and lines > NMEA_FILE_LINES_LEAST:
+                done = True
+    if done:
+        lines = NMEA_FILE_LINES_LEAST + 1
+    else:
+        if len(data) > 0:
+            # Last line without a line break
+            fields = split_nmea_sentence(data.decode('utf-8',
+                                                     errors='replace'))
+            if len(fields) > 0 and fields[0] == GPGSV_PATTERN:
+                triage.feed(fields)
+            lines += 1
+    return {
+        'problem_type': int(triage.problem_type(lines)),
+        'valid': triage.is_exists_gpgsv,
+        'bytes_read': bytes_read
+    }
+
+
+def file_signature(nmea_file_path: Path) -> list:
+    stat = Path(nmea_file_path).stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_manifest(manifest_path: Path) -> dict:
+    manifest_path = Path(manifest_path)
+    if not manifest_path.exists():
+        return {}
+    with manifest_path.open('r') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['files']
+
+
+def save_manifest(manifest_path: Path, files: dict):
+    manifest_path = Path(manifest_path)
+    tmp_path = manifest_path.with_name(f'{manifest_path.name}.{os.getpid()}')
+    with tmp_path.open('w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': files}, f, indent=1)
+    tmp_path.replace(manifest_path)
+
+
+def scan_nmea_file_task(task):
+    """Process pool task"""
+    key, nmea_file_path = task
+    entry = scan_nmea_file(nmea_file_path)
+    entry['signature'] = file_signature(nmea_file_path)
+    return key, entry
+
+
+def triage_nmea_dir(nmea_dir: Path,
+                    pattern=NMEA_FILE_PATTERN,
+                    workers=None,
+                    manifest_path=None) -> dict:
+    """Problem type and validity of every NMEA file in a directory
+
+    Only files that are new or changed since the manifest was written are
+    scanned, in a process pool. Entries of removed files are dropped from
+    the manifest.
+
+    Returns
+    -------
+    dict
+        Path relative to nmea_dir to the entry of scan_nmea_file
+    """
+    nmea_dir = Path(nmea_dir)
+    if manifest_path is None:
+        manifest_path = nmea_dir / MANIFEST_FILE_NAME
+    cached = load_manifest(manifest_path)
+
+    files = {}
+    tasks = []
+    for nmea_file_path in sorted(nmea_dir.rglob(pattern)):
+        key = nmea_file_path.relative_to(nmea_dir).as_posix()
+        entry = cached.get(key)
+        if (entry is not None
+                and entry['signature'] == file_signature(nmea_file_path)):
+            files[key] = entry
+        else:
+            tasks.append((key, nmea_file_path))
+
+    print(f'Scanning {len(tasks)} of {len(files) + len(tasks)} files')
+    if len(tasks) > 0:
+        with Pool(workers) as pool:
+            for i, (key, entry) in enumerate(
+                    pool.imap_unordered(scan_nmea_file_task, tasks,
+                                        chunksize=8), 1):
+                files[key] = entry
+                if i % 100 == 0:
+                    print(f'Scanned ({i} / {len(tasks)})')
+    files = dict(sorted(files.items()))
+    # Keep entries of files matched by other patterns
+    kept = {
+        key: entry
+        for key, entry in cached.items()
+        if key not in files and (nmea_dir / key).exists()
+    }
+    save_manifest(manifest_path, dict(sorted({**kept, **files}.items())))
+    return files
+
+
+def forget_files(nmea_dir: Path, keys, manifest_path=None):
+    """Drop entries from the manifest, for files that were removed"""
+    nmea_dir = Path(nmea_dir)
+    if manifest_path is None:
+        manifest_path = nmea_dir / MANIFEST_FILE_NAME
+    files = load_manifest(manifest_path)
+    for key in keys:
+        files.pop(key, None)
+    save_manifest(manifest_path, files)
+
+
+def summarize_problem_types(files: dict) -> list:
+    problem_types = [0] * len(NmeaFileProblemType)
+    for entry in files.values():
+        problem_types[entry['problem_type']] += 1
+    return problem_types
+
+
+@click.command()
+@click.argument('nmea_path')
+@click.option('-p', '--pattern', default=NMEA_FILE_PATTERN)
+@click.option('-j', '--workers', default=multiprocessing.cpu_count())
+def main(nmea_path, pattern, workers):
+    nmea_path = Path(nmea_path)
+    if nmea_path.is_file():
+        print(scan_nmea_file(nmea_path))
+        return
+
+    files = triage_nmea_dir(nmea_path, pattern, workers)
+    problem_types = summarize_problem_types(files)
+    for problem_type in NmeaFileProblemType:
+        print(f'{problem_type.name}: {problem_types[problem_type]}')
+    unvalid_cnt = sum(not entry['valid'] for entry in files.values())
+    print(f'Unvalid files: {unvalid_cnt} / {len(files)}')
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,7 @@ import pandas as pd
 
 from utils import log
 from utils.data_labeler import DataLabeler, merge_labels
+from utils.label_index import LabelIndex
 
 logger = log.create_logger('ActiDataLabeler')
 
@@ -102,7 +103,8 @@ class MetaType(Enum):
     ACTIVITY_TYPE = 1
 
 
-def label_convert_ts2index(labels_ts, ts_arr):
+def label_convert_ts2index_loop(labels_ts, ts_arr):
+    """Reference per-sample implementation of `label_convert_ts2index`"""
     labels_index = []
     max_idx = len(ts_arr) - 1
     # print(f'TS range: {ts_arr[0]} - {ts_arr[-1]}, Total len: {max_idx + 1}')
@@ -128,6 +130,17 @@ def label_convert_ts2index(labels_ts, ts_arr):
     return labels_index
 
 
+def label_convert_ts2index(labels_ts, ts_arr):
+    """Convert (type, start_ts, end_ts) labels to index labels of ts_arr
+
+    The end search compares timestamps with the end timestamp only, the
+    extra `ts > start_index` check of the loop version always holds for
+    real timestamps. Use `LabelIndex` directly to project the same labels
+    onto several streams.
+    """
+    return LabelIndex(labels_ts).to_index(ts_arr)
+
+
 def load_label_result(label_file: Path):
     labels = []
     with label_file.open('r') as f:
@@ -5,13 +5,15 @@
 
 import multiprocessing as mp
 from pathlib import Path
+import time
 
 import click
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
-from activity_data_labeler import label_convert_ts2index, load_label_result
+from activity_data_labeler import load_label_result
+from utils.label_index import LabelIndex
 
 ACC_SUFFIX = 'accel-52HZ.csv'
 GYRO_SUFFIX = 'gyroscope-52HZ.csv'
@@ -44,13 +46,20 @@ def get_activity_type_name_by_record_name(record_name: str):
     return metas[7].split('_')[1]
 
 
-def align_sensor_data(acc, gyro, mag=None, sample_rate=52):
-    """Align sensor sensor data
+def align_sensor_data_loop(acc,
+                           gyro,
+                           mag=None,
+                           sample_rate=52,
+                           find_closest=False,
+                           align_to_ref_ts=False):
+    """Align sensor sensor data, reference per-sample implementation
     Columns should be CurrentTimeMillis,EventTimestamp,x,y,z
 
     If mag sensor data is None, perform 6-axis sensor data align
     Else perform 9-axis sensor data align
 
+    Kept for benchmarking and cross checking `align_sensor_data`.
+
     Parameters
     ----------
     acc : np.ndarray
@@ -61,9 +70,13 @@ def align_sensor_data(acc, gyro, mag=None, sample_rate=52):
         Mag data with shape (K*5), Nonable
     sample_rate : int
         Sample rate
+    find_closest : bool
+        Pick the closest gyro/mag sample instead of the last one before
+        the reference timestamp
+    align_to_ref_ts : bool
+        Emit rows at a fixed sample period, repeating the accel sample
+        when accel data is missing
     """
-    align_to_ref_ts = False
-    find_closest = False
     sample_period = 1e9 / sample_rate
     acc_num = len(acc)
     acc_ts = acc[:, 1]
@@ -137,6 +150,128 @@ def align_sensor_data(acc, gyro, mag=None, sample_rate=52):
     return np.asarray(aligned)
 
 
+def _reference_timestamps(acc_ts, start, sample_period, align_to_ref_ts):
+    """Accel row index and reference timestamp of every aligned row
+
+    Reproduces the reference timestamp sequence of `align_sensor_data_loop`,
+    including the repeated accel rows emitted for accel gaps when aligning
+    to the reference timestamp.
+    """
+    acc_num = len(acc_ts)
+    if not align_to_ref_ts:
+        acc_idx = np.arange(start, acc_num)
+        ref_ts = acc_ts[start:] + SENSOR_TIMESTAMP_NS_ERROR_MAX
+        ref_ts[0] = acc_ts[start]
+        return acc_idx, ref_ts
+
+    head = acc_ts[start:-1]
+    has_gap = ~(acc_ts[start + 1:] <
+                head + sample_period + SENSOR_TIMESTAMP_NS_ERROR_MAX)
+    repeats = np.ones(acc_num - start, dtype=np.intp)
+    gap_refs = {}
+    # Gaps are rare, walk them one by one to keep the float accumulation
+    # of the reference timestamp identical to the per-sample loop
+    for g in np.flatnonzero(has_gap):
+        next_ts = acc_ts[start + g + 1]
+        ref = acc_ts[start + g]
+        refs = [ref]
+        while True:
+            ref += sample_period
+            if next_ts < ref + SENSOR_TIMESTAMP_NS_ERROR_MAX:
+                break
+            refs.append(ref)
+        repeats[g] = len(refs)
+        gap_refs[g] = refs
+
+    acc_idx = np.repeat(np.arange(start, acc_num), repeats)
+    ref_ts = acc_ts[acc_idx]
+    if gap_refs:
+        ref_ts = ref_ts.astype(np.result_type(ref_ts, sample_period))
+    offsets = np.cumsum(repeats) - repeats
+    for g, refs in gap_refs.items():
+        ref_ts[offsets[g]:offsets[g] + len(refs)] = refs
+    return acc_idx, ref_ts
+
+
+def _align_index(ts, ref_ts, find_closest):
+    """Index of the sample aligned to each reference timestamp
+
+    `ts` must be sorted, the result is what the forward scanning loop in
+    `align_sensor_data_loop` ends up with for every reference timestamp.
+    """
+    num = len(ts)
+    idx = np.searchsorted(ts, ref_ts + SENSOR_TIMESTAMP_NS_ERROR_MAX) - 1
+    np.clip(idx, 0, num - 1, out=idx)
+    if find_closest:
+        nxt = np.minimum(idx + 1, num - 1)
+        closer = (idx + 1 < num) & (ref_ts - ts[idx] > ts[nxt] - ref_ts)
+        # The scanning index never moves backwards
+        idx = np.maximum.accumulate(idx + closer)
+    return idx
+
+
+def align_sensor_data(acc,
+                      gyro,
+                      mag=None,
+                      sample_rate=52,
+                      find_closest=False,
+                      align_to_ref_ts=False):
+    """Align sensor sensor data
+    Columns should be CurrentTimeMillis,EventTimestamp,x,y,z
+
+    If mag sensor data is None, perform 6-axis sensor data align
+    Else perform 9-axis sensor data align
+
+    Batched version of `align_sensor_data_loop` based on binary search over
+    the sorted EventTimestamp(ns) columns, output is the same.
+
+    Parameters
+    ----------
+    acc : np.ndarray
+        Accel data with shape (I*5)
+    gyro : np.ndarray
+        Gyro data with shape (J*5)
+    mag : np.ndarray
+        Mag data with shape (K*5), Nonable
+    sample_rate : int
+        Sample rate
+    find_closest : bool
+        Pick the closest gyro/mag sample instead of the last one before
+        the reference timestamp
+    align_to_ref_ts : bool
+        Emit rows at a fixed sample period, repeating the accel sample
+        when accel data is missing
+    """
+    sample_period = 1e9 / sample_rate
+    acc_ts = acc[:, 1]
+    gyro_ts = gyro[:, 1]
+    if mag is not None:
+        init_ts = max(gyro_ts[0], mag[0, 1])
+        dtype = np.result_type(acc, gyro, mag)
+        col_num = acc.shape[1] + 6
+    else:
+        init_ts = gyro_ts[0]
+        dtype = np.result_type(acc, gyro)
+        col_num = acc.shape[1] + 3
+
+    start = np.searchsorted(acc_ts, init_ts)
+    if start >= len(acc):
+        return np.empty((0, col_num), dtype=dtype)
+
+    acc_idx, ref_ts = _reference_timestamps(acc_ts, start, sample_period,
+                                            align_to_ref_ts)
+
+    acc_col_num = acc.shape[1]
+    aligned = np.empty((len(acc_idx), col_num), dtype=dtype)
+    aligned[:, :acc_col_num] = acc[acc_idx]
+    gyro_idx = _align_index(gyro_ts, ref_ts, find_closest)
+    aligned[:, acc_col_num:acc_col_num + 3] = gyro[gyro_idx, 2:5]
+    if mag is not None:
+        mag_idx = _align_index(mag[:, 1], ref_ts, find_closest)
+        aligned[:, acc_col_num + 3:] = mag[mag_idx, 2:5]
+    return aligned
+
+
 def plot_aligned_data(x1, x2, name1='x1', name2='x2'):
     res = np.correlate(x1, x2, 'full')
     idx = np.argmax(res) - len(x2) + 1
@@ -147,7 +282,12 @@ def plot_aligned_data(x1, x2, name1='x1', name2='x2'):
     plt.legend(loc='lower right')
 
 
-def align_one_record(record_dir: Path, debug=False):
+def load_record_sensor_data(record_dir: Path):
+    """(acc, gyro, mag) of a record, None if a sensor file is missing
+
+    A malformed CSV raises pd.errors.ParserError, so the record is counted as
+    failed instead of empty.
+    """
     acc_file = record_dir / f'{record_dir.name}-{ACC_SUFFIX}'
     gyro_file = record_dir / f'{record_dir.name}-{GYRO_SUFFIX}'
     magnet_file = record_dir / f'{record_dir.name}-{MAGNET_SUFFIX}'
@@ -156,17 +296,21 @@ def align_one_record(record_dir: Path, debug=False):
     # print(f'Magnet file: {magnet_file}')
 
     if acc_file.exists() and gyro_file.exists() and magnet_file.exists():
-        try:
-            acc = pd.read_csv(acc_file).values
-            acc = acc[:-1]
-            gyro = pd.read_csv(gyro_file, ).values
-            gyro = gyro[:-1]
-            mag = pd.read_csv(magnet_file).values
-            mag = mag[:-1]
-        except pd.errors.ParserError as e:
-            print(f'Error: {e}')
-            return None
+        acc = pd.read_csv(acc_file).values
+        acc = acc[:-1]
+        gyro = pd.read_csv(gyro_file, ).values
+        gyro = gyro[:-1]
+        mag = pd.read_csv(magnet_file).values
+        mag = mag[:-1]
+        return acc, gyro, mag
+    else:
+        return None
 
+
+def align_one_record(record_dir: Path, debug=False):
+    sensor_data = load_record_sensor_data(record_dir)
+    if sensor_data is not None:
+        acc, gyro, mag = sensor_data
         aligned = align_sensor_data(acc, gyro, mag)
         if debug:
             plt.figure('Align check: axis x')
@@ -187,17 +331,69 @@ def align_one_record(record_dir: Path, debug=False):
         return None
 
 
+def benchmark_align_sensor_data(record_dir: Path, repeat=3):
+    sensor_data = load_record_sensor_data(record_dir)
+    if sensor_data is None:
+        print(f'No sensor data found in: {record_dir}')
+        return
+    acc, gyro, mag = sensor_data
+    print(f'Acc: {acc.shape}, Gyro: {gyro.shape}, Mag: {mag.shape}')
+    for find_closest, align_to_ref_ts in [(False, False), (True, False),
+                                          (False, True), (True, True)]:
+        for axis, m in [(6, None), (9, mag)]:
+            costs = {}
+            results = {}
+            for func in (align_sensor_data_loop, align_sensor_data):
+                best = float('inf')
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    results[func] = func(acc,
+                                         gyro,
+                                         m,
+                                         find_closest=find_closest,
+                                         align_to_ref_ts=align_to_ref_ts)
+                    best = min(best, time.perf_counter() - start)
+                costs[func] = best
+            loop_cost = costs[align_sensor_data_loop]
+            vec_cost = costs[align_sensor_data]
+            same = np.array_equal(results[align_sensor_data_loop],
+                                  results[align_sensor_data])
+            print(f'{axis}-axis, find_closest={find_closest}, '
+                  f'align_to_ref_ts={align_to_ref_ts}: '
+                  f'loop {loop_cost * 1000:.1f} ms, '
+                  f'vectorized {vec_cost * 1000:.1f} ms, '
+                  f'speedup x{loop_cost / vec_cost:.0f}, '
+                  f'identical: {same}')
+
+
+def get_record_source_files(record_dir: Path):
+    suffixes = [ACC_SUFFIX, GYRO_SUFFIX, MAGNET_SUFFIX, LABEL_SUFFIX]
+    return [record_dir / f'{record_dir.name}-{suffix}' for suffix in suffixes]
+
+
+def get_record_dst_file(record_dir: Path, dst_dir: Path):
+    activity_type = get_activity_type_name_by_record_name(record_dir.name)
+    return dst_dir / f'{activity_type}-{record_dir.name}.csv'
+
+
+def is_record_up_to_date(record_dir: Path, dst_file: Path):
+    """Whether dst_file is newer than every source file of the record"""
+    if not dst_file.exists():
+        return False
+    dst_mtime = dst_file.stat().st_mtime
+    for src_file in get_record_source_files(record_dir):
+        if src_file.exists() and src_file.stat().st_mtime > dst_mtime:
+            return False
+    return True
+
+
 def align_and_relabel_one_record(record_dir: Path,
                                  dst_dir: Path,
                                  sample_rate=26,
                                  debug=False):
     dst_file = None
     if dst_dir is not None:
-        activity_type = get_activity_type_name_by_record_name(record_dir.name)
-        dst_file = dst_dir / f'{activity_type}-{record_dir.name}.csv'
-    # if dst_file is not None and dst_file.exists():
-    #     print('Record processed, skipping...')
-    #     return
+        dst_file = get_record_dst_file(record_dir, dst_dir)
 
     # print(f'\nProcessing record: {record_dir}')
     label_file = record_dir / f'{record_dir.name}-{LABEL_SUFFIX}'
@@ -218,60 +414,124 @@ def align_and_relabel_one_record(record_dir: Path,
 
     # Load label result
     labels_ts = load_label_result(label_file)
-    labels_index = label_convert_ts2index(labels_ts, aligned_ts)
-
-    y = np.zeros([aligned.shape[0], 1])
-    for activity_type, start_idx, end_idx in labels_index:
-        y[start_idx:end_idx] = activity_type
+    y = LabelIndex(labels_ts).label_column(aligned_ts, dtype=float)
+    y = y.reshape(-1, 1)
 
     labeled = np.hstack((aligned, y))
     df = pd.DataFrame(data=labeled, columns=HEADER_NAMES)
-    try:
-        df = df.astype(HEADER_NAMES_TYPE)
-    except ValueError as e:
-        print(f'Convert type error: {e}')
-        return
+    # Malformed columns raise, the record is then counted as failed
+    df = df.astype(HEADER_NAMES_TYPE)
 
     if dst_file is not None:
-        activity_type = get_activity_type_name_by_record_name(record_dir.name)
-        dst_file = dst_dir / f'{activity_type}-{record_dir.name}.csv'
         print(f'Saving to file: {dst_file}')
         df.to_csv(dst_file, index=False)
+    return df
+
+
+def align_and_relabel_record_task(task):
+    """Process pool task, errors are isolated to the record
+
+    Returns
+    -------
+    tuple
+        (record_dir, status, source bytes, error message), status is one of
+        'done', 'empty', 'skipped' and 'failed'
+    """
+    record_dir, dst_dir, sample_rate, force = task
+    src_bytes = sum(f.stat().st_size
+                    for f in get_record_source_files(record_dir)
+                    if f.exists())
+    try:
+        dst_file = get_record_dst_file(record_dir, dst_dir)
+        if not force and is_record_up_to_date(record_dir, dst_file):
+            return record_dir, 'skipped', src_bytes, None
+        df = align_and_relabel_one_record(record_dir, dst_dir, sample_rate)
+    except Exception as e:
+        return record_dir, 'failed', src_bytes, f'{type(e).__name__}: {e}'
+    status = 'empty' if df is None else 'done'
+    return record_dir, status, src_bytes, None
 
 
 def align_and_relabel_datasets(data_dir: Path,
                                save_dir: Path,
                                dataset_names,
-                               sample_rate=26):
+                               sample_rate=26,
+                               workers=1,
+                               force=False):
+    tasks = []
     datasets = [data_dir / name for name in dataset_names]
     set_num = len(datasets)
     for i, dataset in enumerate(datasets, 1):
-        print(f'\nProcess dataset [{i:02d}/{set_num:02d}]: {dataset.name}')
+        print(f'\nCollect dataset [{i:02d}/{set_num:02d}]: {dataset.name}')
         scenes = [r for r in dataset.iterdir() if r.is_dir()]
-        scene_num = len(scenes)
         dst_dir = save_dir / dataset.name
-        if not dst_dir.exists():
-            dst_dir.mkdir(parents=True)
-        for j, scene in enumerate(scenes):
-            print(f'\nProcess scene [{j:02d}/{scene_num:02d}]: {scene.name}')
+        for scene in scenes:
             records = [r for r in scene.iterdir() if r.is_dir()]
-            record_num = len(records)
             type_dir = dst_dir / scene.name
             if not type_dir.exists():
                 type_dir.mkdir(parents=True)
-            for k, record in enumerate(records, 1):
-                print(f'\nProcessing record [{k:02d}/{record_num:02d}]: '
-                      f'{record.name}')
-                align_and_relabel_one_record(record, type_dir, sample_rate)
+            for record in records:
+                tasks.append((record, type_dir, sample_rate, force))
+
+    record_num = len(tasks)
+    print(f'\nProcessing {record_num} records with {workers} worker(s)')
+    counts = dict.fromkeys(['done', 'empty', 'skipped', 'failed'], 0)
+    processed_bytes = 0
+    failures = []
+    start = time.perf_counter()
+    if workers > 1:
+        pool = mp.Pool(workers)
+        results = pool.imap_unordered(align_and_relabel_record_task, tasks)
+    else:
+        pool = None
+        results = map(align_and_relabel_record_task, tasks)
+    for k, (record, status, src_bytes, error) in enumerate(results, 1):
+        counts[status] += 1
+        if status != 'skipped':
+            processed_bytes += src_bytes
+        if error is not None:
+            failures.append((record, error))
+        print(f'Record [{k:04d}/{record_num:04d}] {status}: {record.name}')
+    if pool is not None:
+        pool.close()
+        pool.join()
+    elapsed = time.perf_counter() - start
+
+    processed_num = record_num - counts['skipped']
+    print(f'\nDone in {elapsed:.1f} s: ' +
+          ', '.join(f'{k} {v}' for k, v in counts.items()))
+    if elapsed > 0:
+        print(f'Throughput: {processed_num / elapsed:.2f} records/s, '
+              f'{processed_bytes / 1e6 / elapsed:.2f} MB/s')
+    for record, error in failures:
+        print(f'Failed: {record}\n    {error}')
 
 
 @click.command()
 @click.argument('data-dir')
 @click.option('-s', '--save-dir')
-def main(data_dir, save_dir):
-    if save_dir is not None:
+@click.option('-b',
+              '--benchmark',
+              is_flag=True,
+              help='Benchmark sensor data align on the record of data-dir')
+@click.option('-j',
+              '--workers',
+              default=mp.cpu_count(),
+              help='Number of worker processes')
+@click.option('-f',
+              '--force',
+              is_flag=True,
+              help='Reprocess records whose output is up to date')
+def main(data_dir, save_dir, benchmark, workers, force):
+    if benchmark:
+        benchmark_align_sensor_data(Path(data_dir))
+    elif save_dir is not None:
         save_dir = Path(save_dir)
-        align_and_relabel_datasets(Path(data_dir), save_dir, DATASET_TO_USE)
+        align_and_relabel_datasets(Path(data_dir),
+                                   save_dir,
+                                   DATASET_TO_USE,
+                                   workers=workers,
+                                   force=force)
     else:
         align_and_relabel_one_record(Path(data_dir), Path('./'))
         print('Must set save dir by "-s or --save-dir"')
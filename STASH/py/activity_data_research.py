@@ -15,8 +15,10 @@ from scipy import signal
 from activity_data_labeler import (LABEL_DAILY, LABEL_ITEMS,
                                    LABEL_ITEMS_INDEX_DICT, LABEL_OTHER_SPORTS,
                                    label_convert_ts2index, load_label_result)
-from utils.common import ewma
+from utils.common import ewma, exception_point_process
+from utils.label_index import LabelIndex
 from utils.log import Log
+from utils.record_cache import read_csv_cached
 
 ACC_SUFFIX = 'accel-52HZ.csv'
 GYRO_SUFFIX = 'gyroscope-52HZ.csv'
@@ -111,20 +113,20 @@ def load_sensor_data_and_labels(record_dir):
     magnet_file = record_dir / f'{record_dir.name}-{MAGNET_SUFFIX}'
     label_file = record_dir / f'{record_dir.name}-{LABEL_SUFFIX}'
 
-    acc = pd.read_csv(acc_file)
+    acc = read_csv_cached(acc_file)
     acc = acc[:-1]  # Remove the last line, maybe one broken line
     acc_ts, acc_data = split_ts_and_data(acc)
-    gyro = pd.read_csv(gyro_file)
+    gyro = read_csv_cached(gyro_file)
     gyro = gyro[:-1]  # Remove the last line, maybe one broken line
     gyro_ts, gyro_data = split_ts_and_data(gyro)
-    magnet = pd.read_csv(magnet_file)
+    magnet = read_csv_cached(magnet_file)
     magnet = magnet[:-1]  # Remove the last line, maybe one broken line
     magnet_ts, magnet_data = split_ts_and_data(magnet)
 
-    labels_ts = load_label_result(label_file)
-    acc_labels_index = label_convert_ts2index(labels_ts, acc_ts)
-    gyro_labels_index = label_convert_ts2index(labels_ts, gyro_ts)
-    magnet_labels_index = label_convert_ts2index(labels_ts, magnet_ts)
+    label_index = LabelIndex(load_label_result(label_file))
+    acc_labels_index = label_index.to_index(acc_ts)
+    gyro_labels_index = label_index.to_index(gyro_ts)
+    magnet_labels_index = label_index.to_index(magnet_ts)
 
     ts = {
         'accel': acc_ts,
@@ -205,22 +207,6 @@ def split_ts_and_data(df, transpose_data=False):
     return ts, data
 
 
-def exception_point_process(data, inplace=False):
-    res = data
-    if not inplace:
-        res = data.copy()
-    max_idx = len(data) - 1
-    for i, d in enumerate(data):
-        if d > 80 or d < -80:
-            if i == 0:
-                res[i] = 0
-            elif i == max_idx:
-                res[i] = data[i - 1]
-            else:
-                res[i] = (data[i - 1] + data[i + 1]) / 2
-    return res
-
-
 def process_one_record(record_dir: Path):
     """Process one record
 
@@ -243,10 +229,10 @@ def process_one_record(record_dir: Path):
     pressure = pd.read_csv(pressure_file)
     _, pressure_data = split_ts_and_data(pressure, transpose_data=True)
 
-    labels_ts = load_label_result(label_file)
-    labels_index_acc = label_convert_ts2index(labels_ts, acc_ts)
-    labels_index_gyro = label_convert_ts2index(labels_ts, gyro_ts)
-    labels_index_magnet = label_convert_ts2index(labels_ts, magnet_ts)
+    label_index = LabelIndex(load_label_result(label_file))
+    labels_index_acc = label_index.to_index(acc_ts)
+    labels_index_gyro = label_index.to_index(gyro_ts)
+    labels_index_magnet = label_index.to_index(magnet_ts)
 
     # Check the label result
     plt.figure('IMU Sensor data')
@@ -9,15 +9,16 @@ from pathlib import Path
 import sys
 
 import click
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
 current_dir = Path(__file__).parent.resolve()
 project_dir = current_dir / '../../'
 sys.path.append(str(project_dir))
+from src.py.utils.mode_filter import SlidingModeFilter
 from src.py.utils.model_utils import GeneralModelPredictor
+from src.py.utils.record_cache import read_csv_cached
+from src.py.utils.ring_buffer import RingBuffer
 
 depolyment_dir = current_dir / '../../../ai-algorithm-depolyment/'
 if not depolyment_dir.exists():
@@ -37,62 +38,22 @@ HAR_TYPE_BIKE = 5
 HAR_TYPE_NUMTYPE = 6
 
 
-class ListQueue(object):
-    def __init__(self, capacity) -> None:
-        self._data = []
-        self.capacity = capacity
-
-    def append(self, value):
-        if len(self._data) >= self.capacity:
-            self._data.pop(0)
-        self._data.append(value)
-
-    def shift(self, shift_len):
-        if shift_len < self.capacity:
-            self._data = self._data[shift_len:]
-        else:
-            self._data.clear()
-
-    def get(self, idx):
-        return self._data[idx]
-
-    def get_data(self):
-        return self._data
-
-    def reset(self):
-        self._data.clear()
-
-    def __len__(self):
-        return len(self._data)
-
-    def size(self):
-        return len(self)
-
-    def is_full(self):
-        return self.size() >= self.capacity
-
-
 class ActivityVoter():
     def __init__(self, vote_len, vote_thres, activity_num=6) -> None:
         self._vote_len = vote_len
         self._vote_thres = vote_thres
-        self._buf = ListQueue(vote_len)
-        self.hist = np.zeros(activity_num)  # counting for activity type
+        self._filter = SlidingModeFilter(vote_len, activity_num)
         self.current_predict = 0
         self.current_activity = 0
         self.current_activity_score = 1.0
 
     def process(self, activity):
-        if self._buf.is_full():
-            old = self._buf.get(0)
-            self.hist[old] -= 1
-        self._buf.append(activity)
-        self.hist[activity] += 1
-
-        if self._buf.is_full():
-            max_idx = np.argmax(self.hist)
+        self._filter.process(activity)
+        if self._filter.is_full():
+            max_idx = self._filter.mode()
             self.current_activity = max_idx
-            self.current_activity_score = self.hist[max_idx] / self._vote_len
+            self.current_activity_score = self._filter.hist[
+                max_idx] / self._vote_len
             if self.current_activity_score >= self._vote_thres:  # tigger
                 self.current_predict = self.current_activity
 
@@ -101,8 +62,7 @@ class ActivityVoter():
             return HAR_TYPE_UNKNOWN
 
     def reset(self):
-        self._buf.reset()
-        self.hist.fill(0)
+        self._filter.reset()
         self.current_predict = 0
         self.current_activity = 0
         self.current_activity_score = 1.0
@@ -136,7 +96,7 @@ class ActivityRecognizer(SensorAlgo):
         self._fs = fs
         self._cnt = 0  # count points
         self._buf_len = int(win_len * self._fs)
-        self._data_buffer = ListQueue(self._buf_len)
+        self._data_buffer = RingBuffer(self._buf_len, channels=4)
         self._shift_len = int(shift * self._fs)
 
         self._model_predict = 0
@@ -177,7 +137,7 @@ class ActivityRecognizer(SensorAlgo):
         updated = False
         if self._data_buffer.is_full():
             self._cnt += 1
-            data = np.asarray(self._data_buffer.get_data())
+            data = self._data_buffer.get_data()
             data = data.reshape((1, 1, *data.shape))
             probs = self._model.predict(data)
             self._probs = probs[0]
@@ -217,7 +177,7 @@ class ActivityRecognizer(SensorAlgo):
         return self._model
 
     def process_file(self, file_path):  # process a file
-        df = pd.read_csv(file_path)
+        df = read_csv_cached(file_path)
         acc = df[['AccelX', 'AccelY', 'AccelZ']]
         predicts = {}  # dict of list
         for i, row in df.iterrows():
@@ -232,6 +192,210 @@ class ActivityRecognizer(SensorAlgo):
         result = pd.DataFrame.from_dict(predicts)
         return acc, result
 
+    def process_data_batch(self, df, batch_size=256):
+        """Offline version of feeding every row of df to `feed_data`
+
+        All the windows are built at once and predicted batch_size windows
+        per model call, the voter is then replayed over the predictions.
+        Starts from a reset state, gives one row per window like the
+        streaming path.
+        """
+        self.reset()
+        x = df['AccelX'].values.astype(float)
+        y = df['AccelY'].values.astype(float)
+        z = df['AccelZ'].values.astype(float)
+        acc_amp = np.sqrt(x * x + y * y + z * z)
+        data = np.column_stack((x, y, z, acc_amp)).astype(np.float32)
+
+        # The buffer is cleared when shifting more than its length, and
+        # without a shift a full buffer gives a window on every sample
+        stride = max(1, min(self._shift_len, self._buf_len))
+        if len(data) < self._buf_len:
+            return pd.DataFrame(columns=self._output_names)
+        windows = np.lib.stride_tricks.sliding_window_view(data,
+                                                           self._buf_len,
+                                                           axis=0)
+        windows = np.moveaxis(windows, -1, 1)[::stride]
+        window_num = len(windows)
+        last_idx = np.arange(window_num) * stride + self._buf_len - 1
+
+        probs = np.empty((window_num, self._num_classes))
+        for start in range(0, window_num, batch_size):
+            batch = np.ascontiguousarray(windows[start:start + batch_size])
+            batch = batch.reshape((len(batch), 1, *batch.shape[1:]))
+            probs[start:start + len(batch)] = self._model.predict(batch)
+        model_predicts = np.argmax(probs, axis=1)
+        predict_activities = np.asarray(
+            [self._voter.process(p) for p in model_predicts])
+
+        self._cnt = window_num
+        self._probs = probs[-1]
+        self._model_predict = model_predicts[-1]
+        self._predcit_activity = predict_activities[-1]
+
+        predicts = {
+            'EventTimestamp(ns)': df['EventTimestamp(ns)'].values[last_idx],
+            'Activity': df['Activity'].values[last_idx],
+        }
+        for i in range(self._num_classes):
+            predicts[f'Prob{i}'] = probs[:, i]
+        predicts['Predict'] = model_predicts
+        predicts['PredictActivity'] = predict_activities
+        result = pd.DataFrame.from_dict(predicts)
+        self._res = result.iloc[-1].to_dict()
+        return result
+
+    def process_file_batch(self, file_path, batch_size=256):
+        df = read_csv_cached(file_path)
+        acc = df[['AccelX', 'AccelY', 'AccelZ']]
+        result = self.process_data_batch(df, batch_size)
+        return acc, result
+
+
+class ActivityStream():
+    """Per stream state of `ActivitySessionManager`"""
+    def __init__(self, buf_len, vote_len, vote_threshold) -> None:
+        self.data_buffer = RingBuffer(buf_len, channels=4)
+        self.voter = ActivityVoter(vote_len, vote_threshold)
+        self.res = {}
+
+    def reset(self):
+        self.data_buffer.reset()
+        self.voter.reset()
+        self.res = {}
+
+
+class ActivitySessionManager():
+    """Run many independent ActivityRecognizer streams on one shared model
+
+    Samples are fed per stream id, every stream holds its own buffer and
+    voter. Windows ready across all the streams are queued and predicted
+    together in one micro batch per `tick`.
+    """
+    def __init__(self,
+                 model_file=KERAS_MODEL_FILE,
+                 win_len=8.0,
+                 shift=2.0,
+                 num_classes=6,
+                 fs=26,
+                 vote_len=15,
+                 vote_threshold=0.8,
+                 max_batch_size=256):
+        self._model = GeneralModelPredictor(model_file, 'keras')
+        self._fs = fs
+        self._buf_len = int(win_len * self._fs)
+        self._shift_len = int(shift * self._fs)
+        self._num_classes = num_classes
+        self._vote_len = vote_len
+        self._vote_threshold = vote_threshold
+
+        self._streams = {}
+        self._max_batch_size = max_batch_size
+        self._batch = np.zeros((max_batch_size, 1, self._buf_len, 4),
+                               dtype=np.float32)
+        self._pending = []  # (stream_id, timestamp, activity) of each window
+        self._results = []
+
+    def add_stream(self, stream_id):
+        if stream_id not in self._streams:
+            self._streams[stream_id] = ActivityStream(self._buf_len,
+                                                      self._vote_len,
+                                                      self._vote_threshold)
+        return self._streams[stream_id]
+
+    def remove_stream(self, stream_id):
+        self._streams.pop(stream_id, None)
+
+    def get_stream_ids(self):
+        return list(self._streams.keys())
+
+    def get_result(self, stream_id):
+        return self._streams[stream_id].res
+
+    def feed_data(self, stream_id, data_point):
+        """Feed one sample of a stream, returns True when a window queued
+
+        Queued windows are predicted by the next `tick`, it runs at once
+        when the micro batch is full.
+        """
+        stream = self.add_stream(stream_id)
+        acc_x = data_point['AccelX']
+        acc_y = data_point['AccelY']
+        acc_z = data_point['AccelZ']
+        acc_amp = math.sqrt(acc_x * acc_x + acc_y * acc_y + acc_z * acc_z)
+        stream.data_buffer.append([acc_x, acc_y, acc_z, acc_amp])
+
+        if not stream.data_buffer.is_full():
+            return False
+        if len(self._pending) >= self._max_batch_size:
+            self._predict_pending()
+        self._batch[len(self._pending), 0] = stream.data_buffer.get_data()
+        self._pending.append((stream_id, data_point['EventTimestamp(ns)'],
+                              data_point['Activity']))
+        stream.data_buffer.shift(self._shift_len)
+        return True
+
+    def tick(self):
+        """Predict all the queued windows in one batch
+
+        Returns
+        -------
+        list
+            (stream_id, result) of every window since the last tick in
+            feeding order, result has the same fields as
+            `ActivityRecognizer.get_result`
+        """
+        self._predict_pending()
+        results = self._results
+        self._results = []
+        return results
+
+    def _predict_pending(self):
+        if len(self._pending) == 0:
+            return
+        probs = self._model.predict(self._batch[:len(self._pending)])
+        for (stream_id, ts, activity), p in zip(self._pending, probs):
+            stream = self._streams.get(stream_id)
+            if stream is None:  # Removed after queued
+                continue
+            model_predict = np.argmax(p)
+            res = {'EventTimestamp(ns)': ts, 'Activity': activity}
+            for i in range(self._num_classes):
+                res[f'Prob{i}'] = p[i]
+            res['Predict'] = model_predict
+            res['PredictActivity'] = stream.voter.process(model_predict)
+            stream.res = res
+            self._results.append((stream_id, res))
+        self._pending.clear()
+
+    def process_files(self, file_paths, tick_len=1.0):
+        """Replay files as concurrent streams, ticking every tick_len seconds
+
+        Returns a dict from file path to its result DataFrame.
+        """
+        names = [
+            'EventTimestamp(ns)', 'AccelX', 'AccelY', 'AccelZ', 'Activity'
+        ]
+        records = {}
+        for file_path in file_paths:
+            df = read_csv_cached(file_path, usecols=names)
+            records[file_path] = {k: df[k].values for k in names}
+            self.add_stream(file_path)
+
+        predicts = {file_path: [] for file_path in file_paths}
+        tick_samples = max(1, int(tick_len * self._fs))
+        sample_num = max((len(r[names[0]]) for r in records.values()),
+                         default=0)
+        for start in range(0, sample_num, tick_samples):
+            for file_path, columns in records.items():
+                end = min(start + tick_samples, len(columns[names[0]]))
+                for i in range(start, end):
+                    data_point = {k: columns[k][i] for k in names}
+                    self.feed_data(file_path, data_point)
+            for file_path, res in self.tick():
+                predicts[file_path].append(res)
+        return {k: pd.DataFrame(v) for k, v in predicts.items()}
+
 
 def analysis_result(acc, result):
     print(result[340:360])
@@ -239,6 +403,9 @@ def analysis_result(acc, result):
     result_columns = ['Activity', 'Predict', 'PredictActivity']
     true_pred = result[result_columns]
     prob = result.drop(result_columns, axis='columns')
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+
     mpl.use('Qt5Agg')
     plt.figure()
     plt.subplot(311)
@@ -254,9 +421,16 @@ def analysis_result(acc, result):
 
 @click.command()
 @click.argument('file-path')
-def main(file_path):
+@click.option('-b',
+              '--batch-size',
+              default=0,
+              help='Predict windows in batches offline, 0 to stream samples')
+def main(file_path, batch_size):
     model = ActivityRecognizer()
-    acc, result = model.process_file(file_path)
+    if batch_size > 0:
+        acc, result = model.process_file_batch(file_path, batch_size)
+    else:
+        acc, result = model.process_file(file_path)
     analysis_result(acc, result)
 
 
@@ -24,6 +24,7 @@ from activity_data_labeler import (LABEL_DAILY, LABEL_ITEMS,
                                    LABEL_ITEMS_INDEX_DICT, LABEL_OTHER_SPORTS)
 from utils import log, plotting
 from utils.common import ewma, load_dataset
+from utils.mode_filter import sliding_window_counts
 from utils.model_utils import GeneralModelPredictor
 from utils.trainer import data_normalize, normalize_data, training
 
@@ -155,47 +156,11 @@ def prepare_training(train_dir, test_dir, train_cfg):
 
 
 def predicted_result_smooth(predicted_results, win_size):
-    smoothed = []
-    is_stabled = False
-    stable_y = 0
-    win = []
-    stat = np.zeros((len(ACTIVITY_TYPE), ))
-    for y in predicted_results:
-        # Logic 1
-        win.append(y)
-        if (len(win) > 20):
-            win.pop(0)
-        stat.fill(0)
-        for i in ACTIVITY_TYPE:
-            for t in win:
-                if t == i:
-                    stat[i] += 1
-        percent = stat / 20
-        is_stabled = False
-        for i, p in enumerate(percent):
-            if p > 0.8:
-                is_stabled = True
-                stable_y = i
-                break
-        if not is_stabled:
-            stable_y = 0
-
-        # Logic 2
-        # if py == y:
-        #     if not is_stabled:
-        #         cnt += 1
-        #         # TODO: Optimize the stable condition
-        #         if cnt >= 20:  # 10s
-        #             is_stabled = True
-        #             stable_y = y
-        # else:
-        #     is_stabled = False
-        #     cnt = 1
-        # py = y
-
-        # Update
-        smoothed.append(stable_y)
-    return np.asarray(smoothed)
+    """Class holding over 80% of the last 20 predictions, 0 if none"""
+    counts = sliding_window_counts(predicted_results, 20, len(ACTIVITY_TYPE))
+    percent = counts / 20
+    is_stabled = np.any(percent > 0.8, axis=1)
+    return np.where(is_stabled, np.argmax(percent, axis=1), 0)
 
 
 def evaluate_single_file(file_path: Path, win_size=210, stride=52):
@@ -6,8 +6,13 @@ from pathlib import Path
 import sys
 
 import numpy as np
+import pandas as pd
 
 current_dir = Path(__file__).parent.resolve()
+project_dir = current_dir / '../../'
+sys.path.append(str(project_dir))
+from src.py.utils.mode_filter import sliding_window_counts
+
 depolyment_dir = current_dir / '../../../ai-algorithm-depolyment/'
 if not depolyment_dir.exists():
     print(f'Warnning: ai-algorithm-depolyment not exits: {depolyment_dir}')
@@ -39,6 +44,21 @@ class HarStateMachine(Enum):
 TimeThd = [0, 600, 180, 180, 180, 600]
 
 
+def argmax_positive(probs):
+    """Row-wise `HarDetector.argmax`, the first maximum above 0, else 0"""
+    probs = np.asarray(probs)
+    return np.argmax(np.where(probs > 0, probs, 0), axis=-1)
+
+
+def padded_vote_counts(predicts, vote_len, num_classes):
+    """Vote histogram of the last vote_len predictions at every row
+
+    Rows before vote_len also count the zeros the buffer starts with.
+    """
+    padded = np.concatenate((np.zeros(vote_len - 1, dtype=int), predicts))
+    return sliding_window_counts(padded, vote_len, num_classes)[vote_len - 1:]
+
+
 class HarDetector(SensorAlgo):
     def __init__(self,
                  buf_len=30,
@@ -135,9 +155,88 @@ class HarDetector(SensorAlgo):
     def get_result(self):
         return self._res
 
+    def _check_batch_args(self, probs):
+        probs = np.asarray(probs, dtype=float)
+        if probs.ndim != 2 or probs.shape[1] < self._num_classes:
+            raise ValueError(f'Probs must be of shape (T, {self._num_classes})'
+                             f', got {probs.shape}')
+        if self._vote_len > self._buf_len:
+            raise ValueError('Batch replay needs vote_len <= buf_len')
+        return probs[:, :self._num_classes]
+
+    def _set_batch_state(self, predicts, timestamps):
+        """Leave the buffers as feed_data would after the last row"""
+        n = len(predicts)
+        self._buffer = np.zeros(self._buf_len, dtype=int)
+        tail = np.arange(max(0, n - self._buf_len), n)
+        self._buffer[tail % self._buf_len] = predicts[tail]
+        self._cnt = n
+        self._idx = n % self._buf_len
+        if n > 0 and timestamps is not None:
+            self._cur_timestamp = timestamps[-1]
+
+    def process_probs(self, probs, timestamps=None):
+        """Replay feed_data over all the rows of a probability array
+
+        The detector is reset first and holds the state after the last row
+        afterwards.
+
+        Parameters
+        ----------
+        probs : np.ndarray
+            Model probabilities of shape (T, num_classes)
+        timestamps : np.ndarray, optional
+            EventTimestamp(ns) of the rows
+
+        Returns
+        -------
+        np.ndarray
+            PredictActivity of every row
+        """
+        probs = self._check_batch_args(probs)
+        self.reset()
+        n = len(probs)
+        predicts = argmax_positive(probs)
+        activity = predicts.copy()
+        if n > self._vote_len:
+            counts = sliding_window_counts(predicts, self._vote_len,
+                                           self._num_classes)
+            candidates = np.argmax(counts, axis=1)
+            scores = counts[np.arange(n), candidates] / self._vote_len
+            # From vote_len on the activity only changes on a confident vote
+            update = scores >= self._vote_score_thd
+            update[:self._vote_len] = True
+            activity = np.where(np.arange(n) < self._vote_len, predicts,
+                                candidates)
+            last = np.maximum.accumulate(np.where(update, np.arange(n), 0))
+            activity = activity[last]
+        self._set_batch_state(predicts, timestamps)
+        if n > 0:
+            self._activity = activity[-1]
+        return activity
+
+    def process_data_batch(self, df: pd.DataFrame):
+        """Batch version of calling feed_data on every row of df"""
+        prob_names = [f'Prob{i}' for i in range(self._num_classes)]
+        ts = df['EventTimestamp(ns)'].values
+        predicts = self.process_probs(df[prob_names].values, ts)
+        res = {'EventTimestamp(ns)': ts}
+        if 'Activity' in self._output_names:
+            res['Activity'] = df['Activity'].values
+        res['PredictActivity'] = predicts
+        return pd.DataFrame(res)
+
 
 class HarDetectorFSM(HarDetector):
-    def __init__(self, buf_len=30, vote_len=10, num_classes=6, threds=None):
+    def __init__(self,
+                 buf_len=30,
+                 vote_len=10,
+                 num_classes=6,
+                 threds=None,
+                 vote_score_thd=0.8,
+                 time_thd=None):
+        self._vote_score_thd = vote_score_thd
+        self._time_thd = TimeThd if time_thd is None else time_thd
         self._buf_len = buf_len
         self._buffer = np.zeros(self._buf_len, dtype=int)
         self._cnt = 0
@@ -187,7 +286,8 @@ class HarDetectorFSM(HarDetector):
 
     def process_idle_state(self):
         cur_predict, vote_score = self.vote_majority(self._vote_len)
-        if cur_predict != ActivityType.Unknown.value and vote_score >= 0.8:
+        if (cur_predict != ActivityType.Unknown.value
+                and vote_score >= self._vote_score_thd):
             self._activity = cur_predict
             self._state = HarStateMachine.Prepare.value
             self._start_prepare_ts = self._cur_timestamp
@@ -197,20 +297,20 @@ class HarDetectorFSM(HarDetector):
 
     def process_prepare_state(self):
         vote_score = self.vote_candidate(self._activity, self._vote_len)
-        if vote_score < 0.8:
+        if vote_score < self._vote_score_thd:
             self._state = HarStateMachine.PrepareBreak.value
             self._start_break_ts = self._cur_timestamp
-        elif self._cur_timestamp - self._start_prepare_ts >= TimeThd[
+        elif self._cur_timestamp - self._start_prepare_ts >= self._time_thd[
                 self._activity] * 1000:
             self._state = HarStateMachine.Stable.value
 
     def process_preparebreak_state(self):
         vote_score = self.vote_candidate(self._activity, self._vote_len)
-        if vote_score >= 0.8:
+        if vote_score >= self._vote_score_thd:
             self._state = HarStateMachine.Prepare.value
         else:
             cur_predict, vote_score = self.vote_majority(self._vote_len)
-            if vote_score >= 0.8:
+            if vote_score >= self._vote_score_thd:
                 self._state = HarStateMachine.Prepare.value
                 self._activity = cur_predict
                 self._start_prepare_ts = self._cur_timestamp
@@ -220,17 +320,18 @@ class HarDetectorFSM(HarDetector):
 
     def process_stable_state(self):
         vote_score = self.vote_candidate(self._activity, self._vote_len)
-        if vote_score < 0.8:
+        if vote_score < self._vote_score_thd:
             self._state = HarStateMachine.StableBreak.value
             self._start_break_ts = self._cur_timestamp
 
     def process_stablebreak_state(self):
         vote_score = self.vote_candidate(self._activity, self._vote_len)
-        if vote_score >= 0.8:
+        if vote_score >= self._vote_score_thd:
             self._state = HarStateMachine.Stable.value
         else:
             cur_predict, vote_score = self.vote_majority(self._vote_len)
-            if vote_score >= 0.8 and cur_predict != ActivityType.Unknown.value:
+            if (vote_score >= self._vote_score_thd
+                    and cur_predict != ActivityType.Unknown.value):
                 self._state = HarStateMachine.Prepare.value
                 self._activity = cur_predict
                 self._start_prepare_ts = self._cur_timestamp
@@ -256,3 +357,95 @@ class HarDetectorFSM(HarDetector):
     def process(self, probs):
         self.update_predict_buffer(probs, self._idx)
         self.process_state_machine()
+
+    def process_probs(self, probs, timestamps):
+        """Replay feed_data over all the rows of a probability array
+
+        Votes of every row come from one sliding histogram, only the state
+        machine itself runs per row. The detector is reset first and holds
+        the state after the last row afterwards.
+
+        Parameters
+        ----------
+        probs : np.ndarray
+            Model probabilities of shape (T, num_classes)
+        timestamps : np.ndarray
+            EventTimestamp(ns) of the rows
+
+        Returns
+        -------
+        np.ndarray
+            PredictActivity of every row
+        """
+        probs = self._check_batch_args(probs)
+        self.reset()
+        n = len(probs)
+        predicts = argmax_positive(probs)
+        counts = padded_vote_counts(predicts, self._vote_len,
+                                    self._num_classes)
+        candidates = np.argmax(counts, axis=1)
+        scores = counts[np.arange(n), candidates] / self._vote_len
+
+        unknown = ActivityType.Unknown.value
+        idle = HarStateMachine.Idle.value
+        prepare = HarStateMachine.Prepare.value
+        prepare_break = HarStateMachine.PrepareBreak.value
+        stable = HarStateMachine.Stable.value
+        stable_break = HarStateMachine.StableBreak.value
+        thd = self._vote_score_thd
+        vote_len = self._vote_len
+        time_thd = [t * 1000 for t in self._time_thd]
+
+        activity = unknown
+        state = idle
+        prepare_ts = 0
+        break_ts = 0
+        res = np.empty(n, dtype=int)
+        for t, (ts, votes, candidate, score) in enumerate(
+                zip(timestamps, counts.tolist(), candidates.tolist(),
+                    scores.tolist())):
+            if state == idle:
+                if candidate != unknown and score >= thd:
+                    activity = candidate
+                    state = prepare
+                    prepare_ts = ts
+                else:
+                    activity = unknown
+            elif state == prepare:
+                if votes[activity] / vote_len < thd:
+                    state = prepare_break
+                    break_ts = ts
+                elif ts - prepare_ts >= time_thd[activity]:
+                    state = stable
+            elif state == prepare_break:
+                if votes[activity] / vote_len >= thd:
+                    state = prepare
+                elif score >= thd:
+                    state = prepare
+                    activity = candidate
+                    prepare_ts = ts
+                elif ts - prepare_ts >= 30 * 1000:
+                    state = idle
+                    activity = unknown
+            elif state == stable:
+                if votes[activity] / vote_len < thd:
+                    state = stable_break
+                    break_ts = ts
+            else:
+                if votes[activity] / vote_len >= thd:
+                    state = stable
+                elif score >= thd and candidate != unknown:
+                    state = prepare
+                    activity = candidate
+                    prepare_ts = ts
+                elif ts - break_ts >= 60 * 1000:
+                    state = idle
+                    activity = unknown
+            res[t] = activity
+
+        self._set_batch_state(predicts, timestamps)
+        self._activity = activity
+        self._state = state
+        self._start_prepare_ts = prepare_ts
+        self._start_break_ts = break_ts
+        return res
@@ -6,17 +6,14 @@ from pathlib import Path
 import sys
 
 import click
-from keras.models import load_model
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from scipy.special import softmax
 
 cur_dir = Path(__file__).parent.resolve()
 project_dir = cur_dir / '../../'
 sys.path.append(str(project_dir))
 from src.py.utils.model_utils import GeneralModelPredictor
+from src.py.utils.ring_buffer import RingBuffer
 
 depolyment_dir = cur_dir / '../../../ai-algorithm-depolyment/'
 if not depolyment_dir.exists():
@@ -153,6 +150,9 @@ class HarModel(SensorAlgo):
         acc = df[['AccelX', 'AccelY', 'AccelZ']]
         true_pred = result[['Activity', 'Predict']]
         prob = result.drop(['Activity', 'Predict'], axis='columns')
+        import matplotlib as mpl
+        import matplotlib.pyplot as plt
+
         mpl.use('Qt5Agg')
         plt.figure()
         plt.subplot(311)
@@ -218,7 +218,8 @@ class HarModelCNN(SensorAlgo):
         self._fs = fs
         self._cnt = 0  # count points
         self._buf_len = int(win_len * self._fs)
-        self._buffer = []
+        self._buffer = RingBuffer(self._buf_len, channels=channel)
+        self._lp = None  # low pass state of x, y, z
         self._channel = channel
         self._shift_len = int(shift * self._fs)
         self._idx = 0
@@ -229,7 +230,7 @@ class HarModelCNN(SensorAlgo):
         self._res = {}
 
     def normalize_data(self):
-        x = np.asarray(self._buffer).astype(np.float32)
+        x = self._buffer.get_data()
         x = (x - self._norm[0]) * self._norm[1]
         x = x.reshape(1, *x.shape)
         x = np.transpose(x, (0, 2, 1))
@@ -244,7 +245,8 @@ class HarModelCNN(SensorAlgo):
     def reset(self):
         self._init = False
         self._cnt = 0  # count points
-        self._buffer = []
+        self._buffer.reset()
+        self._lp = None
 
         self._idx = 0
         self._argmax = 0
@@ -260,9 +262,7 @@ class HarModelCNN(SensorAlgo):
         acc_z = data_point['AccelZ']
         activity_type = data_point['Activity']
         if self._init:
-            old_x = self._buffer[-1][3]
-            old_y = self._buffer[-1][4]
-            old_z = self._buffer[-1][5]
+            old_x, old_y, old_z = self._lp
             lp_x = old_x * self._alpha + (1 - self._alpha) * acc_x
             lp_y = old_y * self._alpha + (1 - self._alpha) * acc_y
             lp_z = old_z * self._alpha + (1 - self._alpha) * acc_z
@@ -272,17 +272,21 @@ class HarModelCNN(SensorAlgo):
             lp_z = acc_z
             self._init = True
 
+        self._lp = (lp_x, lp_y, lp_z)
         self._buffer.append([acc_x, acc_y, acc_z, lp_x, lp_y, lp_z])
 
         updated = False
-        if len(self._buffer) >= self._buf_len:
+        if self._buffer.is_full():
+            # scipy is only needed once a window is full
+            from scipy.special import softmax
+
             x = self.normalize_data()
             probs = self._model.predict(x)
             self._probs = softmax(np.squeeze(probs[0]))
             self._argmax = np.argmax(self._probs)
 
             updated = True
-            del self._buffer[:self._shift_len]
+            self._buffer.shift(self._shift_len)
 
             self._res = {
                 'EventTimestamp(ns)': self._cur_timestamp,
@@ -327,6 +331,9 @@ class HarModelCNN(SensorAlgo):
         acc = df[['AccelX', 'AccelY', 'AccelZ']]
         true_pred = result[['Activity', 'Predict']]
         prob = result.drop(['Activity', 'Predict'], axis='columns')
+        import matplotlib as mpl
+        import matplotlib.pyplot as plt
+
         mpl.use('Qt5Agg')
         plt.figure()
         plt.subplot(311)
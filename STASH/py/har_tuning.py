@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: Farmer Li
+# @Date: 2021-03-18
+
+import hashlib
+import itertools
+import multiprocessing as mp
+import os
+from pathlib import Path
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+# activity_recognizer and har_det need the ai-algorithm-depolyment repo,
+# they are imported where the model or the FSM is run
+from utils.common import labels_to_category_idx
+from utils.mode_filter import sliding_window_counts
+from utils.record_cache import record_cache_key
+
+PROBS_CACHE_DIR = Path('.cache/probs')
+# Bumped when what is cached changes, labels are category indices since 2
+PROBS_CACHE_VERSION = 2
+
+# Per-record statistics of one setting, summed over records
+STATS_NAMES = [
+    'windows', 'correct', 'detected', 'latency_s', 'flips', 'duration_s'
+]
+
+
+def file_digest(file_path: Path):
+    h = hashlib.sha1()
+    with Path(file_path).open('rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def probs_cache_file(record_file: Path,
+                     model_digest: str,
+                     cache_dir=PROBS_CACHE_DIR):
+    key = (f'{PROBS_CACHE_VERSION}|{model_digest}|'
+           f'{record_cache_key(record_file)}')
+    key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return Path(cache_dir) / key[:2] / f'{key}.npz'
+
+
+def cache_record_probs(record_file: Path,
+                       recognizer: 'ActivityRecognizer',
+                       model_digest: str,
+                       cache_dir=PROBS_CACHE_DIR):
+    """Run the model over a record once, cache the per-window outputs
+
+    Labels are cached as category indices like the model outputs, -1 for
+    the windows without a category.
+    """
+    dst_file = probs_cache_file(record_file, model_digest, cache_dir)
+    if dst_file.exists():
+        return dst_file
+    _, result = recognizer.process_file_batch(record_file)
+    prob_names = [c for c in result.columns if c.startswith('Prob')]
+    dst_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = dst_file.with_name(f'{dst_file.stem}.{os.getpid()}.tmp.npz')
+    np.savez(tmp_file,
+             ts=result['EventTimestamp(ns)'].values.astype(np.int64),
+             labels=labels_to_category_idx(result['Activity'].values),
+             probs=result[prob_names].values.astype(np.float32))
+    tmp_file.replace(dst_file)
+    return dst_file
+
+
+def replay_activity_voter(model_predicts,
+                          vote_len,
+                          vote_threshold,
+                          num_classes=6):
+    """Output of `ActivityVoter.process` over a sequence of model predicts"""
+    from activity_recognizer import HAR_TYPE_UNKNOWN
+
+    n = len(model_predicts)
+    counts = sliding_window_counts(model_predicts, vote_len, num_classes)
+    candidates = np.argmax(counts, axis=1)
+    scores = counts[np.arange(n), candidates] / vote_len
+    full = np.arange(n) >= vote_len - 1
+    update = full & (scores >= vote_threshold)
+    last = np.maximum.accumulate(np.where(update, np.arange(n), -1))
+    res = np.where(last >= 0, candidates[np.maximum(last, 0)], 0)
+    res[~full] = HAR_TYPE_UNKNOWN
+    return res
+
+
+def replay_setting(probs, ts, setting):
+    if setting['method'] == 'voter':
+        return replay_activity_voter(np.argmax(probs, axis=1),
+                                     setting['vote_len'],
+                                     setting['vote_threshold'],
+                                     probs.shape[1])
+    elif setting['method'] == 'fsm':
+        from har_det import HarDetectorFSM, TimeThd
+
+        time_thd = [t * setting['time_scale'] for t in TimeThd]
+        det = HarDetectorFSM(buf_len=max(30, setting['vote_len']),
+                             vote_len=setting['vote_len'],
+                             num_classes=probs.shape[1],
+                             vote_score_thd=setting['vote_threshold'],
+                             time_thd=time_thd)
+        return det.process_probs(probs, ts)
+    raise ValueError(f'Unknown method: {setting["method"]}')
+
+
+def evaluate_predicts(ts, labels, predicts):
+    """Statistics of one record in the order of STATS_NAMES
+
+    Only the windows with a category label (>= 0) are scored. Latency is the
+    time from the first of them to the first prediction matching its label,
+    flips count changes of the prediction.
+    """
+    stats = np.zeros(len(STATS_NAMES))
+    if len(ts) == 0:
+        return stats
+    labelled = labels >= 0
+    hits = np.nonzero((predicts == labels) & labelled)[0]
+    stats[0] = np.count_nonzero(labelled)
+    stats[1] = len(hits)
+    if len(hits) > 0:
+        stats[2] = 1
+        stats[3] = (ts[hits[0]] - ts[np.argmax(labelled)]) / 1e9
+    stats[4] = np.count_nonzero(predicts[1:] != predicts[:-1])
+    stats[5] = (ts[-1] - ts[0]) / 1e9
+    return stats
+
+
+def evaluate_record_task(task):
+    """Process pool task, statistics of every setting on one record"""
+    cache_file, settings = task
+    with np.load(cache_file) as f:
+        ts, labels, probs = f['ts'], f['labels'], f['probs']
+    res = np.zeros((len(settings), len(STATS_NAMES)))
+    for i, setting in enumerate(settings):
+        res[i] = evaluate_predicts(ts, labels,
+                                   replay_setting(probs, ts, setting))
+    return res
+
+
+def make_grid(methods, vote_lens, vote_thresholds, time_scales):
+    settings = []
+    for method in methods:
+        scales = time_scales if method == 'fsm' else [1.0]
+        for vote_len, thd, scale in itertools.product(vote_lens,
+                                                      vote_thresholds,
+                                                      scales):
+            settings.append({
+                'method': method,
+                'vote_len': vote_len,
+                'vote_threshold': thd,
+                'time_scale': scale
+            })
+    return settings
+
+
+def grid_search(cache_files, settings, workers=1):
+    """Evaluate every setting on every cached record
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per setting with accuracy, detected ratio, mean latency to
+        the first correct detection and flips per hour, best accuracy first
+    """
+    total = np.zeros((len(settings), len(STATS_NAMES)))
+    tasks = [(f, settings) for f in cache_files]
+    with mp.Pool(workers) as pool:
+        for res in pool.imap_unordered(evaluate_record_task, tasks):
+            total += res
+    stats = pd.DataFrame(total, columns=STATS_NAMES)
+    result = pd.DataFrame(settings)
+    result['accuracy'] = stats['correct'] / stats['windows']
+    result['detected'] = stats['detected'] / max(len(cache_files), 1)
+    result['latency_s'] = stats['latency_s'] / stats['detected']
+    result['flips_per_hour'] = stats['flips'] / (stats['duration_s'] / 3600)
+    return result.sort_values('accuracy', ascending=False, ignore_index=True)
+
+
+def parse_list(text, dtype=float):
+    return [dtype(v) for v in text.split(',')]
+
+
+@click.command()
+@click.argument('data-dir')
+@click.option('-m',
+              '--model-file',
+              default=None,
+              help='KERAS_MODEL_FILE of activity_recognizer by default')
+@click.option('-c', '--cache-dir', default=str(PROBS_CACHE_DIR))
+@click.option('-j', '--workers', default=mp.cpu_count())
+@click.option('--methods', default='voter,fsm')
+@click.option('--vote-lens', default='5,10,15,20,25,30')
+@click.option('--thresholds', default='0.5,0.6,0.7,0.8,0.9')
+@click.option('--time-scales',
+              default='0.5,1.0,2.0',
+              help='Scales of TimeThd, FSM only')
+@click.option('-o', '--output', default='har_tuning.csv')
+@click.option('-n', '--top', default=10)
+def main(data_dir, model_file, cache_dir, workers, methods, vote_lens,
+         thresholds, time_scales, output, top):
+    from activity_recognizer import KERAS_MODEL_FILE, ActivityRecognizer
+
+    if model_file is None:
+        model_file = KERAS_MODEL_FILE
+    record_files = sorted(Path(data_dir).rglob('*.csv'))
+    model_digest = file_digest(model_file)
+    recognizer = None
+    cache_files = []
+    start = time.perf_counter()
+    for i, record_file in enumerate(record_files, 1):
+        cache_file = probs_cache_file(record_file, model_digest, cache_dir)
+        if not cache_file.exists():
+            print(f'Predicting [{i:04d}/{len(record_files):04d}]: '
+                  f'{record_file}')
+            if recognizer is None:
+                recognizer = ActivityRecognizer(model_file)
+            cache_record_probs(record_file, recognizer, model_digest,
+                               cache_dir)
+        cache_files.append(cache_file)
+    print(f'Probabilities of {len(cache_files)} records ready in '
+          f'{time.perf_counter() - start:.1f} s')
+
+    settings = make_grid(methods.split(','), parse_list(vote_lens, int),
+                         parse_list(thresholds), parse_list(time_scales))
+    start = time.perf_counter()
+    result = grid_search(cache_files, settings, workers)
+    print(f'Evaluated {len(settings)} settings in '
+          f'{time.perf_counter() - start:.1f} s')
+    print(result.head(top).to_string())
+    result.to_csv(output, index=False)
+    print(f'Saved all settings to: {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -15,18 +15,99 @@ UNDEFINED = 0
 INDOOR = 1
 OUTDOOR = 2
 
+# GSV talker to (first satellite ID, number of satellite slots)
+GSV_CONSTELLATIONS = {
+    'GP': (1, SATELLITE_MAX),  # GPS
+    'GL': (65, 32),  # GLONASS
+    'GA': (1, 36),  # Galileo
+    'GB': (1, 64),  # BeiDou
+}
+DEFAULT_CONSTELLATIONS = ('GP', )
+
+
+def satellite_slots(constellations=DEFAULT_CONSTELLATIONS):
+    """Slot layout of the satellites of several constellations
+
+    Returns
+    -------
+    tuple
+        (slots, total), slots maps a talker to (first ID, count, offset).
+        Satellite `id` of a talker is stored at slot offset + id - first,
+        GPS comes first so GPS slots equal the satellite IDs minus 1.
+    """
+    slots = {}
+    total = 0
+    for name in GSV_CONSTELLATIONS:
+        if name in constellations:
+            first, cnt = GSV_CONSTELLATIONS[name]
+            slots[name] = (first, cnt, total)
+            total += cnt
+    unknown = set(constellations) - set(slots)
+    if unknown:
+        raise ValueError(f'Unknown GSV talkers: {sorted(unknown)}')
+    return slots, total
+
+
+def parse_gsv_sentence(sentence: str, slots=None):
+    """Satellite slot numbers (1-based) and SNRs of a GSV sentence
+
+    Sentences of talkers not in slots give empty lists, as do the ones
+    without satellites. Satellite IDs outside of the constellation range
+    are skipped, a checksum attached to the last SNR field is ignored.
+    """
+    if slots is None:
+        slots = DEFAULT_SLOTS
+    if sentence[3:7] != 'GSV,' or sentence[1:3] not in slots:
+        return [], []
+    first, cnt, offset = slots[sentence[1:3]]
+    fields = sentence.split(',')
+    try:
+        if int(fields[3]) <= 0:
+            return [], []
+    except (ValueError, IndexError):
+        return [], []
+    ids = []
+    snrs = []
+    for s_id, snr in zip(fields[4::4], fields[7::4]):
+        if s_id == '':
+            continue
+        idx = int(s_id) - first
+        if idx < 0 or idx >= cnt:
+            continue
+        snr = snr.split('*', 1)[0]
+        ids.append(offset + idx + 1)
+        snrs.append(int(snr) if snr != '' else 0)
+    return ids, snrs
+
+
+DEFAULT_SLOTS, _ = satellite_slots()
+
 
 class IndoorOutdoorRecognizer():
+    """Indoor/outdoor status from the SNRs of the satellites in view
+
+    Every satellite has a slot in `snrs` holding its last SNR in the
+    current window. A window closes on the first sentence more than
+    win_duration_ms after the previous one, the status is OUTDOOR when
+    enough satellites with enough total SNR were seen.
+
+    Parameters
+    ----------
+    constellations : tuple, optional
+        GSV talkers to use, any of GSV_CONSTELLATIONS, GPS only by default
+    """
     def __init__(self,
                  threshold_satellite_cnt=THRESHOLD_SATELLITE_CNT,
                  threshold_snr_sum=THRESHOLD_SNR_SUM,
-                 win_duration_ms=RECOGNIZE_WIN_DURATION_MS):
+                 win_duration_ms=RECOGNIZE_WIN_DURATION_MS,
+                 constellations=DEFAULT_CONSTELLATIONS):
         self.threshold_satellite_cnt = threshold_satellite_cnt
         self.threshold_snr_sum = threshold_snr_sum
         self.indoor_outdoor_width_ms = win_duration_ms
+        self.slots, self.satellite_max = satellite_slots(constellations)
 
         self.update_timestamp_ms = 0
-        self.snrs = np.zeros(SATELLITE_MAX).astype(np.int)
+        self.snrs = np.zeros(self.satellite_max, dtype=int)
         self._status = UNDEFINED
         self.satellite_num = 0
         self.snr_sum = 0
@@ -43,75 +124,26 @@ class IndoorOutdoorRecognizer():
     def _reset_recognize_status(self):
         self.snrs.fill(0)
 
-    def _parse_gpgsv_sentence(self, gpgsv_sentence: str) -> tuple:
+    def _parse_gsv_sentence(self, gsv_sentence: str) -> tuple:
         # Exmaple： $GPGSV,1,1,03,13,00,000,29,15,00,000,34,30,00,000,19,1*56
-        error_return = ([], [])
-        if len(gpgsv_sentence) == 0:
-            return error_return
-
-        fields = gpgsv_sentence.split(',')
-        if (fields[0] != "$GPGSV"):
-            return error_return
-
-        field_cnt = len(fields)
-        field_idx = 0
-        try:
-            id_num = int(fields[3])
-        except ValueError:
-            return error_return
-
-        if id_num <= 0:
-            return error_return
-
-        field_idx = 4
-        ids = []
-        snrs = []
-        while (True):
-            if (field_idx >= field_cnt):
-                break
-            s_id = fields[field_idx]
-            field_idx += 3
-            if (field_idx >= field_cnt):
-                break
-            snr = fields[field_idx]
-            field_idx += 1
-
-            if (s_id == ''):
-                continue
-            if (snr == ''):
-                snr = 0
+        return parse_gsv_sentence(gsv_sentence, self.slots)
 
-            ids.append(int(s_id))
-            snrs.append(int(snr))
+    def _update_gsv_info(self, num, snr) -> None:
+        assert (1 <= num <= self.satellite_max)
+        assert (snr >= 0)
+        self.snrs[num - 1] = snr
 
-        return ids, snrs
-
-    def _update_gpgsv_info(self, num, snr) -> None:
-        assert (1 <= num <= 32)
-        num -= 1
-        if (snr >= 0):
-            self.snrs[num] = snr
-        else:
-            assert (snr >= 0)
+    def _status_of(self, snr_cnt, snr_sum):
+        if (snr_cnt >= self.threshold_satellite_cnt
+                and snr_sum >= self.threshold_snr_sum):
+            return OUTDOOR
+        return INDOOR
 
     def _classify(self):
-        # print(f'Current satellite info arr: {self.snrs}')
-        snr_cnt = 0
-        snr_sum = 0
-        for snr in self.snrs:
-            if snr > 0:
-                snr_cnt += 1
-                snr_sum += snr
-
-        if (snr_cnt >= THRESHOLD_SATELLITE_CNT
-                and snr_sum >= THRESHOLD_SNR_SUM):
-            self._status = OUTDOOR
-        else:
-            self._status = INDOOR
-
-        self.satellite_num = snr_cnt
-        self.snr_sum = snr_sum
-        # print(f'Classify jugements: {self.satellite_num}, {self.snr_sum}\n')
+        visible = self.snrs > 0
+        self.satellite_num = int(np.count_nonzero(visible))
+        self.snr_sum = int(self.snrs[visible].sum())
+        self._status = self._status_of(self.satellite_num, self.snr_sum)
 
     def process(self, timestamp_ms: int, ids: list, snrs: list) -> None:
         if (self.update_timestamp_ms == 0):
@@ -123,15 +155,15 @@ class IndoorOutdoorRecognizer():
 
         ids_len, snrs_len = len(ids), len(snrs)
         assert (ids_len == snrs_len)
-        assert (ids_len <= SATELLITE_MAX)
+        assert (ids_len <= self.satellite_max)
 
         for i in range(ids_len):
             num, snr = ids[i], snrs[i]
-            self._update_gpgsv_info(num, snr)
+            self._update_gsv_info(num, snr)
 
         update = False
         if (timestamp_ms - self.update_timestamp_ms >
-                RECOGNIZE_WIN_DURATION_MS):
+                self.indoor_outdoor_width_ms):
             update = True
             self.update_timestamp_ms = timestamp_ms
             self._classify()
@@ -139,8 +171,97 @@ class IndoorOutdoorRecognizer():
 
         return update
 
+    def _window_bounds(self, timestamps):
+        """Rows closing a window, as the streaming path would find them"""
+        # The first row above a threshold is also the first row where the
+        # running maximum is above it, and the running maximum is sorted
+        ts_max = np.maximum.accumulate(timestamps)
+        bounds = []
+        update_ts = self.update_timestamp_ms
+        start = 0
+        while True:
+            i = start + np.searchsorted(
+                ts_max[start:], update_ts + self.indoor_outdoor_width_ms,
+                side='right')
+            if i >= len(timestamps):
+                break
+            bounds.append(i)
+            update_ts = timestamps[i]
+            start = i + 1
+        return np.asarray(bounds, dtype=int)
+
+    def process_many(self, timestamps, ids, snrs):
+        """Batch version of calling process on every row
+
+        Parameters
+        ----------
+        timestamps : np.ndarray
+            Timestamps in ms of shape (T, )
+        ids : np.ndarray
+            Satellite slot numbers (1-based) of shape (T, W), 0 for none
+        snrs : np.ndarray
+            SNRs of shape (T, W)
+
+        Returns
+        -------
+        tuple
+            (update_idx, status, satellite_num, snr_sum), rows where
+            process would return True and the outputs after each of them
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        n = len(timestamps)
+        if n == 0:
+            empty = np.zeros(0, dtype=int)
+            return empty, empty, empty, empty
+        ids = np.asarray(ids, dtype=int).reshape(n, -1)
+        snrs = np.asarray(snrs, dtype=int).reshape(n, -1)
+        if self.update_timestamp_ms == 0:
+            self.update_timestamp_ms = int(timestamps[0])
+
+        bounds = self._window_bounds(timestamps)
+        # Window of every row, window k closes at row bounds[k] and the
+        # last one is still open
+        starts = np.zeros(n + 1, dtype=int)
+        starts[bounds + 1] = 1
+        window = np.cumsum(starts[:n])
+        window_ts = np.concatenate(
+            ([self.update_timestamp_ms], timestamps[bounds]))
+        # Rows before the update timestamp of their window are dropped
+        row_ok = timestamps >= window_ts[window]
+
+        rows, cols = np.nonzero((ids > 0) & row_ok[:, None])
+        slot = ids[rows, cols] - 1
+        value = snrs[rows, cols]
+        if np.any(slot >= self.satellite_max) or np.any(value < 0):
+            raise ValueError('Invalid satellite slot or SNR')
+        # Last SNR of every slot in every window
+        key = (window[rows] * self.satellite_max + slot)[::-1]
+        key, last = np.unique(key, return_index=True)
+        value = value[::-1][last]
+        key_window, key_slot = np.divmod(key, self.satellite_max)
+
+        num_windows = len(bounds) + 1
+        state = np.zeros((num_windows, self.satellite_max), dtype=int)
+        state[0] = self.snrs
+        state[key_window, key_slot] = value
+        visible = state > 0
+        satellite_num = np.count_nonzero(visible, axis=1)
+        snr_sum = np.where(visible, state, 0).sum(axis=1)
+        status = np.where(
+            (satellite_num >= self.threshold_satellite_cnt) &
+            (snr_sum >= self.threshold_snr_sum), OUTDOOR, INDOOR)
+
+        # The last window stays open
+        if len(bounds) > 0:
+            self.update_timestamp_ms = int(timestamps[bounds[-1]])
+            self._status = int(status[-2])
+            self.satellite_num = int(satellite_num[-2])
+            self.snr_sum = int(snr_sum[-2])
+        self.snrs[:] = state[-1]
+        return bounds, status[:-1], satellite_num[:-1], snr_sum[:-1]
+
     def process_with_raw_nmea_sentence(self, ts, nmea_sentence: str):
-        nums, snrs = self._parse_gpgsv_sentence(nmea_sentence)
+        nums, snrs = self._parse_gsv_sentence(nmea_sentence)
         return self.process(ts, nums, snrs)
 
     def feed_data(self, data_point):
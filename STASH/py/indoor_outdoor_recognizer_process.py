@@ -12,6 +12,8 @@ from multiprocessing import Pool
 import shutil
 import click
 import datetime
+import functools
+import time
 
 import numpy as np
 import pandas as pd
@@ -22,6 +24,7 @@ import matplotlib.ticker as ticker
 from pathlib import Path
 
 from indoor_outdoor_recognizer import IndoorOutdoorRecognizer
+from nmea_reader import GsvChunkDecoder, iter_nmea_records
 
 HEADER_LINES_TO_SKIP = 2
 
@@ -46,6 +49,9 @@ INDOOR_OUTDOOR_RECOGNIZATION_PNG_DIR = Path(
     './src/data/indoor_outdoor_recognization_png')
 
 REPORT_FILE_HEADER = 'nmea_file,C11,C12,C21,C22\n'
+CM_COLUMNS = ['C11', 'C12', 'C21', 'C22']
+SUMMARY_FILE_PATH = INDOOR_OUTDOOR_RECOGNIZATION_REPORT_DIR.parent / (
+    'indoor_outdoor_recognization_summary.csv')
 
 
 def get_indoor_outdoor_label_from_buffer(indoor_outdoor_buffer: list) -> int:
@@ -84,30 +90,59 @@ def get_preprocessed_nmea_df(nmea_file_path: Path,
 
 
 def nmea_file_recognization(nmea_file_path: Path,
-                            is_raw_nmea_file=False) -> pd.DataFrame:
-
-    recognizer = IndoorOutdoorRecognizer()
-
-    nmea_file_df = get_preprocessed_nmea_df(nmea_file_path, is_raw_nmea_file)
+                            is_raw_nmea_file=False,
+                            chunk_size=4096,
+                            constellations=('GP', )) -> pd.DataFrame:
+    """Run the recognizer over the file chunk by chunk
+
+    Only GSV sentences are parsed, the others just advance the clock. The
+    label of a window is OUTDOOR if any of its rows is, else INDOOR if any
+    is, else UNKNOW.
+    """
+    recognizer = IndoorOutdoorRecognizer(constellations=constellations)
+    decoder = GsvChunkDecoder(chunk_size, recognizer.slots)
 
     results = []
-    indoor_outdoor_buffer = []
-    for i, row in nmea_file_df.iterrows():
-        timestamp = int(row['EventTimestamp(ms)'])
-        indoor_outdoor_buffer.append(int(row['IndoorOutdoor']))
-        update = recognizer.feed_data(row)
-        if update:
-            indoor_outdoor_predict = recognizer.get_status()
-            satel_num, satel_snr_sum = recognizer.get_satellite_status()
-            indoor_outdoor_label = get_indoor_outdoor_label_from_buffer(
-                indoor_outdoor_buffer)
-            indoor_outdoor_buffer.clear()
-
-            result = (timestamp, satel_num, satel_snr_sum,
-                      indoor_outdoor_predict, indoor_outdoor_label)
-            results.append(result)
-
-    return pd.DataFrame(results, columns=NMEA_FILE_REPORT_COLUMNS)
+    has_indoor, has_outdoor = False, False
+    for records in iter_nmea_records(nmea_file_path, is_raw_nmea_file,
+                                     chunk_size):
+        n = decoder.decode(records)
+        labels = decoder.labels[:n]
+        update_idx, status, satel_num, satel_snr_sum = \
+            recognizer.process_many(decoder.ets[:n], decoder.ids[:n],
+                                    decoder.snrs[:n])
+
+        # Label rows seen up to every update, since the previous one
+        indoor_cnt = np.cumsum(labels == INDOOR)[update_idx]
+        outdoor_cnt = np.cumsum(labels == OUTDOOR)[update_idx]
+        window_indoor = np.diff(indoor_cnt, prepend=0) > 0
+        window_outdoor = np.diff(outdoor_cnt, prepend=0) > 0
+        if len(update_idx) > 0:
+            window_indoor[0] |= has_indoor
+            window_outdoor[0] |= has_outdoor
+            has_indoor = has_outdoor = False
+            rest = labels[update_idx[-1] + 1:]
+        else:
+            rest = labels
+        has_indoor = has_indoor or bool(np.any(rest == INDOOR))
+        has_outdoor = has_outdoor or bool(np.any(rest == OUTDOOR))
+        window_labels = np.where(window_outdoor, OUTDOOR,
+                                 np.where(window_indoor, INDOOR, UNKNOW))
+
+        results.append(
+            pd.DataFrame(
+                {
+                    'EventTimestamp(ms)': decoder.ets[update_idx],
+                    'num': satel_num,
+                    'snr_sum': satel_snr_sum,
+                    'indoor_outdoor_predict': status,
+                    'indoor_outdoor_label': window_labels
+                },
+                columns=NMEA_FILE_REPORT_COLUMNS))
+
+    if len(results) == 0:
+        return pd.DataFrame([], columns=NMEA_FILE_REPORT_COLUMNS)
+    return pd.concat(results, ignore_index=True)
 
 
 def indoor_outdoor_recognization_confusion_matrix(results: pd.DataFrame):
@@ -196,8 +231,8 @@ def plot_indoor_outdoor_reports(results: pd.DataFrame, nmea_file_path: Path,
         sport = str(nmea_file_path.name).split('-')[0]
         fig_parent = INDOOR_OUTDOOR_RECOGNIZATION_PNG_DIR / sport
 
-        if not fig_parent.exists():
-            fig_parent.mkdir(parents=True)
+        # Several workers may create it at once
+        fig_parent.mkdir(parents=True, exist_ok=True)
 
         fig_path = fig_parent / (nmea_file_path.stem + '.png')
 
@@ -216,12 +251,15 @@ def process_nmea_file(nmea_file_path: Path,
                       is_raw_nmea_file=False,
                       is_report_cm=False,
                       is_write_cm=False,
-                      job_num=0):
+                      job_num=0,
+                      constellations=('GP', )):
     print(f'Processing job_num {job_num}: {nmea_file_path.name}')
 
     nmea_file_path = Path(nmea_file_path)
 
-    results = nmea_file_recognization(nmea_file_path, is_raw_nmea_file)
+    results = nmea_file_recognization(nmea_file_path,
+                                      is_raw_nmea_file,
+                                      constellations=constellations)
 
     if is_plot:
         plot_indoor_outdoor_reports(results, nmea_file_path, is_save_plt)
@@ -232,6 +270,122 @@ def process_nmea_file(nmea_file_path: Path,
             write_confusion_matrix(cm, nmea_file_path)
 
 
+def init_headless_worker():
+    # Workers only save figures, there is no display to show them on
+    plt.switch_backend('Agg')
+
+
+def evaluate_nmea_file(task):
+    """Process pool task, confusion matrix counts of one file
+
+    Returns
+    -------
+    tuple
+        (nmea_file_path, cm, error), cm is None and error the message of
+        the exception when the file failed
+    """
+    recognize, nmea_file_path, is_raw_nmea_file, is_save_plt = task
+    try:
+        results = recognize(nmea_file_path, is_raw_nmea_file)
+        if is_save_plt:
+            plot_indoor_outdoor_reports(results, nmea_file_path, True)
+        cm = indoor_outdoor_recognization_confusion_matrix(results)
+    except Exception as e:
+        # One broken file must not abort the whole directory
+        return nmea_file_path, None, f'{type(e).__name__}: {e}'
+    return nmea_file_path, cm, None
+
+
+def evaluate_nmea_dir(nmea_file_paths,
+                      is_raw_nmea_file=False,
+                      is_save_plt=False,
+                      is_write_cm=False,
+                      workers=None,
+                      recognize=nmea_file_recognization) -> tuple:
+    """Evaluate NMEA files in a process pool
+
+    Counts of every file are streamed back as soon as it is done, the
+    per-sport report files are written from this process only. recognize
+    is called as recognize(nmea_file_path, is_raw_nmea_file) in the workers,
+    it must be picklable.
+
+    Returns
+    -------
+    tuple
+        (cms, failures), cms has one row per evaluated file with its sport
+        and C11, C12, C21, C22 counts, failures one row per failed file with
+        its error
+    """
+    nmea_file_paths = [Path(p) for p in nmea_file_paths]
+    tasks = [(recognize, path, is_raw_nmea_file, is_save_plt)
+             for path in nmea_file_paths]
+    total = len(tasks)
+    rows = []
+    failed_rows = []
+    with Pool(workers, initializer=init_headless_worker) as pool:
+        for i, (nmea_file_path, cm, error) in enumerate(
+                pool.imap_unordered(evaluate_nmea_file, tasks), 1):
+            if cm is None:
+                print(f'Failed [{i:04d}/{total:04d}]: {nmea_file_path.name}, '
+                      f'{error}')
+                failed_rows.append([str(nmea_file_path), error])
+                continue
+            print(f'Processed [{i:04d}/{total:04d}]: {nmea_file_path.name}, '
+                  f'cm = {cm.tolist()}')
+            if is_write_cm:
+                write_confusion_matrix(cm, nmea_file_path)
+            sport = nmea_file_path.name.split('-')[0]
+            rows.append([str(nmea_file_path), sport] + cm.tolist())
+    cms = pd.DataFrame(rows, columns=['nmea_file', 'sport'] + CM_COLUMNS)
+    failures = pd.DataFrame(failed_rows, columns=['nmea_file', 'error'])
+    return (cms.sort_values('nmea_file', ignore_index=True),
+            failures.sort_values('nmea_file', ignore_index=True))
+
+
+def summarize_confusion_matrices(cms: pd.DataFrame) -> pd.DataFrame:
+    """Confusion matrix of every sport and of all files, with recalls"""
+    summary = cms.groupby('sport')[CM_COLUMNS].sum()
+    summary.loc['all'] = summary.sum()
+    summary.insert(0, 'files', cms.groupby('sport').size())
+    summary.loc['all', 'files'] = len(cms)
+    c11, c12, c21, c22 = (summary[c].astype(float) for c in CM_COLUMNS)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary['indoor_recall'] = c11 / (c11 + c12)
+        summary['outdoor_recall'] = c22 / (c21 + c22)
+        summary['accuracy'] = (c11 + c22) / (c11 + c12 + c21 + c22)
+    summary['files'] = summary['files'].astype(int)
+    return summary
+
+
+def run_nmea_dir(nmea_file_paths,
+                 is_raw_nmea_file=False,
+                 is_save_plt=False,
+                 is_write_cm=False,
+                 workers=None,
+                 recognize=nmea_file_recognization):
+    """Evaluate NMEA files, print and write the summary, list the failures
+    """
+    # Figures of a directory are always saved, never shown
+    start = time.perf_counter()
+    cms, failures = evaluate_nmea_dir(nmea_file_paths,
+                                      is_raw_nmea_file=is_raw_nmea_file,
+                                      is_save_plt=is_save_plt,
+                                      is_write_cm=is_write_cm,
+                                      workers=workers,
+                                      recognize=recognize)
+    print(f'Evaluated {len(cms)} files in '
+          f'{time.perf_counter() - start:.1f} s, {len(failures)} failed')
+    if len(failures) > 0:
+        print(failures.to_string())
+    if len(cms) == 0:
+        return
+    summary = summarize_confusion_matrices(cms)
+    print(summary.to_string())
+    SUMMARY_FILE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    summary.to_csv(SUMMARY_FILE_PATH)
+    print(f'Written summary to {SUMMARY_FILE_PATH.absolute()}')
+
+
 @click.command()
 @click.argument('nmea_path')
 @click.option('-p',
@@ -249,9 +403,18 @@ def process_nmea_file(nmea_file_path: Path,
               '--is_clear_summary',
               is_flag=True,
               help='clear summary file')
+@click.option('-j',
+              '--workers',
+              default=multiprocessing.cpu_count(),
+              help='Processes for a directory')
+@click.option('-g',
+              '--constellations',
+              default='GP',
+              help='GSV talkers to use, comma separated, e.g. GP,GL,GA,GB')
 def main(nmea_path, is_plot, is_save_plt, is_raw_nmea_file, is_report_cm,
-         is_write_cm, is_clear_summary):
+         is_write_cm, is_clear_summary, workers, constellations):
     nmea_path = Path(nmea_path)
+    constellations = tuple(constellations.split(','))
     if is_clear_summary and INDOOR_OUTDOOR_RECOGNIZATION_REPORT_DIR.exists():
         shutil.rmtree(INDOOR_OUTDOOR_RECOGNIZATION_REPORT_DIR)
         print(
@@ -264,18 +427,18 @@ def main(nmea_path, is_plot, is_save_plt, is_raw_nmea_file, is_report_cm,
                           is_save_plt=is_save_plt,
                           is_raw_nmea_file=is_raw_nmea_file,
                           is_report_cm=is_report_cm,
-                          is_write_cm=is_write_cm)
+                          is_write_cm=is_write_cm,
+                          constellations=constellations)
     elif nmea_path.is_dir():
-        nmea_file_paths = [path for path in nmea_path.rglob(NMEA_FILE_PATTERN)]
-        cpu_cnt = multiprocessing.cpu_count()
-        p = Pool(cpu_cnt)
-        for i, nmea_file_path in enumerate(nmea_file_paths):
-            p.apply_async(process_nmea_file,
-                          args=(nmea_file_path, is_plot, is_save_plt,
-                                is_raw_nmea_file, is_report_cm, is_write_cm,
-                                i + 1))
-        p.close()
-        p.join()
+        nmea_file_paths = sorted(nmea_path.rglob(NMEA_FILE_PATTERN))
+        run_nmea_dir(nmea_file_paths,
+                     is_raw_nmea_file=is_raw_nmea_file,
+                     is_save_plt=is_plot,
+                     is_write_cm=is_write_cm,
+                     workers=workers,
+                     recognize=functools.partial(
+                         nmea_file_recognization,
+                         constellations=constellations))
 
 
 if __name__ == "__main__":
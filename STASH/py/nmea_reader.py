@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: Farmer Li
+# @Date: 2021-03-19
+
+import csv
+import itertools
+from pathlib import Path
+
+import numpy as np
+
+from indoor_outdoor_recognizer import (DEFAULT_SLOTS, SATELLITE_MAX,
+                                       parse_gsv_sentence)
+
+HEADER_LINES_TO_SKIP = 2
+CHUNK_SIZE = 4096
+
+UNKNOW = 0
+
+
+def iter_raw_nmea_records(nmea_file_path: Path, chunk_size=CHUNK_SIZE):
+    """Yield chunks of (ts, ets, sentence, indoor_outdoor) from a raw log
+
+    The header lines and the last line, which may be broken, are skipped
+    like in `preprocess_raw_nmea_file`. Only one chunk is held in memory.
+    """
+    with Path(nmea_file_path).open('r') as f:
+        for _ in range(HEADER_LINES_TO_SKIP):
+            f.readline()
+        last = None
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if len(lines) == 0:
+                break
+            if last is not None:
+                lines.insert(0, last)
+            last = lines.pop()
+            if len(lines) == 0:
+                continue
+            yield [(int(ts), int(ets), nmea.rstrip('\n'), UNKNOW)
+                   for ts, ets, nmea in (line.split(',', 2)
+                                         for line in lines)]
+
+
+def iter_nmea_csv_records(nmea_file_path: Path, chunk_size=CHUNK_SIZE):
+    """Yield chunks of (ts, ets, sentence, indoor_outdoor) from a CSV file
+
+    The CSV has the columns of NMEA_FILE_HEADER_NAMES, as written by the
+    preprocess scripts.
+    """
+    with Path(nmea_file_path).open('r', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        ts_idx = header.index('CurrentTimeMillis')
+        ets_idx = header.index('EventTimestamp(ms)')
+        nmea_idx = header.index('NMEA')
+        label_idx = header.index('IndoorOutdoor')
+        while True:
+            rows = list(itertools.islice(reader, chunk_size))
+            if len(rows) == 0:
+                break
+            yield [(int(row[ts_idx]), int(row[ets_idx]), row[nmea_idx],
+                    int(row[label_idx])) for row in rows]
+
+
+def iter_nmea_records(nmea_file_path: Path,
+                      is_raw_nmea_file=False,
+                      chunk_size=CHUNK_SIZE):
+    if is_raw_nmea_file:
+        return iter_raw_nmea_records(nmea_file_path, chunk_size)
+    return iter_nmea_csv_records(nmea_file_path, chunk_size)
+
+
+class GsvChunkDecoder():
+    """Decode chunks of NMEA records into preallocated arrays
+
+    After `decode`, row i of the chunk has timestamp ets[i], label
+    labels[i] and counts[i] satellites in ids[i] and snrs[i], 0 for
+    sentences other than GSV. Satellite IDs are the recognizer slot
+    numbers of `slots`, unused entries of ids are 0.
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE, slots=DEFAULT_SLOTS) -> None:
+        self.slots = slots
+        self.ets = np.zeros(chunk_size, dtype=np.int64)
+        self.labels = np.zeros(chunk_size, dtype=int)
+        self.counts = np.zeros(chunk_size, dtype=int)
+        # A valid GSV sentence has up to 4 satellites, the recognizer accepts
+        # up to SATELLITE_MAX
+        self.ids = np.zeros((chunk_size, SATELLITE_MAX), dtype=int)
+        self.snrs = np.zeros((chunk_size, SATELLITE_MAX), dtype=int)
+        self.size = 0
+
+    def decode(self, records):
+        n = len(records)
+        if n > len(self.ets):
+            raise ValueError(f'Chunk too large: {n} > {len(self.ets)}')
+        self.ets[:n] = [r[1] for r in records]
+        self.labels[:n] = [r[3] for r in records]
+        self.counts[:n] = 0
+        self.ids[:n] = 0
+        for i, (_, _, sentence, _) in enumerate(records):
+            if sentence[3:7] != 'GSV,':
+                continue
+            ids, snrs = parse_gsv_sentence(sentence, self.slots)
+            cnt = len(ids)
+            self.counts[i] = cnt
+            self.ids[i, :cnt] = ids
+            self.snrs[i, :cnt] = snrs
+        self.size = n
+        return n
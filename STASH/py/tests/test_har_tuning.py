@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: Farmer Li
+# @Date: 2021-03-18
+
+from pathlib import Path
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+current_dir = Path(__file__).parent.resolve()
+sys.path.append(str(current_dir.parent))
+import har_tuning
+from utils.common import HEADER_NAMES, labels_to_category_idx
+
+FS = 26
+WIN_LEN = 8 * FS
+SHIFT = 2 * FS
+
+# (Activity label, seconds) of the record, 8 and 0 have no category
+SEGMENTS = [(0, 20), (5, 60), (8, 30), (7, 60), (1000, 30)]
+
+
+class OracleRecognizer():
+    """Stands in for ActivityRecognizer, predicts the category of the
+    record label of every window, Others for the ones without a category
+    """
+    def process_file_batch(self, file_path):
+        df = pd.read_csv(file_path)
+        last_idx = np.arange(WIN_LEN - 1, len(df), SHIFT)
+        activity = df['Activity'].values[last_idx]
+        categories = np.maximum(labels_to_category_idx(activity), 0)
+        result = {
+            'EventTimestamp(ns)': df['EventTimestamp(ns)'].values[last_idx],
+            'Activity': activity
+        }
+        for i in range(6):
+            result[f'Prob{i}'] = (categories == i).astype(float)
+        return df[['AccelX', 'AccelY', 'AccelZ']], pd.DataFrame(result)
+
+
+@pytest.fixture
+def record_file(tmp_path):
+    labels = np.concatenate([[a] * (s * FS) for a, s in SEGMENTS])
+    n = len(labels)
+    ts = np.arange(n) * (10**9 // FS)
+    df = pd.DataFrame(np.random.default_rng(0).normal(size=(n, 9)),
+                      columns=HEADER_NAMES[2:-1])
+    df.insert(0, 'EventTimestamp(ns)', ts)
+    df.insert(0, 'CurrentTimeMillis', ts // 10**6)
+    df['Activity'] = labels
+    record_dir = tmp_path / '20210318-001-phone_mi10'
+    record_dir.mkdir()
+    record_file = record_dir / 'accel.csv'
+    df.to_csv(record_file, index=False)
+    return record_file
+
+
+def test_labels_are_cached_as_categories(record_file, tmp_path):
+    cache_file = har_tuning.cache_record_probs(record_file, OracleRecognizer(),
+                                               'digest', tmp_path / 'cache')
+    with np.load(cache_file) as f:
+        labels = f['labels']
+    assert set(np.unique(labels)) <= set(range(-1, 6))
+    assert np.count_nonzero(labels == -1) > 0
+
+
+def test_oracle_scores_full_accuracy(record_file, tmp_path):
+    cache_file = har_tuning.cache_record_probs(record_file, OracleRecognizer(),
+                                               'digest', tmp_path / 'cache')
+    with np.load(cache_file) as f:
+        ts, labels, probs = f['ts'], f['labels'], f['probs']
+    predicts = np.argmax(probs, axis=1)
+    stats = dict(
+        zip(har_tuning.STATS_NAMES,
+            har_tuning.evaluate_predicts(ts, labels, predicts)))
+    assert stats['windows'] == np.count_nonzero(labels >= 0)
+    assert stats['correct'] == stats['windows']
+    assert stats['detected'] == 1
+    assert stats['latency_s'] == 0
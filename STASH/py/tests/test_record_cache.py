@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: Farmer Li
+# @Date: 2021-03-09
+
+from pathlib import Path
+import sys
+
+import numpy as np
+import pandas as pd
+
+current_dir = Path(__file__).parent.resolve()
+sys.path.append(str(current_dir.parent))
+from utils.common import HEADER_NAMES
+from utils.record_cache import read_csv_cached
+
+
+def is_memory_mapped(arr: np.ndarray):
+    while arr is not None:
+        if isinstance(arr, np.memmap):
+            return True
+        arr = arr.base
+    return False
+
+
+def write_record(tmp_path, n=1000):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(n, len(HEADER_NAMES))),
+                      columns=HEADER_NAMES)
+    df['CurrentTimeMillis'] = np.arange(n) * 40
+    df['Activity'] = rng.integers(0, 28, n)
+    record_file = tmp_path / 'record.csv'
+    df.to_csv(record_file, index=False)
+    return record_file
+
+
+def test_read_csv_cached_matches_read_csv(tmp_path):
+    record_file = write_record(tmp_path)
+    cache_dir = tmp_path / 'cache'
+    expected = pd.read_csv(record_file)
+    for _ in range(2):
+        df = read_csv_cached(record_file, cache_dir=cache_dir)
+        assert df.equals(expected)
+    usecols = ['AccelX', 'AccelY', 'AccelZ', 'Activity']
+    df = read_csv_cached(record_file, usecols=usecols, cache_dir=cache_dir)
+    assert df.equals(expected[usecols])
+
+
+def test_columns_stay_memory_mapped(tmp_path):
+    record_file = write_record(tmp_path)
+    cache_dir = tmp_path / 'cache'
+    df = read_csv_cached(record_file, cache_dir=cache_dir)
+    assert all(is_memory_mapped(df[c].to_numpy()) for c in df.columns)
+
+    df = read_csv_cached(record_file, cache_dir=cache_dir, writeable=True)
+    assert not any(is_memory_mapped(df[c].to_numpy()) for c in df.columns)
+    df.loc[0, 'AccelX'] = 1.0
@@ -1,9 +1,13 @@
 from multiprocessing import Pool, cpu_count
 from pathlib import Path
+import sys
 
 import click
 import pandas as pd
 
+sys.path.append(str(Path(__file__).resolve().parents[3] / 'xiaomi'))
+from time_range_probe import probe_time_range
+
 NMEA_FILE_SUFFIX = '*.csv'
 
 NMEA_CSV_COLUMNS = [
@@ -13,33 +17,6 @@ NMEA_CSV_COLUMNS = [
 NMEA_CLEANED_DIR_NAME = 'nmea_cleaned'
 
 
-def read_tail(input_file: Path, tail=5):
-    file_size = Path(input_file).stat().st_size
-    blocksize = 1024
-    data_file = open(input_file, 'r')
-    if file_size > blocksize:
-        maxseekpoint = (file_size // blocksize)
-        data_file.seek((maxseekpoint - 1) * blocksize)
-    elif file_size:
-        data_file.seek(0, 0)
-    lines = data_file.readlines()
-    last_lines = []
-    if lines:
-        for line in lines[-tail:]:
-            last_lines.append(line.strip())
-    data_file.close()
-    return last_lines
-
-
-def read_head(input_file: Path, head=5):
-    head_lines = []
-    with Path(input_file).open('r') as f:
-        for i in range(head):
-            line = f.readline().strip()
-            head_lines.append(line)
-    return head_lines
-
-
 def nmea_file_path_to_accel_file_path(nmea_file_path: Path, accel_dir: Path):
     nmea_file_path = Path(nmea_file_path)
     accel_dir = Path(accel_dir)
@@ -67,19 +44,12 @@ def get_timerange_from_accel_file_path(accel_file_path: Path) -> tuple:
         print(f'Not exists: {accel_file_path.name}')
         return (begin_ts, end_ts)
 
-    head_lines = read_head(accel_file_path)
-    last_lines = read_tail(accel_file_path)
-
-    head_meta_ts = head_lines[1].split(',')[0]  # skip the header
-    last_meta_ts = last_lines[-1].split(',')[0]  # CurrentTimeMillis
-    try:
-        begin_ts = int(head_meta_ts)
-        end_ts = int(last_meta_ts)
-    except ValueError:
-        print(f'Can not convert ({begin_ts}, {end_ts}) to int')
+    # CurrentTimeMillis of the first and last rows, after the header
+    timerange = probe_time_range(accel_file_path, header_lines=1)
+    if None in timerange:
+        print(f'No timestamp in {accel_file_path.name}')
         return (begin_ts, end_ts)
-
-    return (begin_ts, end_ts)
+    return timerange
 
 
 def clip_nmea_file(nmea_file_path: Path, timerange: tuple) -> pd.DataFrame:
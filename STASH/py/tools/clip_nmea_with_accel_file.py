@@ -8,6 +8,10 @@ import click
 import pandas as pd
 
 from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parents[3] / 'xiaomi'))
+from time_range_probe import probe_time_range
 
 NMEA_FILE_COLUMNS = [
     'CurrentTimeMillis', 'EventTimestamp(ms)', 'NMEA', 'IndoorOutdoor'
@@ -20,33 +24,6 @@ SOURCE_BASE = 'source_nmea'
 CLIPED_BASE = 'cliped_nmea'
 
 
-def read_tail(input_file: Path, tail=5):
-    file_size = Path(input_file).stat().st_size
-    blocksize = 1024
-    data_file = open(input_file, 'r')
-    if file_size > blocksize:
-        maxseekpoint = (file_size // blocksize)
-        data_file.seek((maxseekpoint - 1) * blocksize)
-    elif file_size:
-        data_file.seek(0, 0)
-    lines = data_file.readlines()
-    last_lines = []
-    if lines:
-        for line in lines[-tail:]:
-            last_lines.append(line.strip())
-    data_file.close()
-    return last_lines
-
-
-def read_head(input_file: Path, head=5):
-    head_lines = []
-    with Path(input_file).open('r') as f:
-        for i in range(head):
-            line = f.readline().strip()
-            head_lines.append(line)
-    return head_lines
-
-
 def get_accel_file_path_from_nmea_file_path(nmea_file_path: Path, accel_dir):
     """
     nmea file path like:
@@ -78,19 +55,12 @@ def get_timerange_from_accel_file(accel_file_path: Path) -> tuple:
         return
     accel_file_path = Path(accel_file_path)
 
-    head_lines = read_head(accel_file_path)
-    last_lines = read_tail(accel_file_path)
-
-    head_meta_ts = head_lines[1].split(',')[0]  # skip the header
-    last_meta_ts = last_lines[-1].split(',')[0]  # CurrentTimeMillis
-    begin_ts, end_ts = -1, -1
-    try:
-        begin_ts = int(head_meta_ts)
-        end_ts = int(last_meta_ts)
-    except ValueError:
-        print(f'Can not convert ({begin_ts}, {end_ts}) to int')
-        return (begin_ts, end_ts)
-    return (begin_ts, end_ts)
+    # CurrentTimeMillis of the first and last rows, after the header
+    timerange = probe_time_range(accel_file_path, header_lines=1)
+    if None in timerange:
+        print(f'No timestamp in {accel_file_path.name}')
+        return (-1, -1)
+    return timerange
 
 
 def clip_nmea_file_and_save(nmea_file_path: Path, timerange: tuple):
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: Farmer Li
+# @Date: 2021-03-15
+
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import click
+import numpy as np
+
+current_dir = Path(__file__).parent.resolve()
+py_dir = current_dir.parent
+
+ENTRY_POINTS = [
+    'activity_recognizer.py', 'har_model.py', 'activity_data_preprocess.py',
+    'utils/common.py', 'utils/model_utils.py', 'utils/record_cache.py',
+    'utils/split_test.py'
+]
+
+
+def measure_startup(script: Path, repeat=5):
+    """Wall time in seconds of `python script --help`, one per run"""
+    cmd = [sys.executable, str(script), '--help']
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(cmd,
+                              cwd=script.parent,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE)
+        times.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            err = proc.stderr.decode(errors='replace').strip().split('\n')
+            raise RuntimeError(err[-1])
+    return np.asarray(times)
+
+
+def slowest_imports(script: Path, top=10):
+    """Top modules by cumulative import time in ms, from -X importtime"""
+    cmd = [sys.executable, '-X', 'importtime', str(script), '--help']
+    proc = subprocess.run(cmd,
+                          cwd=script.parent,
+                          stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE)
+    imports = []
+    for line in proc.stderr.decode(errors='replace').split('\n'):
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        # Top level imports only, nested ones are included in cumulative
+        name = fields[2]
+        if name.startswith('  '):
+            continue
+        imports.append((int(fields[1]) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+@click.command()
+@click.argument('scripts', nargs=-1)
+@click.option('-n', '--repeat', default=5)
+@click.option('-t',
+              '--top',
+              default=0,
+              help='Also list the N slowest top level imports')
+def main(scripts, repeat, top):
+    if len(scripts) > 0:
+        scripts = [Path(s).resolve() for s in scripts]
+    else:
+        scripts = [py_dir / s for s in ENTRY_POINTS]
+    for script in scripts:
+        name = script
+        if py_dir in script.parents:
+            name = script.relative_to(py_dir)
+        try:
+            times = measure_startup(script, repeat)
+        except RuntimeError as e:
+            print(f'{str(name):32s} failed: {e}')
+            continue
+        print(f'{str(name):32s} median {np.median(times):.3f} s, '
+              f'min {np.min(times):.3f} s')
+        for cost, module in slowest_imports(script, top):
+            print(f'    {cost:8.1f} ms  {module}')
+
+
+if __name__ == '__main__':
+    main()
@@ -6,20 +6,21 @@ import os
 from pathlib import Path
 import random
 import re
+import sys
 import time
 
 import click
 from joblib import Memory
-from keras.utils import to_categorical
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from scipy import signal, stats
-from sklearn.metrics import (accuracy_score, average_precision_score,
-                             classification_report, confusion_matrix,
-                             precision_recall_curve)
-import tabulate
+
+current_dir = Path(__file__).parent.resolve()
+sys.path.append(str(current_dir.parent))
+from utils.mode_filter import sliding_mode
+from utils.record_cache import read_csv_cached
+
+# keras, matplotlib, scipy, sklearn and tabulate are imported inside the
+# functions using them to keep the import of this module cheap
 
 # mpl.use('Agg')
 
@@ -124,6 +125,17 @@ def label_to_category_idx(label):
         return -1
 
 
+LABEL_CATEGORY_IDX_LUT = np.array(
+    [label_to_category_idx(i) for i in range(len(Activities))])
+
+
+def labels_to_category_idx(labels):
+    """Vectorized `label_to_category_idx` over an array of labels"""
+    labels = np.asarray(labels)
+    labels = np.where(labels == 1000, len(Activities) - 1, labels)
+    return LABEL_CATEGORY_IDX_LUT[labels.astype(int)]
+
+
 def label_to_category(label):
     if label == 1000:
         label = Activities[-1]
@@ -188,18 +200,53 @@ def load_dataset(input_dir,
                  filter_outlier=False,
                  lp_filter=False,
                  valid_only=True):
-    data_x = []
-    data_y = []
+    # Keep the window views of every file, only materialize once at the end
+    files_windows = []
     for file_path in Path(input_dir).rglob('*.csv'):
-        x, y = load_data_file(file_path, fs, downsample, duration, shift,
-                              use_amp, filter_outlier, lp_filter, valid_only)
-        data_x.extend(x)
-        data_y.extend(y)
-    data_x = np.array(data_x, dtype=np.float32)
-    data_y = np.array(data_y, dtype=np.float32)
+        windows, index, labels = load_data_file_view(file_path, fs,
+                                                     downsample, duration,
+                                                     shift, use_amp,
+                                                     filter_outlier,
+                                                     lp_filter, valid_only)
+        if windows is not None and len(index) > 0:
+            files_windows.append((windows, index, labels))
+    if len(files_windows) == 0:
+        return (np.zeros((0, ), dtype=np.float32),
+                np.zeros((0, ), dtype=np.float32))
+
+    frame_shape = files_windows[0][0].shape[1:]
+    total = sum(len(index) for _, index, _ in files_windows)
+    data_x = np.empty((total, *frame_shape), dtype=np.float32)
+    data_y = np.empty((total, ), dtype=np.float32)
+    pos = 0
+    for windows, index, labels in files_windows:
+        data_x[pos:pos + len(index)] = windows[index]
+        data_y[pos:pos + len(index)] = labels
+        pos += len(index)
     return data_x, data_y
 
 
+def load_data_file_view(file_path,
+                        fs=26,
+                        downsample=1,
+                        duration=8,
+                        shift=0.5,
+                        use_amp=True,
+                        filter_outlier=False,
+                        lp_filter=False,
+                        valid_only=True):
+    df = read_csv_cached(file_path, usecols=DATA_NAMES_TO_USE)
+    data = df.values
+    dest_fs = fs
+    if downsample > 1:
+        dest_fs = fs // downsample
+        data = data[::downsample]
+
+    data, activity = preprocess_data(data, use_amp, filter_outlier, lp_filter)
+    return slice_data_view(data, activity, duration, shift, dest_fs,
+                           valid_only)
+
+
 def load_data_file(file_path,
                    fs=26,
                    downsample=1,
@@ -209,17 +256,13 @@ def load_data_file(file_path,
                    filter_outlier=False,
                    lp_filter=False,
                    valid_only=True):
-    df = pd.read_csv(file_path, usecols=DATA_NAMES_TO_USE)
-    data = df.values
-    dest_fs = fs
-    if downsample > 1:
-        dest_fs = fs // downsample
-        data = data[::downsample]
-
-    data, activity = preprocess_data(data, use_amp, filter_outlier, lp_filter)
-    x, y = slice_data(data, activity, duration, shift, dest_fs, valid_only)
-
-    return x, y
+    windows, index, labels = load_data_file_view(file_path, fs, downsample,
+                                                 duration, shift, use_amp,
+                                                 filter_outlier, lp_filter,
+                                                 valid_only)
+    if windows is None:
+        return None, None
+    return windows[index], labels
 
 
 def preprocess_data(data, use_amp=True, filter_outlier=False, lp_filter=False):
@@ -242,7 +285,8 @@ def preprocess_data(data, use_amp=True, filter_outlier=False, lp_filter=False):
     return data, activity
 
 
-def exception_point_process(data, inplace=False, lower=-80, upper=80):
+def exception_point_process_loop(data, inplace=False, lower=-80, upper=80):
+    """Reference per-sample implementation of `exception_point_process`"""
     res = data
     if not inplace:
         res = data.copy()
@@ -258,13 +302,51 @@ def exception_point_process(data, inplace=False, lower=-80, upper=80):
     return res
 
 
+def exception_point_process(data, inplace=False, lower=-80, upper=80):
+    """Replace points out of [lower, upper] by the mean of their neighbours
+
+    The first point is replaced by 0 and the last one by its left
+    neighbour. When inplace, the left neighbour of a point is the already
+    repaired one, same as processing the points one by one.
+    """
+    res = data
+    if not inplace:
+        res = data.copy()
+    outlier = (data > upper) | (data < lower)
+    idx = np.flatnonzero(outlier)
+    if len(idx) == 0:
+        return res
+    max_idx = len(data) - 1
+
+    # Points depending on an already repaired left neighbour, rare
+    chained = np.zeros(len(idx), dtype=bool)
+    if inplace:
+        chained = (idx > 0) & outlier[np.maximum(idx - 1, 0)]
+    direct = idx[~chained]
+    left = data[np.maximum(direct - 1, 0)]
+    right = data[np.minimum(direct + 1, max_idx)]
+    values = np.where(direct == max_idx, left, (left + right) / 2)
+    values = np.where(direct == 0, 0, values)
+    res[direct] = values
+
+    for i in idx[chained]:
+        if i == max_idx:
+            res[i] = res[i - 1]
+        else:
+            res[i] = (res[i - 1] + res[i + 1]) / 2
+    return res
+
+
 def low_pass_filter(data, N=5, Wn=0.05):
+    from scipy import signal
+
     b, a = signal.butter(N, Wn, 'lowpass', output='ba')
     data_lp = signal.filtfilt(b, a, data, axis=0)
     return data_lp
 
 
-def ewma(data: np.ndarray, inplace=False, alpha=0.99):
+def ewma_loop(data: np.ndarray, inplace=False, alpha=0.99):
+    """Reference per-sample implementation of `ewma`"""
     res = data
     if not inplace:
         res = data.copy()
@@ -276,29 +358,156 @@ def ewma(data: np.ndarray, inplace=False, alpha=0.99):
     return res
 
 
-def slice_data(in_data, activity, frame_len, shift, fs, valid_only=True):
+def ewma(data: np.ndarray, inplace=False, alpha=0.99):
+    """Exponentially weighted moving average along the first axis
+
+    Implemented as the IIR filter y[n] = alpha * y[n - 1] + beta * x[n]
+    starting from y[0] = x[0].
+    """
+    res = data
+    if not inplace:
+        res = data.copy()
+    if len(data) > 0:
+        res[...] = EwmaFilter(alpha).process(data)
+    return res
+
+
+class EwmaFilter():
+    """Streaming `ewma`, the filter state is carried across chunks"""
+    def __init__(self, alpha=0.99) -> None:
+        self._alpha = alpha
+        self._b = [1 - alpha]
+        self._a = [1, -alpha]
+        self._zi = None
+
+    def process(self, data: np.ndarray):
+        from scipy import signal
+
+        data = np.asarray(data)
+        if len(data) == 0:
+            return data.astype(float)
+        if self._zi is None:
+            self._zi = self._alpha * data[0:1]
+        res, self._zi = signal.lfilter(self._b,
+                                       self._a,
+                                       data,
+                                       axis=0,
+                                       zi=self._zi)
+        return res
+
+    def reset(self):
+        self._zi = None
+
+
+def benchmark_preprocess_filters(duration_s=3600, fs=26, repeat=3):
+    """Compare the filters against the per-sample loops on a synthetic
+    record"""
+    rng = np.random.default_rng(0)
+    data = rng.normal(0, 10, (duration_s * fs, 3))
+    spikes = rng.random(data.shape) < 1e-3
+    data[spikes] = 200
+    print(f'Record: {duration_s} s at {fs} Hz, shape: {data.shape}, '
+          f'outliers: {spikes.sum()}')
+
+    def best_time(func):
+        best = float('inf')
+        res = None
+        for _ in range(repeat):
+            x = data.copy()
+            start = time.perf_counter()
+            res = func(x)
+            best = min(best, time.perf_counter() - start)
+        return best, res
+
+    def process_columns(func):
+        def process(x):
+            for i in range(x.shape[1]):
+                func(x[:, i], inplace=True)
+            return x
+
+        return process
+
+    cases = [
+        ('exception_point_process',
+         process_columns(exception_point_process_loop),
+         process_columns(exception_point_process)),
+        ('ewma', ewma_loop, ewma),
+    ]
+    for name, loop_func, func in cases:
+        loop_cost, expected = best_time(loop_func)
+        cost, res = best_time(func)
+        print(f'{name}: loop {loop_cost * 1000:.1f} ms, '
+              f'vectorized {cost * 1000:.1f} ms, '
+              f'speedup x{loop_cost / cost:.0f}, '
+              f'max abs diff: {np.max(np.abs(expected - res)):.3g}')
+
+
+def sliding_windows(in_data, win_len, stride):
+    """Read-only window view over the first axis, no data is copied
+
+    Returns an array with shape (n, win_len, *in_data.shape[1:]), the last
+    full window is excluded to keep the windows of `slice_data`.
+    """
+    n = len(range(0, in_data.shape[0] - win_len, stride))
+    if n == 0:
+        return np.empty((0, win_len, *in_data.shape[1:]), dtype=in_data.dtype)
+    windows = np.lib.stride_tricks.sliding_window_view(in_data,
+                                                       win_len,
+                                                       axis=0)
+    windows = np.moveaxis(windows, -1, 1)
+    return windows[:n * stride:stride]
+
+
+def window_purity_mask(activity, win_len, stride, n):
+    """Whether every one of the n windows holds one single label"""
+    changes = np.zeros(len(activity), dtype=np.int64)
+    changes[1:] = activity[1:] != activity[:-1]
+    changes = np.cumsum(changes)
+    starts = np.arange(n) * stride
+    return changes[starts + win_len - 1] == changes[starts]
+
+
+def slice_data_view(in_data, activity, frame_len, shift, fs, valid_only=True):
+    """Slice data into windows without copying
+
+    Returns
+    -------
+    tuple
+        (windows, index, labels), windows is the read-only view of all the
+        windows, index selects the labeled and pure ones and labels holds
+        their category, materialize with windows[index]
+    """
     win_len = int(frame_len * fs)
     stride = int(shift * fs)
-    input_shape = np.shape(in_data)
-    input_len = input_shape[0]
+    input_len = np.shape(in_data)[0]
     n_frames = int((input_len - win_len) / stride) + 1
     if n_frames < 1:
+        return None, None, None
+    activity = np.asarray(activity)
+    windows = sliding_windows(in_data, win_len, stride)
+    n = windows.shape[0]
+    starts_activity = activity[:n * stride:stride]
+
+    # Only accept labeled and pure data
+    valid = ((starts_activity > 0)
+             & window_purity_mask(activity, win_len, stride, n))
+    index = np.flatnonzero(valid)
+    # Convert activity to target category
+    categories = labels_to_category_idx(starts_activity[index])
+    # Category <0 means this type data should not be use
+    if valid_only:
+        keep = categories >= 0
+        index = index[keep]
+        categories = categories[keep]
+    return windows, index, categories
+
+
+def slice_data(in_data, activity, frame_len, shift, fs, valid_only=True):
+    windows, index, labels = slice_data_view(in_data, activity, frame_len,
+                                             shift, fs, valid_only)
+    if windows is None:
         return None, None
-    frames = []
-    labels = []
-    load_all = not valid_only
-    for i in range(0, in_data.shape[0] - win_len, stride):
-        acc_raw = in_data[i:i + win_len]
-
-        # Only accept labeled and pure data
-        if activity[i] > 0 and np.all(activity[i:i + win_len] == activity[i]):
-            # Convert activity to target category
-            category = label_to_category_idx(activity[i])
-            # Category <0 means this type data should not be use
-            if category >= 0 or load_all:
-                frames.append(acc_raw)
-                labels.append(category)
-    return frames, labels
+    return windows[index], labels
 
 
 def reshape_data(data):
@@ -309,7 +518,12 @@ def reshape_data(data):
 def plot_confusion_matrix(cm,
                           classes,
                           title='Confusion matrix',
-                          cmap=plt.cm.binary):
+                          cmap=None):
+    import matplotlib.pyplot as plt
+
+    if cmap is None:
+        cmap = plt.cm.binary
+
     cm = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
     # cm = cm.astype('float')
     plt.imshow(cm, interpolation='nearest', cmap=cmap)
@@ -332,6 +546,9 @@ def plot_confusion_matrix(cm,
 
 
 def plot_confuse(ypre, y_val, acc, title, plot=False):
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import confusion_matrix
+
     predictions = ypre
     y_val = np.array(y_val).astype(np.int64)
     print(y_val.shape)
@@ -371,6 +588,8 @@ def get_pr(pos_prob, y_true):
 
 
 def stats_confusion_matrix(y_true, y_pred, title='', plot=False):
+    from sklearn.metrics import accuracy_score
+
     acc = accuracy_score(y_true, y_pred)
     conf_mat = plot_confuse(y_pred, y_true, acc, title, plot)
     return acc, conf_mat
@@ -381,6 +600,10 @@ def stats_precision_recall(y_true,
                            num_classes,
                            title='',
                            plot=False):
+    from keras.utils import to_categorical
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import average_precision_score, precision_recall_curve
+
     # For each class
     precision = dict()
     recall = dict()
@@ -447,6 +670,8 @@ def stats_precision_recall(y_true,
 
 
 def tabulate_conf_mat(conf_mat):
+    import tabulate
+
     conf_mat_score = conf_mat.astype('float') / conf_mat.sum(
         axis=1)[:, np.newaxis]
 
@@ -477,20 +702,24 @@ def tabulate_conf_mat(conf_mat):
 
 
 def post_process(in_data, src_period, dest_period):
+    """Mode of the previous dest_period seconds for every sample
+
+    The first samples, without a full window before them, are kept as is.
+    Ties go to the smallest value, as with scipy.stats.mode.
+    """
     stats_num = int(dest_period / src_period)
     data_len = in_data.shape[0]
-    out_data = np.zeros(data_len)
-    for i in range(data_len):
-        start = i - stats_num
-        end = i
-        if start < 0:
-            out_data[i] = in_data[i]
-        else:
-            out_data[i] = stats.mode(in_data[start:end])[0]
+    out_data = np.asarray(in_data, dtype=float).copy()
+    if data_len > stats_num:
+        values, inverse = np.unique(in_data, return_inverse=True)
+        modes = sliding_mode(inverse, stats_num, len(values))
+        out_data[stats_num:] = values[modes[stats_num - 1:-1]]
     return out_data
 
 
 def stats_evaluation(y_test, y_pred_probs, num_classes, shift=0.5, show=False):
+    from sklearn.metrics import classification_report
+
     y_pred = np.argmax(y_pred_probs, axis=1)
     acc, conf_mat = stats_confusion_matrix(y_test, y_pred, title='', plot=show)
     precision, recall, average_precision = stats_precision_recall(
@@ -558,6 +787,8 @@ def save_model(model, model_name, out_path, type='.yaml'):
 
 
 def plot_har_prediction(filename, data_dict, predictions={}):
+    import matplotlib.pyplot as plt
+
     print("plot data")
     figure, axes = plt.subplots(2, 1, sharex=True, figsize=(20, 8))
     mngr = plt.get_current_fig_manager()
@@ -605,6 +836,8 @@ def plot_har_prediction(filename, data_dict, predictions={}):
 
 
 def check_processed_data(data_file):
+    import matplotlib.pyplot as plt
+
     raw = pd.read_csv(data_file, usecols=DATA_NAMES_TO_USE).values
     x = raw[:, 0].copy()
     y = raw[:, 1].copy()
@@ -630,8 +863,15 @@ def check_processed_data(data_file):
 
 
 @click.command()
-@click.argument('data-file')
-def main(data_file):
+@click.argument('data-file', required=False)
+@click.option('-b',
+              '--benchmark',
+              is_flag=True,
+              help='Benchmark the preprocess filters on a 1-hour record')
+def main(data_file, benchmark):
+    if benchmark:
+        benchmark_preprocess_filters()
+        return
     data_file = Path(data_file)
     x, y = load_data_file(data_file)
     x = np.asarray(x)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: Farmer Li
+# @Date: 2021-03-16
+
+import numpy as np
+
+
+class LabelIndex():
+    """Project (type, start_ts, end_ts) labels onto sorted timestamp arrays
+
+    Build it once per record and reuse it for every sensor stream, each
+    projection is a binary search per label boundary. When labels overlap,
+    the later label in the list wins, the same as writing the intervals to
+    the label column one by one.
+
+    Parameters
+    ----------
+    labels_ts : list
+        (type, start_ts, end_ts) tuples, as from `load_label_result`
+    """
+    def __init__(self, labels_ts) -> None:
+        labels = np.asarray(labels_ts).reshape(-1, 3)
+        self.types = labels[:, 0].astype(int)
+        self.starts = labels[:, 1]
+        self.ends = labels[:, 2]
+
+    def __len__(self):
+        return len(self.types)
+
+    def index_bounds(self, ts_arr):
+        """Index intervals of the labels on ts_arr
+
+        Returns
+        -------
+        tuple
+            (types, start_idx, end_idx, valid), labels not overlapping
+            ts_arr at all are flagged False in valid
+        """
+        ts_arr = np.asarray(ts_arr)
+        n = len(ts_arr)
+        if n == 0:
+            empty = np.zeros(len(self), dtype=int)
+            return self.types, empty, empty, np.zeros(len(self), dtype=bool)
+        valid = (self.starts <= ts_arr[-1]) & (self.ends >= ts_arr[0])
+        # First sample after start, first sample after end following it
+        start_idx = np.searchsorted(ts_arr, self.starts, side='right')
+        end_idx = np.searchsorted(ts_arr, self.ends, side='right')
+        end_idx = np.maximum(end_idx, start_idx + 1)
+        end_idx[end_idx >= n] = n - 1
+        start_idx[start_idx >= n] = -1
+        return self.types, start_idx, end_idx, valid
+
+    def to_index(self, ts_arr):
+        """Labels as (type, start_idx, end_idx) tuples on ts_arr"""
+        types, start_idx, end_idx, valid = self.index_bounds(ts_arr)
+        return [(int(t), int(s), int(e))
+                for t, s, e, v in zip(types, start_idx, end_idx, valid) if v]
+
+    def label_column(self, ts_arr, default=0, dtype=int):
+        """Per-sample label of ts_arr, default where no label applies"""
+        n = len(ts_arr)
+        types, start_idx, end_idx, valid = self.index_bounds(ts_arr)
+        # Start index -1 means an empty interval
+        valid = valid & (start_idx >= 0) & (start_idx < end_idx)
+        types, start_idx, end_idx = types[valid], start_idx[valid], end_idx[
+            valid]
+        res = np.full(n, default, dtype=dtype)
+        if len(types) == 0:
+            return res
+
+        # Elementary segments between all label boundaries, each one is
+        # covered by the same set of labels
+        bounds = np.unique(np.concatenate(([0, n], start_idx, end_idx)))
+        seg_starts = bounds[:-1]
+        covered = ((start_idx[:, None] <= seg_starts[None, :]) &
+                   (end_idx[:, None] > seg_starts[None, :]))
+        # Last covering label wins
+        last = len(types) - 1 - np.argmax(covered[::-1], axis=0)
+        seg_labels = np.where(covered.any(axis=0), types[last], default)
+        res[:] = np.repeat(seg_labels, np.diff(bounds))
+        return res
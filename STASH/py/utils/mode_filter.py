@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: Farmer Li
+# @Date: 2021-03-17
+
+import numpy as np
+
+from .ring_buffer import RingBuffer
+
+
+def sliding_window_counts(labels, win_len, num_classes):
+    """Class histogram of the trailing window ending at every sample
+
+    Row i counts labels[max(0, i - win_len + 1):i + 1], labels outside
+    [0, num_classes) take a place in the window but are not counted.
+
+    Returns
+    -------
+    np.ndarray
+        Counts of shape (len(labels), num_classes)
+    """
+    if win_len < 1:
+        raise ValueError(f'Window length must be positive: {win_len}')
+    labels = np.asarray(labels).astype(int)
+    n = len(labels)
+    one_hot = np.zeros((n + 1, num_classes), dtype=int)
+    valid = (labels >= 0) & (labels < num_classes)
+    one_hot[np.nonzero(valid)[0] + 1, labels[valid]] = 1
+    cum = np.cumsum(one_hot, axis=0)
+    counts = cum[1:].copy()
+    if n > win_len:
+        counts[win_len:] -= cum[1:n + 1 - win_len]
+    return counts
+
+
+def sliding_mode(labels, win_len, num_classes=None):
+    """Most frequent label of the trailing window ending at every sample
+
+    Ties go to the smallest label, as with scipy.stats.mode.
+    """
+    labels = np.asarray(labels).astype(int)
+    if num_classes is None:
+        num_classes = int(labels.max()) + 1 if len(labels) > 0 else 1
+    counts = sliding_window_counts(labels, win_len, num_classes)
+    return np.argmax(counts, axis=1)
+
+
+class SlidingModeFilter():
+    """Streaming `sliding_mode` with an incremental class histogram"""
+    def __init__(self, win_len, num_classes) -> None:
+        self._buf = RingBuffer(win_len, dtype=int)
+        self.hist = np.zeros(num_classes, dtype=int)
+
+    def process(self, label):
+        if self._buf.is_full():
+            self.hist[self._buf.get(0)] -= 1
+        self._buf.append(label)
+        self.hist[label] += 1
+        return self.mode()
+
+    def mode(self):
+        return int(np.argmax(self.hist))
+
+    def size(self):
+        return self._buf.size()
+
+    def is_full(self):
+        return self._buf.is_full()
+
+    def reset(self):
+        self._buf.reset()
+        self.hist.fill(0)
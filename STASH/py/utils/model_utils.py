@@ -3,25 +3,218 @@
 # @Author: Farmer Li
 # @Date: 2021-01-22
 
-from keras.models import load_model
-import onnxruntime as ort
+from collections import deque
+import time
+
+import click
+import numpy as np
+
+# keras and onnxruntime are imported where they are used, importing keras
+# pulls in TensorFlow and costs seconds even for ONNX only runs
+
+# Latencies kept for the percentiles, the oldest are dropped first
+LATENCY_WINDOW = 10000
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL'
+}
+
+EXECUTION_MODES = {
+    'sequential': 'ORT_SEQUENTIAL',
+    'parallel': 'ORT_PARALLEL'
+}
+
+
+def create_onnx_session(model_file,
+                        intra_op_threads=None,
+                        inter_op_threads=None,
+                        graph_optimization_level=None,
+                        execution_mode=None,
+                        providers=None):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    if intra_op_threads is not None:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads is not None:
+        options.inter_op_num_threads = inter_op_threads
+    if graph_optimization_level is not None:
+        level = GRAPH_OPTIMIZATION_LEVELS[graph_optimization_level]
+        options.graph_optimization_level = getattr(ort.GraphOptimizationLevel,
+                                                   level)
+    if execution_mode is not None:
+        mode = EXECUTION_MODES[execution_mode]
+        options.execution_mode = getattr(ort.ExecutionMode, mode)
+    if providers is None:
+        providers = ['CPUExecutionProvider']
+    return ort.InferenceSession(str(model_file),
+                                sess_options=options,
+                                providers=providers)
 
 
 class GeneralModelPredictor():
-    def __init__(self, model_file, model_type='onnx') -> None:
+    """Keras or ONNX model behind one predict API
+
+    Parameters
+    ----------
+    model_file : str
+        Path to the model file
+    model_type : str, optional
+        'keras' or 'onnx', by default 'onnx'
+    intra_op_threads, inter_op_threads : int, optional
+        ONNX Runtime thread counts, runtime default if None
+    graph_optimization_level : str, optional
+        One of 'disable', 'basic', 'extended', 'all'
+    execution_mode : str, optional
+        One of 'sequential', 'parallel'
+    io_binding_shape : tuple, optional
+        Fixed float32 input shape, inputs of this shape are copied into
+        preallocated ONNX Runtime buffers bound to the session
+    """
+    def __init__(self,
+                 model_file,
+                 model_type='onnx',
+                 intra_op_threads=None,
+                 inter_op_threads=None,
+                 graph_optimization_level=None,
+                 execution_mode=None,
+                 io_binding_shape=None,
+                 providers=None) -> None:
         self._type = model_type
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._latency_count = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+        self._io_binding = None
         if model_type == 'keras':
+            from keras.models import load_model
             self._model = load_model(model_file, compile=False)
         elif model_type == 'onnx':
-            self._model = ort.InferenceSession(model_file)
+            self._model = create_onnx_session(model_file, intra_op_threads,
+                                              inter_op_threads,
+                                              graph_optimization_level,
+                                              execution_mode, providers)
+            self._input_name = self._model.get_inputs()[0].name
+            self._output_names = [o.name for o in self._model.get_outputs()]
+            if io_binding_shape is not None:
+                self._bind_io(tuple(io_binding_shape))
         else:
             raise ValueError(f'Unsupported model type: {model_type}')
 
-    def predict(self, x):
+    def _bind_io(self, input_shape):
+        import onnxruntime as ort
+
+        self._input = np.zeros(input_shape, dtype=np.float32)
+        input_value = ort.OrtValue.ortvalue_from_numpy(self._input)
+        # Run once to get the output shape
+        out = self._model.run(None, {self._input_name: self._input})[0]
+        self._output = ort.OrtValue.ortvalue_from_shape_and_type(
+            out.shape, out.dtype)
+        self._io_binding = self._model.io_binding()
+        self._io_binding.bind_ortvalue_input(self._input_name, input_value)
+        self._io_binding.bind_ortvalue_output(self._output_names[0],
+                                              self._output)
+
+    def _predict(self, x):
         if self._type == 'keras':
             return self._model.predict(x)
         elif self._type == 'onnx':
-            input_name = self._model.get_inputs()[0].name
-            input_x = {input_name: x}
-            onnx_out = self._model.run(None, input_x)
+            if (self._io_binding is not None
+                    and np.shape(x) == self._input.shape):
+                np.copyto(self._input, x)
+                self._model.run_with_iobinding(self._io_binding)
+                return self._output.numpy()
+            input_x = {self._input_name: x}
+            onnx_out = self._model.run(self._output_names[:1], input_x)
             return onnx_out[0]
+
+    def predict(self, x):
+        start = time.perf_counter()
+        res = self._predict(x)
+        latency = time.perf_counter() - start
+        self._latencies.append(latency)
+        self._latency_count += 1
+        self._latency_sum += latency
+        self._latency_max = max(self._latency_max, latency)
+        return res
+
+    def warm_up(self, input_shape=None, times=3):
+        """Run the model on zeros, latency statistics are not affected"""
+        if input_shape is None:
+            if self._io_binding is None:
+                raise ValueError('Input shape is needed for warming up')
+            input_shape = self._input.shape
+        x = np.zeros(input_shape, dtype=np.float32)
+        for _ in range(times):
+            self._predict(x)
+
+    def get_latency_stats(self):
+        """Statistics of predict latency in ms since the last reset
+
+        count, mean and max cover every call, the percentiles the last
+        LATENCY_WINDOW calls.
+        """
+        if self._latency_count == 0:
+            return {'count': 0}
+        latencies = np.asarray(self._latencies) * 1000
+        return {
+            'count': self._latency_count,
+            'mean': self._latency_sum / self._latency_count * 1000,
+            'p50': np.percentile(latencies, 50),
+            'p90': np.percentile(latencies, 90),
+            'p99': np.percentile(latencies, 99),
+            'max': self._latency_max * 1000
+        }
+
+    def reset_latency_stats(self):
+        self._latencies.clear()
+        self._latency_count = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+
+
+def benchmark_predictors(predictors: dict, input_shape, repeat=200):
+    """Compare predictors on the same random input through the same API"""
+    x = np.random.rand(*input_shape).astype(np.float32)
+    for name, predictor in predictors.items():
+        predictor.warm_up(input_shape)
+        predictor.reset_latency_stats()
+        for _ in range(repeat):
+            predictor.predict(x)
+        stats = predictor.get_latency_stats()
+        print(f'{name}: {stats["count"]} calls, '
+              f'mean {stats["mean"]:.3f} ms, p50 {stats["p50"]:.3f} ms, '
+              f'p99 {stats["p99"]:.3f} ms, max {stats["max"]:.3f} ms')
+
+
+@click.command()
+@click.option('-k', '--keras-model', help='Keras model file')
+@click.option('-o', '--onnx-model', help='ONNX model file')
+@click.option('-s',
+              '--shape',
+              default='1,1,208,4',
+              help='Input shape, comma separated')
+@click.option('-n', '--repeat', default=200)
+@click.option('-t', '--threads', default=1, help='ONNX intra op threads')
+def main(keras_model, onnx_model, shape, repeat, threads):
+    input_shape = tuple(int(d) for d in shape.split(','))
+    predictors = {}
+    if keras_model is not None:
+        predictors['keras'] = GeneralModelPredictor(keras_model, 'keras')
+    if onnx_model is not None:
+        predictors['onnx'] = GeneralModelPredictor(onnx_model,
+                                                   'onnx',
+                                                   intra_op_threads=threads)
+        predictors['onnx-iobinding'] = GeneralModelPredictor(
+            onnx_model,
+            'onnx',
+            intra_op_threads=threads,
+            io_binding_shape=input_shape)
+    benchmark_predictors(predictors, input_shape, repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: Farmer Li
+# @Date: 2021-03-10
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+
+import click
+import numpy as np
+import pandas as pd
+
+RECORD_CACHE_DIR = Path('.cache/records')
+META_FILE_NAME = 'meta.json'
+
+
+def read_header(file_path: Path):
+    with Path(file_path).open('r') as f:
+        return f.readline().rstrip('\n')
+
+
+def record_cache_key(file_path: Path):
+    """Cache key of a CSV record, changes with path, mtime, size and header"""
+    file_path = Path(file_path).resolve()
+    st = file_path.stat()
+    key = f'{file_path}|{st.st_mtime_ns}|{st.st_size}|{read_header(file_path)}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def record_cache_dir(file_path: Path, cache_dir=RECORD_CACHE_DIR):
+    key = record_cache_key(file_path)
+    return Path(cache_dir) / key[:2] / key
+
+
+def build_record_cache(file_path: Path, cache_dir=RECORD_CACHE_DIR):
+    """Parse the CSV once and store every column as a .npy file"""
+    dst_dir = record_cache_dir(file_path, cache_dir)
+    df = pd.read_csv(file_path)
+    tmp_dir = dst_dir.with_name(f'{dst_dir.name}.{os.getpid()}.tmp')
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    columns = []
+    for i, name in enumerate(df.columns):
+        values = df[name].to_numpy()
+        np.save(tmp_dir / f'c{i}.npy',
+                values,
+                allow_pickle=values.dtype == object)
+        columns.append({'name': name, 'dtype': str(values.dtype)})
+    meta = {'source': str(Path(file_path).resolve()), 'columns': columns}
+    with (tmp_dir / META_FILE_NAME).open('w') as f:
+        json.dump(meta, f, indent=4)
+    try:
+        tmp_dir.rename(dst_dir)
+    except OSError:
+        # Built by another process meanwhile
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return dst_dir
+
+
+def load_record_columns(file_path: Path,
+                        usecols=None,
+                        cache_dir=RECORD_CACHE_DIR):
+    """Load columns of a CSV record from the binary cache
+
+    The cache is built on first use. Numeric columns are memory mapped
+    read-only, columns keep the order of the CSV file.
+
+    Parameters
+    ----------
+    file_path : Path
+        Path to the CSV file
+    usecols : list, optional
+        Column names to load, all columns if None
+    cache_dir : Path, optional
+        Root directory of the cache
+
+    Returns
+    -------
+    dict
+        Column name to np.ndarray
+    """
+    src_dir = record_cache_dir(file_path, cache_dir)
+    if not (src_dir / META_FILE_NAME).exists():
+        src_dir = build_record_cache(file_path, cache_dir)
+    with (src_dir / META_FILE_NAME).open('r') as f:
+        meta = json.load(f)
+
+    names = [c['name'] for c in meta['columns']]
+    if usecols is not None:
+        missing = set(usecols) - set(names)
+        if missing:
+            raise ValueError(f'Columns not found in {file_path}: {missing}')
+    res = {}
+    for i, column in enumerate(meta['columns']):
+        name = column['name']
+        if usecols is not None and name not in usecols:
+            continue
+        if column['dtype'] == 'object':
+            res[name] = np.load(src_dir / f'c{i}.npy', allow_pickle=True)
+        else:
+            res[name] = np.load(src_dir / f'c{i}.npy', mmap_mode='r')
+    return res
+
+
+def read_csv_cached(file_path: Path,
+                    usecols=None,
+                    cache_dir=RECORD_CACHE_DIR,
+                    writeable=False):
+    """Drop-in for pd.read_csv(file_path, usecols=usecols) on sensor records
+
+    Numeric columns stay memory-mapped and read-only, unless writeable is
+    set and they are copied into memory.
+    """
+    columns = load_record_columns(file_path, usecols, cache_dir)
+    if writeable:
+        return pd.DataFrame({k: np.array(v) for k, v in columns.items()})
+    return pd.DataFrame(columns, copy=False)
+
+
+@click.command()
+@click.argument('data-dir')
+@click.option('-c', '--cache-dir', default=str(RECORD_CACHE_DIR))
+def main(data_dir, cache_dir):
+    files = sorted(Path(data_dir).rglob('*.csv'))
+    file_num = len(files)
+    for i, file_path in enumerate(files, 1):
+        print(f'Caching [{i:04d}/{file_num:04d}]: {file_path}')
+        load_record_columns(file_path, cache_dir=cache_dir)
+
+
+if __name__ == '__main__':
+    main()
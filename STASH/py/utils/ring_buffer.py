@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Author: Farmer Li
+# @Date: 2021-03-12
+
+import numpy as np
+
+
+class RingBuffer():
+    """Fixed capacity FIFO queue on a preallocated NumPy array
+
+    Every value is written twice, at pos and pos + capacity, so the queued
+    data is always one contiguous slice of the storage. append, shift and
+    get_data are O(1) and get_data returns a view without copying.
+    """
+    def __init__(self, capacity, channels=None, dtype=np.float32) -> None:
+        self.capacity = capacity
+        shape = (2 * capacity, ) if channels is None else (2 * capacity,
+                                                           channels)
+        self._data = np.zeros(shape, dtype=dtype)
+        self._start = 0
+        self._size = 0
+
+    def append(self, value):
+        if self._size >= self.capacity:
+            self._start = (self._start + 1) % self.capacity
+            self._size -= 1
+        pos = (self._start + self._size) % self.capacity
+        self._data[pos] = value
+        self._data[pos + self.capacity] = value
+        self._size += 1
+
+    def shift(self, shift_len):
+        if shift_len < self._size:
+            self._start = (self._start + shift_len) % self.capacity
+            self._size -= shift_len
+        else:
+            self.reset()
+
+    def get(self, idx):
+        if idx < 0:
+            idx += self._size
+        return self._data[self._start + idx]
+
+    def get_data(self):
+        return self._data[self._start:self._start + self._size]
+
+    def reset(self):
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def size(self):
+        return len(self)
+
+    def is_full(self):
+        return self.size() >= self.capacity
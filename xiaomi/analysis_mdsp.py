@@ -18,6 +18,8 @@ import pandas as pd
 
 from activity_recognizer_demo import (analysis_result, process_df,
                                       process_log_file)
+from mdsp_log import MdspClip, MdspLog
+from time_range_probe import probe_time_range
 
 SPORTS = ['UNKNOWN', 'WALK', 'RUN', 'ELLIPTICAL', 'BIKE']
 
@@ -39,26 +41,6 @@ ACCEL_RAW_COLUMNS = [
 SPORT_COLUMNS = ['CurrentTimeMillis', 'sport']
 
 
-def get_timestamp_acc(line: str) -> tuple:
-    fields = line.strip().split('|')
-    time_timestamp = fields[0].strip().split(' ')
-    timestamp = time_timestamp[-1]
-    timestamp = int(timestamp)
-    feed_data = fields[1].strip().split(',')
-    accel_x, accel_y, accel_z = feed_data[2:]
-    timestamp_acc = (timestamp, accel_x, accel_y, accel_z)
-    return timestamp_acc
-
-
-def get_timestamp_sport(line: str) -> tuple:
-    fields = line.strip().split('|')
-    timestamp = int(fields[0].strip().split(' ')[-1])
-    sport = fields[-1].strip().split(' ')[0].split('_')[-1]
-    timestamp_sport = (timestamp, sport)
-
-    return timestamp_sport
-
-
 def plot_sport(df: pd.DataFrame):
 
     timestamp = df['CurrentTimeMillis'].values.astype(np.int)
@@ -88,31 +70,30 @@ def plot_sport(df: pd.DataFrame):
     plt.show()
 
 
+def mdsp_clip_to_dfs(clip: MdspClip) -> tuple:
+    timestamp_acc_df = pd.DataFrame(clip.accs, columns=ACCEL_RAW_COLUMNS[1:])
+    timestamp_acc_df.insert(0, 'CurrentTimeMillis', clip.acc_timestamps)
+    timestamp_sport_df = pd.DataFrame(
+        {
+            'CurrentTimeMillis': clip.sport_timestamps,
+            'sport': clip.sports
+        },
+        columns=SPORT_COLUMNS)
+    return (timestamp_acc_df, timestamp_sport_df)
+
+
 def clip_mdsp_with_timerange(mdsp_log_path: Path, timerange: tuple) -> tuple:
+    """Accel and sport lines with a timestamp in timerange, both included
+
+    The log is sorted by timestamp, the range is found by binary search and
+    only its lines are read.
+    """
     low, high = timerange[0], timerange[1]
 
-    timestamp_accs = []
-    timestamp_sports = []
-    with open(mdsp_log_path, 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            fields = line.strip().split('|')
-            timestamp = fields[0].strip().split(' ')[-1]  # not 1
-            timestamp = int(timestamp)
-            if timestamp < low:
-                continue
-            if timestamp > high:
-                break
-            if line.find('feed_data') != -1:
-                timestamp_acc = get_timestamp_acc(line)
-                timestamp_accs.append(timestamp_acc)
-            if len(fields) == 3 and line.find('MI_HAR') != -1:
-                timestamp_sport = get_timestamp_sport(line)
-                timestamp_sports.append(timestamp_sport)
-    timestamp_acc_df = pd.DataFrame(timestamp_accs, columns=ACCEL_RAW_COLUMNS)
-    timestamp_sport_df = pd.DataFrame(timestamp_sports, columns=SPORT_COLUMNS)
+    with MdspLog(mdsp_log_path) as mdsp_log:
+        clip = mdsp_log.clip(low, high)
 
-    return (timestamp_acc_df, timestamp_sport_df)
+    return mdsp_clip_to_dfs(clip)
 
 
 def plot_acc_and_sport(acc_df: pd.DataFrame, sport_df: pd.DataFrame) -> None:
@@ -122,19 +103,9 @@ def plot_acc_and_sport(acc_df: pd.DataFrame, sport_df: pd.DataFrame) -> None:
 def read_raw_feed_data(log_path: Path) -> pd.DataFrame:
     log_path = Path(log_path)
 
-    records = []
-    with open(log_path, 'r') as f:
-        line = f.readlines()
-        for i, line in enumerate(line):
-            fields = line.strip().split('|')
-            time_timestamp = fields[0].strip().split(' ')
-            timestamp = time_timestamp[-1]
-            timestamp = int(timestamp)
-            feed_data = fields[1].strip().split(',')
-            accel_x, accel_y, accel_z = feed_data[2:]
-            record = (timestamp, accel_x, accel_y, accel_z)
-            records.append(record)
-    raw_feed_data_df = pd.DataFrame(records, columns=ACCEL_RAW_COLUMNS)
+    with MdspLog(log_path) as mdsp_log:
+        clip = mdsp_log.read()
+    raw_feed_data_df, _ = mdsp_clip_to_dfs(clip)
     return raw_feed_data_df
 
 
@@ -147,9 +118,10 @@ def get_timerange(libai_record: Path) -> tuple:
 
     print(f'accel_path = {accel_path}')
 
-    accel_df = pd.read_csv(accel_path, header=1)
-    timestamp_begin = accel_df.iloc[0, 0].astype(np.int) // 1000 - 60
-    timestamp_end = accel_df.iloc[-1, 0].astype(np.int) // 1000
+    # CurrentTimeMillis of the first and last rows, after 2 header lines
+    first_ms, last_ms = probe_time_range(accel_path, header_lines=2)
+    timestamp_begin = first_ms // 1000 - 60
+    timestamp_end = last_ms // 1000
 
     return (timestamp_begin, timestamp_end)
 
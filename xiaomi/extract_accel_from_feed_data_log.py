@@ -14,6 +14,9 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+from mdsp_log import MdspLog
+from time_range_probe import probe_time_range
+
 ACCEL_LOG_COLUMNS = [
     'CurrentTimeMillis',
     'EventTimestamp(ns)',
@@ -30,54 +33,29 @@ ACCEL_RAW_COLUMNS = [
 ]
 
 
-def get_timestamp_acc(line: str) -> tuple:
-    pass
-
-
-def get_timestamp_sport(line: str) -> tuple:
-    pass
+def feed_data_to_df(acc_timestamps: np.ndarray,
+                    accs: np.ndarray) -> pd.DataFrame:
+    raw_feed_data_df = pd.DataFrame(accs, columns=ACCEL_RAW_COLUMNS[1:])
+    raw_feed_data_df.insert(0, 'timestamp', acc_timestamps)
+    return raw_feed_data_df
 
 
-def clip_mdsp_with_timerange(mdsp_log_path: Path, timerange: tuple):
+def clip_mdsp_with_timerange(mdsp_log_path: Path,
+                             timerange: tuple) -> pd.DataFrame:
+    """Accel lines with a timestamp in timerange, found by binary search"""
     low, high = timerange[0], timerange[1]
 
-    timestamp_accs = []
-    timestamp_sports = []
-    with open(mdsp_log_path, 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            fields = line.strip().split('|')
-            timestamp = fields[0].strip().split(' ')[1]
-            timestamp = int(timestamp)
-            if timestamp < low:
-                continue
-            if timestamp > high:
-                break
-            if line.find('feed_data') != -1:
-                timestamp_acc = get_timestamp_acc(line)
-                timestamp_accs.append(timestamp_acc)
-            if len(fields) == 3 and line.find('MI_HAR') != -1:
-                timestamp_sport = get_timestamp_sport(line)
-                timestamp_sports.append(timestamp_sport)
+    with MdspLog(mdsp_log_path) as mdsp_log:
+        clip = mdsp_log.clip(low, high)
+    return feed_data_to_df(clip.acc_timestamps, clip.accs)
 
 
 def read_raw_feed_data(log_path: Path) -> pd.DataFrame:
     log_path = Path(log_path)
 
-    records = []
-    with open(log_path, 'r') as f:
-        line = f.readlines()
-        for i, line in enumerate(line):
-            fields = line.strip().split('|')
-            time_timestamp = fields[0].strip().split(' ')
-            timestamp = time_timestamp[-1]
-            timestamp = int(timestamp)
-            feed_data = fields[1].strip().split(',')
-            accel_x, accel_y, accel_z = feed_data[2:]
-            record = (timestamp, accel_x, accel_y, accel_z)
-            records.append(record)
-    raw_feed_data_df = pd.DataFrame(records, columns=ACCEL_RAW_COLUMNS)
-    return raw_feed_data_df
+    with MdspLog(log_path) as mdsp_log:
+        clip = mdsp_log.read()
+    return feed_data_to_df(clip.acc_timestamps, clip.accs)
 
 
 def get_timerange(libai_record: Path) -> tuple:
@@ -86,9 +64,10 @@ def get_timerange(libai_record: Path) -> tuple:
     timestamp_key = libai_name.split('-')[0]
     accel_name = timestamp_key + '-accel-52HZ.csv'
     accel_path = libai_record / accel_name
-    accel_df = pd.read_csv(accel_path, header=1)
-    timestamp_begin = accel_df.iloc[0, 0].astype(np.int) // 1000 + 60
-    timestamp_end = accel_df.iloc[-1, 0].astype(np.int) // 1000
+    # CurrentTimeMillis of the first and last rows, after 2 header lines
+    first_ms, last_ms = probe_time_range(accel_path, header_lines=2)
+    timestamp_begin = first_ms // 1000 + 60
+    timestamp_end = last_ms // 1000
 
     return (timestamp_begin, timestamp_end)
 
@@ -165,10 +144,9 @@ def save_df_nearly(df: pd.DataFrame, log_path: Path) -> Path:
 
 
 def run(log_path: Path, libai_record: Path):
-    raw_feed_data = read_raw_feed_data(log_path)
     timerange = get_timerange(libai_record)
 
-    feed_data_cliped = clip_raw_feed_data(raw_feed_data, timerange)
+    feed_data_cliped = clip_mdsp_with_timerange(log_path, timerange)
 
     plot_timestamp(feed_data_cliped.loc[:, 'timestamp'].values, timerange)
 
@@ -0,0 +1,170 @@
+'''
+Author       : Tianzw
+Date         : 2021-03-28 14:10:52
+LastEditors  : Tianzw
+LastEditTime : 2021-03-28 19:47:15
+FilePath     : /my_github/fit_cache.py
+'''
+from datetime import datetime, timedelta
+import hashlib
+import os
+from pathlib import Path
+
+import click
+import numpy as np
+
+# Under the repo root whatever the working directory, or XIAOMI_CACHE_DIR
+CACHE_ROOT = Path(
+    os.environ.get('XIAOMI_CACHE_DIR',
+                   Path(__file__).resolve().parents[1] / '.cache'))
+FIT_CACHE_DIR = CACHE_ROOT / 'fit'
+FIT_CACHE_VERSION = 2
+FIT_RECORD_FIELDS = ('heart_rate', 'distance')
+FIT_EPOCH = datetime(1970, 1, 1)
+GARMIN_UTC_OFFSET = timedelta(hours=8)
+
+
+def fit_cache_key(fit_path: Path, fields=FIT_RECORD_FIELDS) -> str:
+    """Cache key of a FIT file, changes with path, mtime, size and fields"""
+    fit_path = Path(fit_path).resolve()
+    st = fit_path.stat()
+    key = (f'{FIT_CACHE_VERSION}|{fit_path}|{st.st_mtime_ns}|{st.st_size}|'
+           f'{",".join(fields)}')
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def fit_cache_file(fit_path: Path,
+                   fields=FIT_RECORD_FIELDS,
+                   cache_dir=FIT_CACHE_DIR) -> Path:
+    key = fit_cache_key(fit_path, fields)
+    return Path(cache_dir) / key[:2] / f'{key}.npz'
+
+
+def decode_fit_records(fit_path: Path, fields=FIT_RECORD_FIELDS) -> dict:
+    """Columns of the record messages of a FIT file
+
+    Only the values of timestamp and of fields are kept, missing or invalid
+    values are NaN. Timestamps are the naive UTC datetimes of fitparse as
+    seconds since 1970.
+    """
+    import fitparse
+
+    # Corrupt or truncated files raise while decoding and are never cached
+    fit_file = fitparse.FitFile(str(fit_path))
+    names = ('timestamp', ) + tuple(fields)
+    rows = []
+    for record in fit_file.get_messages('record'):
+        values = dict.fromkeys(names)
+        for data in record:
+            if data.name in values:
+                values[data.name] = data.value
+        timestamp = values['timestamp']
+        if timestamp is not None:
+            values['timestamp'] = (timestamp - FIT_EPOCH).total_seconds()
+        rows.append([np.nan if values[n] is None else values[n]
+                     for n in names])
+    columns = np.array(rows, dtype=float).reshape(-1, len(names))
+    return {name: columns[:, i] for i, name in enumerate(names)}
+
+
+def build_fit_cache(fit_path: Path,
+                    fields=FIT_RECORD_FIELDS,
+                    cache_dir=FIT_CACHE_DIR) -> Path:
+    dst_file = fit_cache_file(fit_path, fields, cache_dir)
+    columns = decode_fit_records(fit_path, fields)
+    dst_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = dst_file.with_name(f'{dst_file.stem}.{os.getpid()}.tmp.npz')
+    np.savez(tmp_file, **columns)
+    tmp_file.replace(dst_file)
+    return dst_file
+
+
+def load_fit_records(fit_path: Path,
+                     fields=FIT_RECORD_FIELDS,
+                     cache_dir=FIT_CACHE_DIR) -> dict:
+    """Columns of decode_fit_records, decoded once and then cached"""
+    cache_file = fit_cache_file(fit_path, fields, cache_dir)
+    if not cache_file.exists():
+        build_fit_cache(fit_path, fields, cache_dir)
+    with np.load(cache_file) as f:
+        return {name: f[name] for name in f.files}
+
+
+def to_local_timestamps(seconds: np.ndarray,
+                        utc_offset=GARMIN_UTC_OFFSET) -> np.ndarray:
+    """Same as (datetime + utc_offset).timestamp() on every naive datetime
+
+    timestamp() reads naive datetimes as local time, the local offset is
+    looked up once unless it changes within the array.
+    """
+    seconds = np.asarray(seconds, dtype=float)
+    if len(seconds) == 0:
+        return seconds
+
+    def local_timestamp(s):
+        return (FIT_EPOCH + timedelta(seconds=float(s)) +
+                utc_offset).timestamp()
+
+    first_shift = local_timestamp(seconds[0]) - seconds[0]
+    last_shift = local_timestamp(seconds[-1]) - seconds[-1]
+    if first_shift == last_shift:
+        return seconds + first_shift
+    return np.array([local_timestamp(s) for s in seconds])
+
+
+def get_fit_heartrates(fit_path: Path,
+                       utc_offset=GARMIN_UTC_OFFSET,
+                       cache_dir=FIT_CACHE_DIR) -> np.ndarray:
+    """(timestamp, heart_rate) rows of the records having both"""
+    records = load_fit_records(fit_path, cache_dir=cache_dir)
+    valid = ~np.isnan(records['timestamp']) & ~np.isnan(
+        records['heart_rate'])
+    timestamps = to_local_timestamps(records['timestamp'][valid], utc_offset)
+    return np.column_stack((timestamps, records['heart_rate'][valid]))
+
+
+def get_fit_info(fit_path: Path,
+                 utc_offset=GARMIN_UTC_OFFSET,
+                 cache_dir=FIT_CACHE_DIR) -> tuple:
+    """(start_date_str, start_timestamp, stop_timestamp, seconds, distance)
+
+    From the first and last record timestamps and the last record distance,
+    None for what is not there.
+    """
+    records = load_fit_records(fit_path, cache_dir=cache_dir)
+    timestamps = records['timestamp'][~np.isnan(records['timestamp'])]
+    distances = records['distance'][~np.isnan(records['distance'])]
+
+    start_date_str, start_timestamp, stop_timestamp, seconds = (None, None,
+                                                                None, None)
+    if len(timestamps) > 0:
+        start_datetime = FIT_EPOCH + timedelta(
+            seconds=float(timestamps[0])) + utc_offset
+        start_date_str = start_datetime.date().isoformat()
+        start_timestamp, stop_timestamp = (int(ts) for ts in
+                                           to_local_timestamps(
+                                               timestamps[[0, -1]],
+                                               utc_offset))
+        seconds = stop_timestamp - start_timestamp
+    distance = None
+    if len(distances) > 0:
+        distance = float(distances[-1])
+    return (start_date_str, start_timestamp, stop_timestamp, seconds,
+            distance)
+
+
+@click.command()
+@click.argument('fit-dir')
+@click.option('-c', '--cache-dir', default=str(FIT_CACHE_DIR))
+def main(fit_dir: str, cache_dir: str):
+    """Fill the cache with every FIT file under a directory"""
+    fit_paths = sorted(Path(fit_dir).rglob('*.fit'))
+    for i, fit_path in enumerate(fit_paths):
+        if fit_cache_file(fit_path, cache_dir=cache_dir).exists():
+            continue
+        print(f'Decoding ({i + 1} / {len(fit_paths)}): {fit_path.name}')
+        build_fit_cache(fit_path, cache_dir=cache_dir)
+
+
+if __name__ == '__main__':
+    main()
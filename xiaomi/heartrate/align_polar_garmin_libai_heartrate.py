@@ -1,13 +1,16 @@
 from datetime import datetime, timedelta
 from pathlib import Path
+import sys
 
 import click
-import fitparse
 from matplotlib import ticker
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from fit_cache import get_fit_heartrates
+
 UTC_OFFSET = timedelta(hours=8)
 GARMIN_FIT_COLUMNS = [
     'cadence', 'distance', 'enhanced_altitude', 'enhanced_speed',
@@ -25,6 +28,8 @@ POLAR_CSV_PREFIX = 'polar_'
 LIBAI_HEARTRATE_HEADER_LINE = 1
 GARMIN_HEARTRATE_HEADER_LINE = 2
 
+DELAY_LENGTH = 20  # seconds
+
 
 @ticker.FuncFormatter
 def func(x, pos) -> None:
@@ -57,25 +62,9 @@ def parse_garmin_fit(garmin_fit_path: str, is_save=False) -> pd.DataFrame:
     assert garmin_fit_path is not None
     assert Path(garmin_fit_path).exists()
 
-    garmin_fit_path = str(garmin_fit_path)
-
-    garmin_fit_file = fitparse.FitFile(garmin_fit_path)
-
-    records = []
-    for i, fields in enumerate(garmin_fit_file.get_messages('record')):
-        timestamp, heartrate = None, None
-        for data in fields:
-            name, value = data.name, data.value
-            if name == 'timestamp':
-                value += UTC_OFFSET
-                value = value.timestamp()
-                timestamp = value
-            elif name == 'heart_rate':
-                heartrate = value
-        if timestamp is not None and heartrate is not None:
-            records.append((timestamp, heartrate))
-
+    records = get_fit_heartrates(garmin_fit_path, UTC_OFFSET)
     garmin_df = pd.DataFrame(records, columns=['timestamp', 'heartrate'])
+    garmin_df['heartrate'] = garmin_df['heartrate'].astype(int)
 
     if is_save:
         save_garmin_df_nearly(garmin_df, garmin_fit_path)
@@ -226,26 +215,26 @@ def plot_libai_garmin_polar_heartrates(libai_heartrates: np.ndarray,
     return
 
 
-def get_point_wise_error(polar_heartrates: np.ndarray,
-                         target_heartrates: np.ndarray) -> tuple:
-    timestamp_set = set(polar_heartrates[:, 0]) & set(target_heartrates[:, 0])
+def get_common_index(polar_timestamps: np.ndarray,
+                     target_timestamps: np.ndarray) -> tuple:
+    """Rows of the first sample of every timestamp found in both, in order"""
+    polar_unique, polar_first = np.unique(polar_timestamps,
+                                          return_index=True)
+    target_unique, target_first = np.unique(target_timestamps,
+                                            return_index=True)
+    polar_index = np.sort(polar_first[np.isin(polar_unique, target_unique)])
+    target_index = np.sort(target_first[np.isin(target_unique,
+                                                polar_unique)])
+    return polar_index, target_index
 
-    polar_mask = [False] * len(polar_heartrates)
-    timestamp_visited = set()
-    for i, timestamp in enumerate(polar_heartrates[:, 0]):
-        if timestamp in timestamp_set and timestamp not in timestamp_visited:
-            polar_mask[i] = True
-            timestamp_visited.add(timestamp)
 
-    target_mask = [False] * len(target_heartrates)
-    timestamp_visited.clear()
-    for i, timestamp in enumerate(target_heartrates[:, 0]):
-        if timestamp in timestamp_set and timestamp not in timestamp_visited:
-            target_mask[i] = True
-            timestamp_visited.add(timestamp)
+def get_point_wise_error(polar_heartrates: np.ndarray,
+                         target_heartrates: np.ndarray) -> tuple:
+    polar_index, target_index = get_common_index(polar_heartrates[:, 0],
+                                                 target_heartrates[:, 0])
 
-    polar_heartrate = polar_heartrates[polar_mask][:, 1]
-    target_heartrate = target_heartrates[target_mask][:, 1]
+    polar_heartrate = polar_heartrates[polar_index, 1]
+    target_heartrate = target_heartrates[target_index, 1]
 
     error = np.abs(target_heartrate - polar_heartrate)
     error_mean = error.mean()
@@ -257,6 +246,51 @@ def get_point_wise_error(polar_heartrates: np.ndarray,
     return (error_mean, error_20, error_50, error_80, error_max)
 
 
+def get_shifted_mean_errors(polar_heartrates: np.ndarray,
+                            target_heartrates: np.ndarray,
+                            shifts: np.ndarray) -> np.ndarray:
+    """Mean point-wise error with target timestamps moved by every shift
+
+    Polar heartrates are put on a 1 s grid, keeping the first sample of
+    every second like get_point_wise_error, so every shift is one lookup
+    of the target timestamps. NaN where no timestamps are in common.
+    """
+    polar_timestamps, polar_first = np.unique(polar_heartrates[:, 0],
+                                              return_index=True)
+    target_timestamps, target_first = np.unique(target_heartrates[:, 0],
+                                                return_index=True)
+    target_heartrate = target_heartrates[target_first, 1]
+
+    start = polar_timestamps[0]
+    grid_len = polar_timestamps[-1] - start + 1
+    polar_grid = np.zeros(grid_len, dtype=polar_heartrates.dtype)
+    polar_valid = np.zeros(grid_len, dtype=bool)
+    polar_grid[polar_timestamps - start] = polar_heartrates[polar_first, 1]
+    polar_valid[polar_timestamps - start] = True
+
+    errors = np.full(len(shifts), np.nan)
+    for i, shift in enumerate(shifts):
+        pos = target_timestamps + (shift - start)
+        matched = (pos >= 0) & (pos < grid_len)
+        matched[matched] = polar_valid[pos[matched]]
+        if not matched.any():
+            continue
+        error = np.abs(target_heartrate[matched] - polar_grid[pos[matched]])
+        errors[i] = error.mean()
+    return errors
+
+
+def refine_delay(delays: np.ndarray, errors: np.ndarray, best: int) -> float:
+    """Sub-second delay from a parabola through the errors around the best"""
+    if 0 < best < len(delays) - 1:
+        error_before, error, error_after = errors[best - 1:best + 2]
+        curvature = error_before - 2 * error + error_after
+        if np.isfinite(curvature) and curvature > 0:
+            return float(delays[best] + 0.5 *
+                         (error_before - error_after) / curvature)
+    return float(delays[best])
+
+
 def compare_polar_libai_garmin_heartrate(libai_heartrates,
                                          libai_heartrates_adjusted,
                                          garmin_heartrates,
@@ -288,28 +322,29 @@ def compare_polar_libai_garmin_heartrate(libai_heartrates,
 
 
 def get_best_delay(polar_heartrates: np.ndarray,
-                   target_heartrates: np.ndarray) -> tuple:
-    delay_length = 20
-
-    best_delay = 0
-    min_mean_error = np.inf
-    for i in range(-delay_length, delay_length + 1, 1):
-        target_heartrates_adjust = target_heartrates.copy()
-        target_heartrates_adjust[:, 0] += i
-        point_wise_error = get_point_wise_error(polar_heartrates,
-                                                target_heartrates_adjust)
-        if point_wise_error[0] < min_mean_error:
-            best_delay = i
-            min_mean_error = point_wise_error[0]
-            # print(f'best_delay, error = {best_delay}, {point_wise_error}')
-    return (best_delay, min_mean_error)
-
-
-def adjust_garmin_libai_heartrates(polar_heartrates, garmin_heartrates,
-                                   libai_heartrates) -> tuple:
-    garmin_delay = get_best_delay(polar_heartrates, garmin_heartrates)
-
-    libai_delay = get_best_delay(polar_heartrates, libai_heartrates)
+                   target_heartrates: np.ndarray,
+                   delay_length=DELAY_LENGTH) -> tuple:
+    """(best_delay, min_mean_error, refined_delay) of target in seconds"""
+    delays = np.arange(-delay_length, delay_length + 1)
+    errors = get_shifted_mean_errors(polar_heartrates, target_heartrates,
+                                     delays)
+    if np.all(np.isnan(errors)):
+        return (0, np.inf, 0.0)
+
+    best = int(np.nanargmin(errors))
+    return (int(delays[best]), errors[best],
+            refine_delay(delays, errors, best))
+
+
+def adjust_garmin_libai_heartrates(polar_heartrates,
+                                   garmin_heartrates,
+                                   libai_heartrates,
+                                   delay_length=DELAY_LENGTH) -> tuple:
+    garmin_delay = get_best_delay(polar_heartrates, garmin_heartrates,
+                                  delay_length)
+
+    libai_delay = get_best_delay(polar_heartrates, libai_heartrates,
+                                 delay_length)
 
     print(f'garmin_delay = {garmin_delay}')
     print(f'libai_delay = {libai_delay}')
@@ -323,7 +358,7 @@ def adjust_garmin_libai_heartrates(polar_heartrates, garmin_heartrates,
     return (garmin_heartrates_adjusted, libai_heartrates_adjusted)
 
 
-def run(libai_record: str) -> None:
+def run(libai_record: str, delay_length=DELAY_LENGTH) -> None:
     libai_record = Path(libai_record)
 
     (libai_heartrate_path, garmin_heartrate_path, polar_heartrate_path
@@ -335,7 +370,7 @@ def run(libai_record: str) -> None:
 
     (garmin_heartrates_adjusted,
      libai_heartrates_adjusted) = adjust_garmin_libai_heartrates(
-         polar_heartrates, garmin_heartrates, libai_heartrates)
+         polar_heartrates, garmin_heartrates, libai_heartrates, delay_length)
 
     plot_libai_garmin_polar_heartrates(libai_heartrates,
                                        libai_heartrates_adjusted,
@@ -351,8 +386,13 @@ def run(libai_record: str) -> None:
 
 @click.command()
 @click.argument('libai-record')
-def main(libai_record: str):
-    run(libai_record)
+@click.option('-l',
+              '--delay-length',
+              type=int,
+              default=DELAY_LENGTH,
+              help='Search delays in [-l, l] seconds')
+def main(libai_record: str, delay_length: int):
+    run(libai_record, delay_length)
 
 
 if __name__ == '__main__':
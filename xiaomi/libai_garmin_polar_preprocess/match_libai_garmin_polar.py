@@ -3,12 +3,15 @@ from datetime import datetime, timedelta
 from enum import Enum, unique
 from pathlib import Path
 import shutil
+import sys
 
 import click
-import fitparse
 import numpy as np
 import pandas as pd
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from fit_cache import get_fit_info
+
 GARMIN_UTC_OFFSET = timedelta(hours=8)
 
 LOG_DIR = Path(__file__).parent / 'log'
@@ -125,32 +128,8 @@ def read_info_from_libai_accel(libai_accel_path: Path) -> RecordInfo:
 
 
 def read_info_from_garmin_fit(garmin_fit_path: Path) -> RecordInfo:
-    garmin_fit_path = str(garmin_fit_path)
-
-    garmin_fit_opened = fitparse.FitFile(garmin_fit_path)
-
-    start_datetime, stop_datetime = None, None
-    distance = None
-    for record in garmin_fit_opened.get_messages('record'):
-        for data in record:
-            name, value = data.name, data.value
-            if name == 'timestamp':
-                if start_datetime is None:
-                    start_datetime = value
-                stop_datetime = value
-            if name == 'distance':
-                distance = value
-    (start_timestamp, stop_timestamp, start_date_str, seconds) = (None, None,
-                                                                  None, None)
-    if start_datetime is not None:
-        start_datetime += GARMIN_UTC_OFFSET
-        start_date_str = start_datetime.date().isoformat()
-        start_timestamp = int(start_datetime.timestamp())
-    if stop_datetime is not None:
-        stop_datetime += GARMIN_UTC_OFFSET
-        stop_timestamp = int(stop_datetime.timestamp())
-    if isinstance(start_timestamp, int) and isinstance(stop_timestamp, int):
-        seconds = stop_timestamp - start_timestamp
+    (start_date_str, start_timestamp, stop_timestamp, seconds,
+     distance) = get_fit_info(garmin_fit_path, GARMIN_UTC_OFFSET)
     sport_name = None
 
     record_info = RecordInfo(start_date_str, start_timestamp, stop_timestamp,
@@ -11,18 +11,25 @@ from enum import Enum, unique
 import os
 from pathlib import Path
 import shutil
+import sqlite3
 
 import click
-import fitparse
 import numpy as np
 import pandas as pd
 
+from fit_cache import get_fit_info
+from record_catalog import (CATALOG_PATH, connect_catalog, query_records,
+                            update_catalog)
+from time_range_probe import probe_time_range
+from timestamp_join import overlap_indices_by
+
 GARMIN_UTC_OFFSET = timedelta(hours=8)
 
 RecordInfo = namedtuple('RecordInfo', [
     'date', 'start_timestamp', 'stop_timestamp', 'seconds', 'sport_name',
-    'distance'
-])
+    'distance', 'sample_rate'
+],
+                        defaults=(None, ))
 
 
 @unique
@@ -89,21 +96,6 @@ def save_df_to_log(df, df_name: str):
     print(f'Saved: {df_path}\n')
 
 
-def arg_nearest_in_sorted(value, arr_sorted: np.ndarray) -> int:
-    i = np.searchsorted(arr_sorted, value)
-
-    if i == len(arr_sorted):
-        return i - 1
-
-    if i == 0:
-        return 0
-
-    if abs(arr_sorted[i - 1] - value) < abs(arr_sorted[i] - value):
-        return i - 1
-
-    return i
-
-
 def read_info_from_libai_accel(libai_accel_path: Path) -> RecordInfo:
 
     libai_accel_path = Path(libai_accel_path)
@@ -112,13 +104,12 @@ def read_info_from_libai_accel(libai_accel_path: Path) -> RecordInfo:
     start_date_str = None
     sport_name, distance = None, None
 
-    libai_accel_df = pd.read_csv(libai_accel_path,
-                                 header=LIBAI_ACCEL_HEADER_LINE)
-
-    last = libai_accel_df.index[-1]
-
-    start_timestamp = libai_accel_df.loc[0, 'CurrentTimeMillis'] // 1000
-    stop_timestamp = libai_accel_df.loc[last, 'CurrentTimeMillis'] // 1000
+    # CurrentTimeMillis of the first and last rows, after the header
+    start_ms, stop_ms = probe_time_range(
+        libai_accel_path, header_lines=LIBAI_ACCEL_HEADER_LINE + 1)
+    if start_ms is not None:
+        start_timestamp = start_ms // 1000
+        stop_timestamp = stop_ms // 1000
 
     if start_timestamp and stop_timestamp:
         seconds = stop_timestamp - start_timestamp
@@ -126,38 +117,20 @@ def read_info_from_libai_accel(libai_accel_path: Path) -> RecordInfo:
         start_date_str = datetime.fromtimestamp(
             start_timestamp).date().isoformat()
 
+    # Nominal rate in the file name, like 'accel-52HZ.csv'
+    sample_rate = None
+    rate = libai_accel_path.stem.split('-')[-1].upper()
+    if rate.endswith('HZ') and rate[:-2].isdigit():
+        sample_rate = float(rate[:-2])
+
     record_info = RecordInfo(start_date_str, start_timestamp, stop_timestamp,
-                             seconds, sport_name, distance)
+                             seconds, sport_name, distance, sample_rate)
     return record_info
 
 
 def read_info_from_garmin_fit(garmin_fit_path: Path) -> RecordInfo:
-    garmin_fit_path = str(garmin_fit_path)
-
-    garmin_fit_opened = fitparse.FitFile(garmin_fit_path)
-
-    start_datetime, stop_datetime = None, None
-    distance = None
-    for record in garmin_fit_opened.get_messages('record'):
-        for data in record:
-            name, value = data.name, data.value
-            if name == 'timestamp':
-                if start_datetime is None:
-                    start_datetime = value
-                stop_datetime = value
-            if name == 'distance':
-                distance = value
-    (start_timestamp, stop_timestamp, start_date_str, seconds) = (None, None,
-                                                                  None, None)
-    if start_datetime is not None:
-        start_datetime += GARMIN_UTC_OFFSET
-        start_date_str = start_datetime.date().isoformat()
-        start_timestamp = int(start_datetime.timestamp())
-    if stop_datetime is not None:
-        stop_datetime += GARMIN_UTC_OFFSET
-        stop_timestamp = int(stop_datetime.timestamp())
-    if isinstance(start_timestamp, int) and isinstance(stop_timestamp, int):
-        seconds = stop_timestamp - start_timestamp
+    (start_date_str, start_timestamp, stop_timestamp, seconds,
+     distance) = get_fit_info(garmin_fit_path, GARMIN_UTC_OFFSET)
     sport_name = None
 
     record_info = RecordInfo(start_date_str, start_timestamp, stop_timestamp,
@@ -197,87 +170,71 @@ def read_info_from_polar_csv(polar_csv_path: Path) -> RecordInfo:
     return record_info
 
 
-def collect_libai_accel_infos(libai_clean: Path) -> pd.DataFrame:
+def collect_libai_accel_infos(libai_clean: Path,
+                              catalog: sqlite3.Connection) -> pd.DataFrame:
     libai_clean = Path(libai_clean)
 
-    libai_accel_infos = []
-    for libai_accel_path in libai_clean.rglob(f'*{LIBAI_ACCEL_SUFFIX}'):
-        print(f'Collecting libai accel info: {libai_accel_path.name}')
-        libai_name = libai_accel_path.parent.name
-        libai_tag = libai_name.split('-')[-4]
-        garmin_tag = libai_name.split('-')[-2]
-        polar_tag = libai_name.split('_')[-1]
-        accel_name = libai_accel_path.name
-        libai_accel_info = read_info_from_libai_accel(libai_accel_path)
-
-        msg = (libai_tag, garmin_tag, polar_tag, accel_name, *libai_accel_info,
-               libai_accel_path)
-        libai_accel_infos.append(msg)
-
-    libai_accel_collected = pd.DataFrame(libai_accel_infos,
-                                         columns=LIBAI_ACCEL_COLLECTED_COLUMNS)
+    update_catalog(catalog, libai_clean, 'libai', f'*{LIBAI_ACCEL_SUFFIX}',
+                   read_info_from_libai_accel)
+    records = query_records(catalog, 'libai', libai_clean)
 
-    libai_accel_collected.sort_values(by='start_timestamp', inplace=True)
+    libai_names = records['record_name'].str
+    libai_accel_collected = records.assign(
+        libai_tag=libai_names.split('-').str[-4],
+        garmin_tag=libai_names.split('-').str[-2],
+        polar_tag=libai_names.split('_').str[-1],
+        path=records['path'].map(Path))[LIBAI_ACCEL_COLLECTED_COLUMNS]
 
     print(f'Succeed: collect libai accel info from {libai_clean}\n')
 
     return libai_accel_collected
 
 
-def collect_garmin_fit_infos(garmin_clean: Path) -> pd.DataFrame:
-    garmin_clean = Path(garmin_clean)
-
-    garmin_fit_infos = []
-    for garmin_fit_path in garmin_clean.rglob(f'*{GARMIN_FIT_SUFFIX}'):
-        print(f'Collecting garmin fit info: {garmin_fit_path.name}')
-        garmin_tag = garmin_fit_path.parents[0].name
-        garmin_name = garmin_fit_path.name
-        garmin_fit_info = read_info_from_garmin_fit(garmin_fit_path)
-        msg = (garmin_tag, garmin_name, *garmin_fit_info, garmin_fit_path)
-        garmin_fit_infos.append(msg)
-
-    garmin_fit_collected = pd.DataFrame(garmin_fit_infos,
-                                        columns=GARMIN_FIT_COLLECTED_COLUMNS)
-    garmin_fit_collected.sort_values(by='start_timestamp', inplace=True)
+def collect_target_infos(target_clean: Path, catalog: sqlite3.Connection,
+                         garmin_or_polar: str, suffix: str, reader,
+                         columns: list) -> pd.DataFrame:
+    """Garmin or polar files under target_clean, tagged by their directory"""
+    target_clean = Path(target_clean)
 
-    print(f'Succeed: collect garmin fit info from {garmin_clean}\n')
+    update_catalog(catalog, target_clean, garmin_or_polar, f'*{suffix}',
+                   reader)
+    records = query_records(catalog, garmin_or_polar, target_clean)
 
-    return garmin_fit_collected
+    target_collected = records.assign(
+        tag=records['record_name'],
+        path=records['path'].map(Path))[columns]
 
+    print(f'Succeed: collect {garmin_or_polar} info from {target_clean}\n')
 
-def collect_polar_csv_infos(polar_clean: Path) -> pd.DataFrame:
-    polar_clean = Path(polar_clean)
+    return target_collected
 
-    polar_csv_infos = []
-    for polar_csv_path in polar_clean.rglob(f'*{POLAR_CSV_SUFFIX}'):
-        print(f'Collect polar csv info: {polar_csv_path.name}')
-        polar_tag = polar_csv_path.parents[0].name
-        polar_name = polar_csv_path.name
-        polar_csv_info = read_info_from_polar_csv(polar_csv_path)
-        msg = (polar_tag, polar_name, *polar_csv_info, polar_csv_path)
-        polar_csv_infos.append(msg)
 
-    polar_csv_collected = pd.DataFrame(polar_csv_infos,
-                                       columns=POLAR_CSV_COLLECTED_COLUMNS)
-    polar_csv_collected.sort_values(by='start_timestamp', inplace=True)
+def collect_garmin_fit_infos(garmin_clean: Path,
+                             catalog: sqlite3.Connection) -> pd.DataFrame:
+    return collect_target_infos(garmin_clean, catalog, 'garmin',
+                                GARMIN_FIT_SUFFIX, read_info_from_garmin_fit,
+                                GARMIN_FIT_COLLECTED_COLUMNS)
 
-    print(f'Succeed: collect polar csv info from {polar_clean}\n')
 
-    return polar_csv_collected
+def collect_polar_csv_infos(polar_clean: Path,
+                            catalog: sqlite3.Connection) -> pd.DataFrame:
+    return collect_target_infos(polar_clean, catalog, 'polar',
+                                POLAR_CSV_SUFFIX, read_info_from_polar_csv,
+                                POLAR_CSV_COLLECTED_COLUMNS)
 
 
-def get_insert_info(accel_start_timestamp: int, accel_stop_timestamp: int,
-                    target_start_timestamp: int,
-                    target_stop_timestamp: int) -> tuple:
+def get_insert_info(accel_start_timestamp, accel_stop_timestamp,
+                    target_start_timestamp, target_stop_timestamp) -> tuple:
+    """Overlap of targets with libai records, on scalars or arrays"""
     accel_seconds = accel_stop_timestamp - accel_start_timestamp
     target_seconds = target_stop_timestamp - accel_start_timestamp
 
-    if target_start_timestamp < accel_start_timestamp:
-        overlap = target_stop_timestamp - accel_start_timestamp
-        overlap = min(overlap, accel_seconds)
-    elif target_start_timestamp >= accel_start_timestamp:
-        overlap = accel_stop_timestamp - target_start_timestamp
-        overlap = min(overlap, target_seconds)
+    overlap = np.where(
+        target_start_timestamp < accel_start_timestamp,
+        np.minimum(target_stop_timestamp - accel_start_timestamp,
+                   accel_seconds),
+        np.minimum(accel_stop_timestamp - target_start_timestamp,
+                   target_seconds))
 
     overlap_rate = (overlap / accel_seconds) * 100
 
@@ -293,76 +250,53 @@ def insert_target_into_libai_record(target_collected: pd.DataFrame,
                                     columns: list) -> pd.DataFrame:
     libai_accel_collected.sort_values(by='start_timestamp', inplace=True)
 
-    inserted_infos = {}
-    for i, row in target_collected.iterrows():
-        target_path = Path(row['path'])
-        target_tag = row['tag']
-        target_start_timestamp = row['start_timestamp']
-        target_stop_timestamp = row['stop_timestamp']
-
-        if garmin_or_polar == 'garmin':
-            libai_accel_part = libai_accel_collected[
-                libai_accel_collected['garmin_tag'] == target_tag].copy()
-        elif garmin_or_polar == 'polar':
-            libai_accel_part = libai_accel_collected[
-                libai_accel_collected['polar_tag'] == target_tag].copy()
-
-        if libai_accel_part.empty:
-            # TODO: process target without match tag libai accel
-            continue
-        libai_accel_part.sort_values(by='start_timestamp', inplace=True)
-        libai_accel_part.reset_index(drop=True, inplace=True)
-
-        accel_nearest_index = arg_nearest_in_sorted(
-            target_start_timestamp, libai_accel_part['start_timestamp'].values)
-
-        libai_accel_path = Path(
-            libai_accel_part.loc[accel_nearest_index, 'path'])
-        accel_start_timestamp = libai_accel_part.loc[accel_nearest_index,
-                                                     'start_timestamp']
-        accel_stop_timestamp = libai_accel_part.loc[accel_nearest_index,
-                                                    'stop_timestamp']
-        libai_tag = libai_accel_part.loc[accel_nearest_index, 'libai_tag']
-
-        target_name = target_path.name
-        libai_record = libai_accel_path.parent
-        libai_name = libai_record.name
-
-        (overlap, overlap_rate, start_timestamp_diff,
-         stop_timestamp_diff) = get_insert_info(accel_start_timestamp,
-                                                accel_stop_timestamp,
-                                                target_start_timestamp,
-                                                target_stop_timestamp)
-
-        if overlap <= 0:
-            print(f'Failure match: overlap = {overlap}, '
-                  f'target_name = {target_name}')
-            continue
-        insert_msg = (target_name, overlap, overlap_rate, target_tag,
-                      libai_tag, libai_name, start_timestamp_diff,
-                      stop_timestamp_diff, accel_start_timestamp,
-                      accel_stop_timestamp, target_start_timestamp,
-                      target_stop_timestamp, target_path, libai_accel_path)
-        if libai_name in inserted_infos:
-            old_overlap = inserted_infos[libai_name][1]
-            if overlap > old_overlap:
-                # to_remove = Path(inserted_infos[libai_name][-2])
-                # os.remove(to_remove)
-                # print(f'Removed: {to_remove}')
-                # shutil.copy(target_path, libai_record)
-                # print(f'Copy {target_path.name} into {libai_record.name}')
-                # print(f'Replace "{to_remove}" with "{target_name}"')
-                inserted_infos[libai_name] = insert_msg
-            else:
-                print(f'Giveup insert {target_name} into {libai_name} '
-                      f'overlap, old_overlap = {overlap}, {old_overlap}')
-        else:
-            # shutil.copy(target_path, libai_record)
-            print(f'Copy {target_path.name} into {libai_record.name}')
-            inserted_infos[libai_name] = insert_msg
-
-    inserted_collected = pd.DataFrame(
-        [value for value in inserted_infos.values()], columns=columns)
+    # Libai record of the same tag overlapping every target, the one
+    # starting nearest if several do
+    accel_indices = overlap_indices_by(
+        target_collected['start_timestamp'].values,
+        target_collected['stop_timestamp'].values,
+        target_collected['tag'].values,
+        libai_accel_collected['start_timestamp'].values,
+        libai_accel_collected['stop_timestamp'].values,
+        libai_accel_collected[f'{garmin_or_polar}_tag'].values)
+    # TODO: process target without overlapping libai accel of the same tag
+    matched = accel_indices >= 0
+    target_part = target_collected[matched]
+    accel_part = libai_accel_collected.iloc[accel_indices[matched]]
+
+    target_paths = [Path(path) for path in target_part['path']]
+    libai_accel_paths = [Path(path) for path in accel_part['path']]
+    target_start_timestamps = target_part['start_timestamp'].values
+    target_stop_timestamps = target_part['stop_timestamp'].values
+    accel_start_timestamps = accel_part['start_timestamp'].values
+    accel_stop_timestamps = accel_part['stop_timestamp'].values
+
+    (overlap, overlap_rate, start_timestamp_diff,
+     stop_timestamp_diff) = get_insert_info(accel_start_timestamps,
+                                            accel_stop_timestamps,
+                                            target_start_timestamps,
+                                            target_stop_timestamps)
+
+    target_names = [path.name for path in target_paths]
+    libai_names = [path.parent.name for path in libai_accel_paths]
+    values = (target_names, overlap, overlap_rate, target_part['tag'].values,
+              accel_part['libai_tag'].values, libai_names,
+              start_timestamp_diff, stop_timestamp_diff,
+              accel_start_timestamps, accel_stop_timestamps,
+              target_start_timestamps, target_stop_timestamps, target_paths,
+              libai_accel_paths)
+    inserted_collected = pd.DataFrame(dict(zip(columns, values)),
+                                      columns=columns)
+    inserted_collected = inserted_collected[overlap > 0]
+
+    # One target per libai record, the first one with the largest overlap
+    best = inserted_collected.groupby('libai_name',
+                                      sort=False)['overlap'].idxmax()
+    inserted_collected = inserted_collected.loc[best.values].reset_index(
+        drop=True)
+    print(f'Inserted {len(inserted_collected)} of {len(target_collected)} '
+          f'{garmin_or_polar} files, {int(np.sum(~matched))} without '
+          f'overlapping libai record\n')
 
     return inserted_collected
 
@@ -385,67 +319,51 @@ def get_match_summary(libai_accel_collected: pd.DataFrame,
                       garmin_fit_inserted: pd.DataFrame,
                       polar_csv_inserted: pd.DataFrame,
                       match_columns=MATCH_COLUMNS) -> pd.DataFrame:
-
-    matchs = []
-
-    for i, row in libai_accel_collected.iterrows():
-        libai_tag = row['libai_tag']
-        libai_accel_path = Path(row['path'])
-        libai_record = libai_accel_path.parent
-        libai_name = libai_record.name
-
-        garmin_fit_part = garmin_fit_inserted[garmin_fit_inserted['libai_name']
-                                              == libai_name].copy()
-        polar_csv_part = polar_csv_inserted[polar_csv_inserted['libai_name'] ==
-                                            libai_name].copy()
-
-        garmin_overlap, garmin_overlap_rate, garmin_fit_path = None, None, None
-        polar_overlap, polar_overlap_rate, polar_csv_path = None, None, None
-        polar_tag, garmin_tag = None, None
-
-        if not garmin_fit_part.empty:
-            if len(garmin_fit_part) > 1:
-                pass
-            garmin_overlap = garmin_fit_part['overlap'].values[0]
-            garmin_overlap_rate = garmin_fit_part['overlap_rate'].values[0]
-            garmin_fit_path = garmin_fit_part['garmin_fit_path'].values[0]
-            garmin_tag = int(garmin_fit_part['garmin_tag'].values[0])
-        if not polar_csv_part.empty:
-            if len(polar_csv_part) > 1:
-                pass
-            polar_overlap = polar_csv_part['overlap'].values[0]
-            polar_overlap_rate = polar_csv_part['overlap_rate'].values[0]
-            polar_csv_path = polar_csv_part['polar_csv_path'].values[0]
-            polar_tag = int(polar_csv_part['polar_tag'].values[0])
-
-        match_type = None
-        if garmin_fit_path is not None:
-            if polar_csv_path is not None:
-                match_type = MatchType.VALID_RECORD.value[0]
-            else:
-                match_type = MatchType.NO_GARMIN.value[0]
-        else:
-            if polar_csv_path is not None:
-                match_type = MatchType.NO_GARMIN.value[0]
-            else:
-                match_type = MatchType.NO_POLAR_GARMIN.value[0]
-        msg = (libai_name, match_type, garmin_overlap, polar_overlap,
-               garmin_overlap_rate, polar_overlap_rate, libai_tag, garmin_tag,
-               polar_tag, libai_record, garmin_fit_path, polar_csv_path)
-        matchs.append(msg)
-
-    match_df = pd.DataFrame(matchs, columns=match_columns)
-
+    libai_records = libai_accel_collected['path'].map(lambda p: Path(p).parent)
+    match_df = pd.DataFrame({
+        'libai_name': libai_records.map(lambda p: p.name).values,
+        'libai_tag': libai_accel_collected['libai_tag'].values,
+        'libai_record': libai_records.values
+    })
+
+    for target, path_name in (('garmin', 'garmin_fit_path'),
+                              ('polar', 'polar_csv_path')):
+        inserted = garmin_fit_inserted if target == 'garmin' else (
+            polar_csv_inserted)
+        inserted = inserted.drop_duplicates('libai_name')[[
+            'libai_name', 'overlap', 'overlap_rate', path_name,
+            f'{target}_tag'
+        ]].rename(columns={
+            'overlap': f'{target}_overlap',
+            'overlap_rate': f'{target}_overlap_rate'
+        })
+        inserted[f'{target}_tag'] = pd.to_numeric(
+            inserted[f'{target}_tag']).astype('Int64')
+        match_df = match_df.merge(inserted, on='libai_name', how='left')
+
+    has_garmin = match_df['garmin_fit_path'].notna().values
+    has_polar = match_df['polar_csv_path'].notna().values
+    match_df['match_type'] = np.select(
+        [has_garmin & has_polar, has_garmin, has_polar], [
+            MatchType.VALID_RECORD.value[0], MatchType.NO_POLAR.value[0],
+            MatchType.NO_GARMIN.value[0]
+        ], MatchType.NO_POLAR_GARMIN.value[0])
+
+    match_df = match_df[match_columns]
     match_df.sort_values(by='libai_name', inplace=True)
 
     return match_df
 
 
-def run(libai_clean: Path, garmin_clean: Path,
-        polar_clean: Path) -> pd.DataFrame:
-    libai_accel_collected = collect_libai_accel_infos(libai_clean)
-    garmin_fit_collected = collect_garmin_fit_infos(garmin_clean)
-    polar_csv_collected = collect_polar_csv_infos(polar_clean)
+def run(libai_clean: Path,
+        garmin_clean: Path,
+        polar_clean: Path,
+        catalog_path=CATALOG_PATH) -> pd.DataFrame:
+    catalog = connect_catalog(catalog_path)
+    libai_accel_collected = collect_libai_accel_infos(libai_clean, catalog)
+    garmin_fit_collected = collect_garmin_fit_infos(garmin_clean, catalog)
+    polar_csv_collected = collect_polar_csv_infos(polar_clean, catalog)
+    catalog.close()
 
     garmin_fit_inserted = insert_target_into_libai_record(
         garmin_fit_collected, libai_accel_collected, 'garmin',
@@ -480,12 +398,16 @@ def run(libai_clean: Path, garmin_clean: Path,
 @click.argument('libai-cleaned')
 @click.option('-garmin', '--garmin-cleaned', required=True, type=str)
 @click.option('-polar', '--polar-cleaned', required=True, type=str)
-def main(libai_cleaned, garmin_cleaned, polar_cleaned):
+@click.option('-c',
+              '--catalog',
+              default=str(CATALOG_PATH),
+              help='SQLite catalog of the record files')
+def main(libai_cleaned, garmin_cleaned, polar_cleaned, catalog):
     libai_cleaned = Path(libai_cleaned)
     garmin_cleaned = Path(garmin_cleaned)
     polar_cleaned = Path(polar_cleaned)
 
-    run(libai_cleaned, garmin_cleaned, polar_cleaned)
+    run(libai_cleaned, garmin_cleaned, polar_cleaned, catalog)
 
 
 if __name__ == "__main__":
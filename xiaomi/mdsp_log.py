@@ -0,0 +1,213 @@
+'''
+Author       : Tianzw
+Date         : 2021-04-09 10:05:37
+LastEditors  : Tianzw
+LastEditTime : 2021-04-09 17:48:12
+FilePath     : /activity-recognition/src/py/mdsp_log.py
+'''
+from collections import namedtuple
+import hashlib
+import mmap
+import os
+from pathlib import Path
+
+import click
+import numpy as np
+
+from fit_cache import CACHE_ROOT
+
+INDEX_STEP = 1 << 16
+CHUNK_SIZE = 1 << 22
+MDSP_INDEX_DIR = CACHE_ROOT / 'mdsp_index'
+MDSP_INDEX_VERSION = 1
+
+FEED_DATA_PATTERN = b'feed_data'
+MI_HAR_PATTERN = b'MI_HAR'
+
+MdspClip = namedtuple(
+    'MdspClip', ['acc_timestamps', 'accs', 'sport_timestamps', 'sports'])
+
+
+def line_timestamp(line: bytes) -> int:
+    """Leading timestamp of a log line, the last word before the first '|'"""
+    return int(line.split(b'|', 1)[0].strip().split(b' ')[-1])
+
+
+def parse_lines(lines) -> MdspClip:
+    """Accel samples of the feed_data lines and sports of the MI_HAR lines
+
+    Accel lines are 'time ts | a,b,x,y,z', sport lines are
+    'time ts | ... | MI_HAR_SPORT ...'.
+    """
+    acc_timestamps, accs = [], []
+    sport_timestamps, sports = [], []
+    for line in lines:
+        line = line.strip()
+        fields = line.split(b'|')
+        if line.find(FEED_DATA_PATTERN) != -1:
+            acc_timestamps.append(line_timestamp(line))
+            accel_x, accel_y, accel_z = fields[1].strip().split(b',')[2:]
+            accs += (accel_x, accel_y, accel_z)
+        if len(fields) == 3 and line.find(MI_HAR_PATTERN) != -1:
+            sport_timestamps.append(line_timestamp(line))
+            sports.append(fields[-1].strip().split(b' ')[0].split(b'_')[-1])
+    return MdspClip(np.array(acc_timestamps, dtype=np.int64),
+                    np.array(accs, dtype=bytes).astype(float).reshape(-1, 3),
+                    np.array(sport_timestamps, dtype=np.int64),
+                    np.array(sports, dtype=bytes).astype(str))
+
+
+class MdspLog():
+    """A log sorted by leading timestamp, read through mmap
+
+    Clips binary search a sparse index of the first line after every
+    index_step bytes, then scan at most one step of lines. The index is
+    built on the first clip and saved in index_dir, keyed by the path, size
+    and mtime of the log, so later clips and later runs reuse it. No index
+    is saved with index_dir None.
+    """
+    def __init__(self,
+                 log_path: Path,
+                 index_step=INDEX_STEP,
+                 index_dir=MDSP_INDEX_DIR) -> None:
+        self.log_path = Path(log_path)
+        self.index_step = index_step
+        self.index_dir = index_dir
+        self._file = self.log_path.open('rb')
+        st = os.fstat(self._file.fileno())
+        self.size = st.st_size
+        self._mtime_ns = st.st_mtime_ns
+        self._mm = b''
+        if self.size > 0:
+            self._mm = mmap.mmap(self._file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        self._index = None
+
+    def close(self) -> None:
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _line_at(self, offset: int) -> tuple:
+        """Line starting at offset and the offset of the next one"""
+        end = self._mm.find(b'\n', offset)
+        if end < 0:
+            end = self.size
+        return self._mm[offset:end], end + 1
+
+    def _timestamped_line(self, offset: int, stop: int) -> tuple:
+        """First line from offset with a timestamp, (size, None) if none"""
+        while offset < stop:
+            line, next_offset = self._line_at(offset)
+            try:
+                return offset, line_timestamp(line)
+            except (ValueError, IndexError):
+                offset = next_offset
+        return self.size, None
+
+    def index_file(self) -> Path:
+        key = (f'{MDSP_INDEX_VERSION}|{self.log_path.resolve()}|{self.size}|'
+               f'{self._mtime_ns}|{self.index_step}')
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return Path(self.index_dir) / key[:2] / f'{key}.npz'
+
+    def _build_index(self) -> tuple:
+        offsets, timestamps = [], []
+        for pos in range(0, self.size, self.index_step):
+            if pos > 0:
+                # Start of the first line after pos
+                pos = self._mm.find(b'\n', pos - 1) + 1
+                if pos == 0:
+                    break
+            offset, timestamp = self._timestamped_line(pos, self.size)
+            if timestamp is None:
+                break
+            if len(offsets) == 0 or offset > offsets[-1]:
+                offsets.append(offset)
+                timestamps.append(timestamp)
+        return (np.array(offsets, dtype=np.int64),
+                np.array(timestamps, dtype=np.int64))
+
+    @property
+    def index(self) -> tuple:
+        """(offsets, timestamps) of the sparse index"""
+        if self._index is not None:
+            return self._index
+        if self.index_dir is None:
+            self._index = self._build_index()
+            return self._index
+
+        index_file = self.index_file()
+        if not index_file.exists():
+            offsets, timestamps = self._build_index()
+            index_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = index_file.with_name(
+                f'{index_file.stem}.{os.getpid()}.tmp.npz')
+            np.savez(tmp_file, offsets=offsets, timestamps=timestamps)
+            tmp_file.replace(index_file)
+        with np.load(index_file) as f:
+            self._index = (f['offsets'], f['timestamps'])
+        return self._index
+
+    def offset_of(self, timestamp: int, side='left') -> int:
+        """Offset of the first line with a timestamp >= timestamp, or >
+        timestamp with side 'right', size if there is none"""
+        offsets, timestamps = self.index
+        i = np.searchsorted(timestamps, timestamp, side=side)
+        offset = int(offsets[i - 1]) if i > 0 else 0
+        stop = int(offsets[i]) if i < len(offsets) else self.size
+        while offset < stop:
+            offset, line_ts = self._timestamped_line(offset, stop)
+            if line_ts is None:
+                break
+            if line_ts > timestamp or (side == 'left'
+                                       and line_ts == timestamp):
+                return offset
+            offset = self._line_at(offset)[1]
+        return stop
+
+    def iter_lines(self, start=0, stop=None, chunk_size=CHUNK_SIZE):
+        """Lines between two line offsets, split chunk by chunk"""
+        stop = self.size if stop is None else stop
+        pos = start
+        while pos < stop:
+            end = self._mm.find(b'\n', min(pos + chunk_size, stop) - 1,
+                                stop) + 1
+            if end <= 0:
+                end = stop
+            lines = self._mm[pos:end].split(b'\n')
+            if len(lines[-1]) == 0:
+                lines.pop()
+            yield from lines
+            pos = end
+
+    def read(self, start=0, stop=None) -> MdspClip:
+        return parse_lines(self.iter_lines(start, stop))
+
+    def clip(self, low: int, high: int) -> MdspClip:
+        """Accel samples and sports of the lines with low <= timestamp <= high
+        """
+        start = self.offset_of(low, side='left')
+        stop = self.offset_of(high, side='right')
+        return self.read(start, max(start, stop))
+
+
+@click.command()
+@click.argument('log-path')
+@click.option('-l', '--low', type=int, required=True)
+@click.option('-h', '--high', type=int, required=True)
+def main(log_path, low, high):
+    with MdspLog(log_path) as log:
+        clip = log.clip(low, high)
+    print(f'accel samples: {len(clip.acc_timestamps)}, '
+          f'sports: {len(clip.sports)}')
+
+
+if __name__ == '__main__':
+    main()
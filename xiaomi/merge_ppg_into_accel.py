@@ -11,6 +11,8 @@ import click
 import numpy as np
 import pandas as pd
 
+from timestamp_join import asof_join
+
 ACCEL_HEADER = [
     'CurrentTimeMillis', 'EventTimestamp(ns)', 'accel_x', 'accel_y', 'accel_z'
 ]
@@ -28,21 +30,6 @@ LIBAI_ACCEL_SUFFIX = '-accel-52HZ.csv'
 LIBAI_PPG_SUFFIX = '-ppg-100HZ.csv'
 
 
-def arg_nearest_in_sorted(value, arr_sorted: np.ndarray) -> int:
-    i = np.searchsorted(arr_sorted, value)
-
-    if i == len(arr_sorted):
-        return i - 1
-
-    if i == 0:
-        return 0
-
-    if abs(arr_sorted[i - 1] - value) < abs(arr_sorted[i] - value):
-        return i - 1
-
-    return i
-
-
 def get_accel_ppg_path(libai_record: Path) -> tuple:
     libai_record = Path(libai_record)
 
@@ -121,19 +108,15 @@ def preprocess_accel_ppg_values(accel: np.ndarray, ppg: np.ndarray) -> tuple:
     return accel_cliped, ppg_cliped
 
 
-def merge_ppg_into_accel(ppg: np.ndarray, accel: np.ndarray) -> np.ndarray:
-    """ align with ns """
-    accel_ns, ppg_ns = accel[:, 1], ppg[:, 1]
-
-    ppg_index = np.full_like(accel_ns, -1).astype(np.int)
-
-    for i, ns in enumerate(accel_ns):
-        nearest = arg_nearest_in_sorted(ns, ppg_ns)
-        ppg_index[i] = nearest
+def merge_ppg_into_accel(ppg: np.ndarray,
+                         accel: np.ndarray,
+                         max_gap_ns=None) -> np.ndarray:
+    """ align with ns, accel rows without ppg within max_gap_ns are dropped """
+    accel_index, ppg_index = asof_join(accel, ppg, tolerance=max_gap_ns)
 
     ppg_part = ppg[ppg_index, 2:]
 
-    accel_ppg_merged = np.hstack((accel, ppg_part))
+    accel_ppg_merged = np.hstack((accel[accel_index], ppg_part))
 
     return accel_ppg_merged
 
@@ -160,7 +143,7 @@ def save_accel_ppg_df_nearly(accel_ppg_df, accel_path: Path):
     print(f'Saved: {accel_ppg_path}')
 
 
-def process_one_record(record_path: Path):
+def process_one_record(record_path: Path, max_gap_ns=None):
     accel_path, ppg_path = get_accel_ppg_path(record_path)
 
     if not accel_path.exists() or not ppg_path.exists():
@@ -175,31 +158,37 @@ def process_one_record(record_path: Path):
         accel_values, ppg_values)
 
     accel_ppg_values = merge_ppg_into_accel(ppg_cliped_values,
-                                            accel_cliped_values)
+                                            accel_cliped_values, max_gap_ns)
 
     accel_ppg_df = convert_accel_ppg_values(accel_ppg_values)
 
     save_accel_ppg_df_nearly(accel_ppg_df, accel_path)
 
 
-def process_record_dir(record_dir: Path):
+def process_record_dir(record_dir: Path, max_gap_ns=None):
     record_dir = Path(record_dir)
     for date_str in record_dir.iterdir():
         for libai_record in date_str.iterdir():
             print(f'Processing: {libai_record.name}')
-            process_one_record(libai_record)
+            process_one_record(libai_record, max_gap_ns)
 
 
 @click.command()
 @click.argument('libai-dir')
 @click.option('-d', '--is-dir', is_flag=True, help='Directory to process')
-def main(libai_dir: str, is_dir: bool):
+@click.option('-g',
+              '--max-gap-ms',
+              type=float,
+              default=None,
+              help='Drop accel samples without ppg this close')
+def main(libai_dir: str, is_dir: bool, max_gap_ms: float):
     libai_dir = Path(libai_dir)
+    max_gap_ns = None if max_gap_ms is None else int(max_gap_ms * 1e6)
 
     if is_dir:
-        process_record_dir(libai_dir)
+        process_record_dir(libai_dir, max_gap_ns)
     else:
-        process_one_record(libai_dir)
+        process_one_record(libai_dir, max_gap_ns)
 
 
 if __name__ == '__main__':
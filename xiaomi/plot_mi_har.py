@@ -15,6 +15,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+from time_range_probe import probe_time_range
+
 SPORTS = ['UNKNOWN', 'WALK', 'RUN', 'ELLIPTICAL', 'BIKE']
 
 
@@ -24,9 +26,10 @@ def get_timerange(libai_record: Path) -> tuple:
     timestamp_key = libai_name.split('-')[0]
     accel_name = timestamp_key + '-accel-52HZ.csv'
     accel_path = libai_record / accel_name
-    accel_df = pd.read_csv(accel_path, header=1)
-    timestamp_begin = accel_df.iloc[0, 0].astype(np.int) // 1000
-    timestamp_end = accel_df.iloc[-1, 0].astype(np.int) // 1000
+    # CurrentTimeMillis of the first and last rows, after 2 header lines
+    first_ms, last_ms = probe_time_range(accel_path, header_lines=2)
+    timestamp_begin = first_ms // 1000
+    timestamp_end = last_ms // 1000
 
     return (timestamp_begin, timestamp_end)
 
@@ -0,0 +1,181 @@
+'''
+Author       : Tianzw
+Date         : 2021-03-29 09:41:26
+LastEditors  : Tianzw
+LastEditTime : 2021-03-29 17:02:58
+FilePath     : /my_github/record_catalog.py
+'''
+import json
+from pathlib import Path
+import sqlite3
+
+import click
+import pandas as pd
+
+from fit_cache import CACHE_ROOT
+
+CATALOG_PATH = CACHE_ROOT / 'record_catalog.sqlite'
+# Bumped when the columns or what the readers store change, sample_rate is
+# the nominal rate of the file name since 2
+CATALOG_VERSION = 2
+
+CATALOG_COLUMNS = [
+    'device', 'path', 'name', 'record_name', 'size', 'mtime_ns', 'date',
+    'start_timestamp', 'stop_timestamp', 'seconds', 'sport_name', 'distance',
+    'sample_rate', 'metas'
+]
+INFO_COLUMNS = [
+    'date', 'start_timestamp', 'stop_timestamp', 'seconds', 'sport_name',
+    'distance', 'sample_rate'
+]
+
+CREATE_TABLE_SQL = '''
+CREATE TABLE IF NOT EXISTS records (
+    device TEXT NOT NULL,
+    path TEXT NOT NULL,
+    name TEXT,
+    record_name TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    date TEXT,
+    start_timestamp INTEGER,
+    stop_timestamp INTEGER,
+    seconds INTEGER,
+    sport_name TEXT,
+    distance,
+    sample_rate REAL,
+    metas TEXT,
+    PRIMARY KEY (device, path)
+)
+'''
+
+
+def record_name_metas(record_name: str) -> dict:
+    """Metas of a record directory name, like record_name_metas_to_dict
+
+    Names are 'date-id-key_value-...', parts without a '_' are skipped.
+    """
+    metas = record_name.split('-')
+    res = {}
+    if len(metas) >= 2:
+        res['date'], res['id'] = metas[0], metas[1]
+    for meta in metas[2:]:
+        kv = meta.split('_', 1)
+        if len(kv) == 2:
+            res[kv[0]] = kv[1]
+    return res
+
+
+def connect_catalog(catalog_path=CATALOG_PATH) -> sqlite3.Connection:
+    """Open the catalog, its rows are dropped when written by another
+    CATALOG_VERSION and read again on the next update"""
+    catalog_path = Path(catalog_path)
+    catalog_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(catalog_path))
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version != CATALOG_VERSION:
+        conn.execute('DROP TABLE IF EXISTS records')
+        conn.execute(f'PRAGMA user_version = {CATALOG_VERSION}')
+    conn.execute(CREATE_TABLE_SQL)
+    conn.commit()
+    return conn
+
+
+def _path_range(root: Path) -> tuple:
+    """Bounds of the paths under root, '0' follows '/'"""
+    root = str(Path(root).resolve())
+    return f'{root}/', f'{root}0'
+
+
+def _to_sql_value(value):
+    # numpy scalars to python ones
+    return value.item() if hasattr(value, 'item') else value
+
+
+def update_catalog(conn: sqlite3.Connection, root: Path, device: str,
+                   pattern: str, reader) -> dict:
+    """Catalog the files matching pattern under root
+
+    Only files that are new or whose size or mtime changed are read with
+    reader, which returns a RecordInfo or a dict of INFO_COLUMNS. Rows of
+    files that are gone are removed.
+
+    Returns
+    -------
+    dict
+        Number of files found, read and removed
+    """
+    low, high = _path_range(root)
+    cataloged = {
+        path: (size, mtime_ns)
+        for path, size, mtime_ns in conn.execute(
+            'SELECT path, size, mtime_ns FROM records '
+            'WHERE device = ? AND path >= ? AND path < ?', (device, low, high))
+    }
+
+    found = set()
+    changed = []
+    for file_path in Path(root).resolve().rglob(pattern):
+        st = file_path.stat()
+        path = str(file_path)
+        found.add(path)
+        if cataloged.get(path) != (st.st_size, st.st_mtime_ns):
+            changed.append((file_path, st))
+
+    for i, (file_path, st) in enumerate(changed):
+        print(f'Cataloging {device} ({i + 1} / {len(changed)}): '
+              f'{file_path.name}')
+        info = reader(file_path)
+        info = info._asdict() if hasattr(info, '_asdict') else dict(info)
+        row = {
+            'device': device,
+            'path': str(file_path),
+            'name': file_path.name,
+            'record_name': file_path.parent.name,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'metas': json.dumps(record_name_metas(file_path.parent.name))
+        }
+        row.update({c: _to_sql_value(info.get(c)) for c in INFO_COLUMNS})
+        conn.execute(
+            f'INSERT OR REPLACE INTO records ({", ".join(CATALOG_COLUMNS)}) '
+            f'VALUES ({", ".join("?" * len(CATALOG_COLUMNS))})',
+            [row[c] for c in CATALOG_COLUMNS])
+        # Keep what was read if a later file fails
+        if (i + 1) % 100 == 0:
+            conn.commit()
+
+    removed = [(device, path) for path in cataloged if path not in found]
+    conn.executemany('DELETE FROM records WHERE device = ? AND path = ?',
+                     removed)
+    conn.commit()
+    return {'found': len(found), 'read': len(changed), 'removed': len(removed)}
+
+
+def query_records(conn: sqlite3.Connection, device: str,
+                  root=None) -> pd.DataFrame:
+    """Cataloged records of a device, under root if given, by start time
+    with the ones without a start last"""
+    sql = (f'SELECT {", ".join(CATALOG_COLUMNS)} FROM records '
+           'WHERE device = ?')
+    params = [device]
+    if root is not None:
+        sql += ' AND path >= ? AND path < ?'
+        params += _path_range(root)
+    sql += ' ORDER BY start_timestamp IS NULL, start_timestamp, path'
+    return pd.read_sql_query(sql, conn, params=params)
+
+
+@click.command()
+@click.argument('device')
+@click.option('-r', '--root', default=None, help='Only records under root')
+@click.option('-c', '--catalog', default=str(CATALOG_PATH))
+def main(device, root, catalog):
+    """Print the cataloged records of a device"""
+    with connect_catalog(catalog) as conn:
+        records = query_records(conn, device, root)
+    print(records.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,14 +8,15 @@ FilePath     : /my_github/refactor.py
 from datetime import date, datetime, timedelta
 from enum import Enum, unique
 from pathlib import Path
-from pprint import pprint
 import shutil
 
 import click
-import fitparse
 import numpy as np
 import pandas as pd
 
+from fit_cache import get_fit_info
+from timestamp_join import overlap_indices_by
+
 ACCEL_HEADER_LINE = 1  # begin with 0
 ACCEL_SUFFIX = 'accel-52HZ.csv'
 GARMIN_FIT_SUFFIX = '.fit'
@@ -79,32 +80,16 @@ class MatchType(Enum):
     VALID_RECORD = 'VALID_RECORD',
 
 
-def arg_nearest_in_sorted(value, arr_sorted: np.ndarray) -> int:
-    i = np.searchsorted(arr_sorted, value)
-
-    if i == len(arr_sorted):
-        return i - 1
-
-    if i == 0:
-        return 0
-
-    if abs(arr_sorted[i - 1] - value) < abs(arr_sorted[i] - value):
-        return i - 1
-
-    return i
-
-
-def get_insert_info(accel_start_ts: int, accel_stop_ts: int,
-                    target_start_ts: int, target_stop_ts: int) -> tuple:
+def get_insert_info(accel_start_ts, accel_stop_ts, target_start_ts,
+                    target_stop_ts) -> tuple:
+    """Overlap of targets with libai records, on scalars or arrays"""
     accel_seconds = accel_stop_ts - accel_start_ts
     target_seconds = target_stop_ts - accel_start_ts
 
-    if target_start_ts < accel_start_ts:
-        overlap = target_stop_ts - accel_start_ts
-        overlap = min(overlap, accel_seconds)
-    elif target_start_ts >= accel_start_ts:
-        overlap = accel_stop_ts - target_start_ts
-        overlap = min(overlap, target_seconds)
+    overlap = np.where(
+        target_start_ts < accel_start_ts,
+        np.minimum(target_stop_ts - accel_start_ts, accel_seconds),
+        np.minimum(accel_stop_ts - target_start_ts, target_seconds))
 
     overlap_rate = (overlap / accel_seconds) * 100
 
@@ -145,32 +130,8 @@ def read_info_from_libai_accel(libai_accel_path: Path) -> tuple:
 
 
 def read_info_from_garmin_fit(garmin_fit_path: str) -> tuple:
-    garmin_fit_path = str(garmin_fit_path)
-
-    garmin_fit_opened = fitparse.FitFile(garmin_fit_path)
-
-    start_datetime, stop_datetime, distance = None, None, None
-    for record in garmin_fit_opened.get_messages('record'):
-        for data in record:
-            name, value = data.name, data.value
-            if name == 'timestamp':  # amateur name for garmin
-                if start_datetime is None:
-                    start_datetime = value
-                stop_datetime = value
-            if name == 'distance':
-                distance = value
-
-    (start_timestamp, stop_timestamp, start_date_str, seconds) = (None, None,
-                                                                  None, None)
-    if start_datetime is not None:
-        start_datetime += GARMIN_UTC_OFFSET
-        start_date_str = start_datetime.date().isoformat()
-        start_timestamp = int(start_datetime.timestamp())
-    if stop_datetime is not None:
-        stop_datetime += GARMIN_UTC_OFFSET
-        stop_timestamp = int(stop_datetime.timestamp())
-    if isinstance(stop_timestamp, int) and isinstance(start_timestamp, int):
-        seconds = stop_timestamp - start_timestamp
+    (start_date_str, start_timestamp, stop_timestamp, seconds,
+     distance) = get_fit_info(garmin_fit_path, GARMIN_UTC_OFFSET)
     sport_name = None
     return (start_date_str, start_timestamp, stop_timestamp, seconds,
             sport_name, distance)
@@ -275,212 +236,118 @@ def collect_and_save_libai_garmin_polar(libai_clean: Path, garmin_clean: Path,
     return (libai_accel_collected, garmin_fit_collected, polar_csv_collected)
 
 
+def insert_target_into_libai_record(target_collected: pd.DataFrame,
+                                    libai_accel_collected: pd.DataFrame,
+                                    garmin_or_polar: str,
+                                    columns: list) -> pd.DataFrame:
+    libai_accel_collected.sort_values(by='start_timestamp', inplace=True)
+
+    # Libai record of the same tag overlapping every target, the one
+    # starting nearest if several do
+    accel_indices = overlap_indices_by(
+        target_collected['start_timestamp'].values,
+        target_collected['stop_timestamp'].values,
+        target_collected['tag'].values,
+        libai_accel_collected['start_timestamp'].values,
+        libai_accel_collected['stop_timestamp'].values,
+        libai_accel_collected[f'{garmin_or_polar}_tag'].values)
+    # TODO: process target without the same tag libai record
+    matched = accel_indices >= 0
+    target_part = target_collected[matched]
+    accel_part = libai_accel_collected.iloc[accel_indices[matched]]
+
+    target_paths = [
+        Path(path) for path in target_part[f'{garmin_or_polar}_path']
+    ]
+    accel_paths = [Path(path) for path in accel_part['accel_path']]
+    target_start_ts = target_part['start_timestamp'].values
+    target_stop_ts = target_part['stop_timestamp'].values
+    accel_start_ts = accel_part['start_timestamp'].values
+    accel_stop_ts = accel_part['stop_timestamp'].values
+
+    (overlap, overlap_rate, start_ts_diff,
+     stop_ts_diff) = get_insert_info(accel_start_ts, accel_stop_ts,
+                                     target_start_ts, target_stop_ts)
+
+    target_names = [path.name for path in target_paths]
+    libai_names = [path.parent.name for path in accel_paths]
+    values = (target_names, overlap, overlap_rate, target_part['tag'].values,
+              accel_part['libai_tag'].values, libai_names, start_ts_diff,
+              stop_ts_diff, accel_start_ts, accel_stop_ts, target_start_ts,
+              target_stop_ts, target_paths, accel_paths)
+    inserted = pd.DataFrame(dict(zip(columns, values)), columns=columns)
+    inserted = inserted[overlap > 0]
+
+    # One target per libai record, the first one with the largest overlap
+    best = inserted.groupby('libai_name', sort=False)['overlap'].idxmax()
+    inserted = inserted.loc[best.values].reset_index(drop=True)
+    print(f'Matched {len(inserted)} of {len(target_collected)} '
+          f'{garmin_or_polar} files, {int(np.sum(~matched))} without '
+          f'the same tag libai record')
+    return inserted
+
+
+def copy_inserted_into_libai_record(inserted: pd.DataFrame,
+                                    garmin_or_polar: str):
+    for target_path, accel_path in zip(inserted[f'{garmin_or_polar}_path'],
+                                       inserted['accel_path']):
+        shutil.copy(target_path, Path(accel_path).parent)
+
+
 def insert_garmin_fit_into_libai_record(garmin_fit_collected: pd.DataFrame,
                                         libai_accel_collected: pd.DataFrame
-                                        ) -> dict:
-    libai_accel_collected.sort_values(by='start_timestamp', inplace=True)
-    libai_name_inserted = {}
-    for i, row in garmin_fit_collected.iterrows():
-        garmin_path = Path(row['garmin_path'])
-        garmin_tag = row['tag']
-        garmin_start_timestamp = row['start_timestamp']
-        garmin_stop_timestamp = row['stop_timestamp']
-
-        libai_accel_part = libai_accel_collected[
-            libai_accel_collected['garmin_tag'] == garmin_tag].copy()
-
-        if libai_accel_part.empty:
-            # TODO: process garmin fit file without the same tag libai record
-            continue
-        libai_accel_part.sort_values(by='start_timestamp', inplace=True)
-        libai_accel_part.reset_index(drop=True, inplace=True)
-
-        accel_nearest_index = arg_nearest_in_sorted(
-            garmin_start_timestamp, libai_accel_part['start_timestamp'].values)
-
-        libai_accel_path = Path(
-            libai_accel_part.loc[accel_nearest_index, 'accel_path'])
-        accel_start_timestamp = libai_accel_part.loc[accel_nearest_index,
-                                                     'start_timestamp']
-        accel_stop_timestamp = libai_accel_part.loc[accel_nearest_index,
-                                                    'stop_timestamp']
-        libai_tag = libai_accel_part.loc[accel_nearest_index, 'libai_tag']
-
-        garmin_name = garmin_path.name
-        libai_record = libai_accel_path.parent
-        libai_name = libai_record.name
-
-        (overlap, overlap_rate, start_ts_diff, stop_ts_diff) = get_insert_info(
-            accel_start_timestamp, accel_stop_timestamp,
-            garmin_start_timestamp, garmin_stop_timestamp)
-
-        if overlap <= 0:
-            print(f'Failure match: overlap = {overlap}, '
-                  f'garmin_name = {garmin_name}')
-            continue
-
-        msg = (garmin_name, overlap, overlap_rate, garmin_tag, libai_tag,
-               libai_name, start_ts_diff, stop_ts_diff, accel_start_timestamp,
-               accel_stop_timestamp, garmin_start_timestamp,
-               garmin_stop_timestamp, garmin_path, libai_accel_path)
-
-        if libai_name in libai_name_inserted:
-            print(f'Already matchs: {libai_name}')
-            print('old_msg = ')
-            old_msg = libai_name_inserted[libai_name]
-            pprint(old_msg)
-            print('new_msg = ')
-            pprint(msg)
-            old_overlap = old_msg[1]
-            if overlap > old_overlap:
-                shutil.copy(garmin_path, libai_record)
-                libai_name_inserted[libai_name] = msg
-                print(f'Change match: old_overlap, new_overlap = '
-                      f'{old_overlap}, {overlap}')
-            else:
-                print(f'Remain match: old_overlap, new_overlap = '
-                      f'{old_overlap}, {overlap}')
-            print('\n')
-        else:
-            shutil.copy(garmin_path, libai_record)
-            libai_name_inserted[libai_name] = msg
+                                        ) -> pd.DataFrame:
+    garmin_fit_inserted = insert_target_into_libai_record(
+        garmin_fit_collected, libai_accel_collected, 'garmin',
+        GARMIN_FIT_INSERTED_COLUMNS)
+    copy_inserted_into_libai_record(garmin_fit_inserted, 'garmin')
     print('Succeed: insert garmin fit into libai reocrd\n')
-    return libai_name_inserted
+    return garmin_fit_inserted
 
 
 def insert_polar_csv_into_libai_record(polar_csv_collected: pd.DataFrame,
                                        libai_accel_collected: pd.DataFrame
-                                       ) -> dict:
-    libai_accel_collected.sort_values(by='start_timestamp', inplace=True)
-    libai_name_inserted = {}
-    for i, row in polar_csv_collected.iterrows():
-        polar_path = Path(row['polar_path'])
-        polar_tag = row['tag']
-        polar_start_timestamp = row['start_timestamp']
-        polar_stop_timestamp = row['stop_timestamp']
-
-        libai_accel_part = libai_accel_collected[
-            libai_accel_collected['polar_tag'] == polar_tag].copy()
-
-        if libai_accel_part.empty:
-            # TODO: process polar fit file without the same tag libai record
-            continue
-        libai_accel_part.sort_values(by='start_timestamp', inplace=True)
-        libai_accel_part.reset_index(drop=True, inplace=True)
-
-        accel_nearest_index = arg_nearest_in_sorted(
-            polar_start_timestamp, libai_accel_part['start_timestamp'].values)
-
-        libai_accel_path = Path(
-            libai_accel_part.loc[accel_nearest_index, 'accel_path'])
-        accel_start_timestamp = libai_accel_part.loc[accel_nearest_index,
-                                                     'start_timestamp']
-        accel_stop_timestamp = libai_accel_part.loc[accel_nearest_index,
-                                                    'stop_timestamp']
-        libai_tag = libai_accel_part.loc[accel_nearest_index, 'libai_tag']
-
-        polar_name = polar_path.name
-        libai_record = libai_accel_path.parent
-        libai_name = libai_record.name
-
-        (overlap, overlap_rate, start_ts_diff, stop_ts_diff) = get_insert_info(
-            accel_start_timestamp, accel_stop_timestamp, polar_start_timestamp,
-            polar_stop_timestamp)
-
-        if overlap <= 0:
-            print(f'Failure match: overlap = {overlap}, '
-                  f'polar_name = {polar_name}')
-            continue
-
-        msg = (polar_name, overlap, overlap_rate, polar_tag, libai_tag,
-               libai_name, start_ts_diff, stop_ts_diff, accel_start_timestamp,
-               accel_stop_timestamp, polar_start_timestamp,
-               polar_stop_timestamp, polar_path, libai_accel_path)
-
-        if libai_name in libai_name_inserted:
-            print(f'Already matchs: {libai_name}')
-            print('old_msg = ')
-            old_msg = libai_name_inserted[libai_name]
-            pprint(old_msg)
-            print('new_msg = ')
-            pprint(msg)
-            old_overlap = old_msg[1]
-            if overlap > old_overlap:
-                shutil.copy(polar_path, libai_record)
-                libai_name_inserted[libai_name] = msg
-                print(f'Change match: old_overlap, new_overlap = '
-                      f'{old_overlap}, {overlap}')
-            else:
-                print(f'Remain match: old_overlap, new_overlap = '
-                      f'{old_overlap}, {overlap}')
-            print('\n')
-        else:
-            shutil.copy(polar_path, libai_record)
-            libai_name_inserted[libai_name] = msg
+                                       ) -> pd.DataFrame:
+    polar_csv_inserted = insert_target_into_libai_record(
+        polar_csv_collected, libai_accel_collected, 'polar',
+        POLAR_CSV_INSERTED_COLUMNS)
+    copy_inserted_into_libai_record(polar_csv_inserted, 'polar')
     print('Succeed: insert polar into libai reocrd\n')
-    return libai_name_inserted
-
-
-def save_libai_name_inserted(libai_name_inserted: dict,
-                             columns: list) -> pd.DataFrame:
-    vals = []
-    for val in libai_name_inserted.values():
-        vals.append(val)
-    inserted_msg = pd.DataFrame(vals, columns=columns)
-    return inserted_msg
+    return polar_csv_inserted
 
 
 def match_summary(accel_collected: pd.DataFrame,
                   garmin_fit_inserted: pd.DataFrame,
                   polar_csv_inserted: pd.DataFrame) -> pd.DataFrame:
-
-    matchs = []
-    for i, row in accel_collected.iterrows():
-        libai_tag = row['libai_tag']
-        accel_path = Path(row['accel_path'])
-        libai_record = accel_path.parent
-        libai_name = libai_record.name
-
-        garmin_part = garmin_fit_inserted[garmin_fit_inserted['libai_name'] ==
-                                          libai_name].copy()
-        polar_part = polar_csv_inserted[polar_csv_inserted['libai_name'] ==
-                                        libai_name].copy()
-        garmin_overlap, garmin_overlap_rate, garmin_path = None, None, None
-        polar_overlap, polar_overlap_rate, polar_path = None, None, None
-        polar_tag, garmin_tag = None, None
-
-        if not garmin_part.empty:
-            if len(garmin_part) > 1:
-                pass
-            garmin_overlap = garmin_part['overlap'].values[0]
-            garmin_overlap_rate = garmin_part['overlap_rate'].values[0]
-            garmin_path = garmin_part['garmin_path'].values[0]
-            garmin_tag = int(garmin_part['garmin_tag'].values[0])
-        if not polar_part.empty:
-            if len(polar_part) > 1:
-                pass
-            polar_overlap = polar_part['overlap'].values[0]
-            polar_overlap_rate = polar_part['overlap_rate'].values[0]
-            polar_path = polar_part['polar_path'].values[0]
-            polar_tag = int(polar_part['polar_tag'].values[0])
-
-        if garmin_path is not None:
-            if polar_path is not None:
-                match_type = MatchType.VALID_RECORD.value[0]
-            else:
-                match_type = MatchType.NO_POLAR.value[0]
-        else:
-            if polar_path is not None:
-                match_type = MatchType.NO_GARMIN.value[0]
-            else:
-                match_type = MatchType.NO_POLAR_GARMIN.value[0]
-
-        matchs.append(
-            (libai_name, match_type, garmin_overlap, polar_overlap,
-             garmin_overlap_rate, polar_overlap_rate, libai_tag, garmin_tag,
-             polar_tag, libai_record, garmin_path, polar_path))
-    match_df = pd.DataFrame(matchs, columns=MATCH_COLUMNS)
-    return match_df
+    libai_records = accel_collected['accel_path'].map(
+        lambda path: Path(path).parent)
+    match_df = pd.DataFrame({
+        'libai_name': libai_records.map(lambda path: path.name).values,
+        'libai_tag': accel_collected['libai_tag'].values,
+        'libai_record': libai_records.values
+    })
+
+    for target, inserted in (('garmin', garmin_fit_inserted),
+                             ('polar', polar_csv_inserted)):
+        inserted = inserted.drop_duplicates('libai_name')[[
+            'libai_name', 'overlap', 'overlap_rate', f'{target}_path',
+            f'{target}_tag'
+        ]].rename(columns={
+            'overlap': f'{target}_overlap',
+            'overlap_rate': f'{target}_overlap_rate'
+        })
+        inserted[f'{target}_tag'] = pd.to_numeric(
+            inserted[f'{target}_tag']).astype('Int64')
+        match_df = match_df.merge(inserted, on='libai_name', how='left')
+
+    has_garmin = match_df['garmin_path'].notna().values
+    has_polar = match_df['polar_path'].notna().values
+    match_df['match_type'] = np.select(
+        [has_garmin & has_polar, has_garmin, has_polar], [
+            MatchType.VALID_RECORD.value[0], MatchType.NO_POLAR.value[0],
+            MatchType.NO_GARMIN.value[0]
+        ], MatchType.NO_POLAR_GARMIN.value[0])
+    return match_df[MATCH_COLUMNS]
 
 
 def run(libai_clean, garmin_clean, polar_clean) -> tuple:
@@ -492,15 +359,11 @@ def run(libai_clean, garmin_clean, polar_clean) -> tuple:
     save_df_to_log(garmin_fit_collected, 'garmin_fit_collected.csv')
     save_df_to_log(polar_csv_collected, 'polar_csv_collected.csv')
 
-    garmin_fit_inserted_dict = insert_garmin_fit_into_libai_record(
+    garmin_fit_inserted = insert_garmin_fit_into_libai_record(
         garmin_fit_collected, libai_accel_collected)
-    garmin_fit_inserted = save_libai_name_inserted(
-        garmin_fit_inserted_dict, columns=GARMIN_FIT_INSERTED_COLUMNS)
 
-    polar_csv_inserted_dict = insert_polar_csv_into_libai_record(
+    polar_csv_inserted = insert_polar_csv_into_libai_record(
         polar_csv_collected, libai_accel_collected)
-    polar_csv_inserted = save_libai_name_inserted(
-        polar_csv_inserted_dict, columns=POLAR_CSV_INSERTED_COLUMNS)
     print(f'garmin_fit_inserted = {garmin_fit_collected.head()}')
 
     match_df = match_summary(libai_accel_collected, garmin_fit_inserted,
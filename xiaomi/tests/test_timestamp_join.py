@@ -0,0 +1,85 @@
+'''
+Author       : Tianzw
+Date         : 2021-03-27 16:02:41
+LastEditors  : Tianzw
+LastEditTime : 2021-03-27 16:40:18
+FilePath     : /my_github/tests/test_timestamp_join.py
+'''
+from pathlib import Path
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).parents[1]))
+from timestamp_join import overlap_indices_by, overlapping_pairs
+
+
+def brute_force_pairs(starts, stops, other_starts, other_stops):
+    index, other_index = np.nonzero(
+        (other_starts[None, :] < stops[:, None])
+        & (other_stops[None, :] > starts[:, None]))
+    return set(zip(index.tolist(), other_index.tolist()))
+
+
+def random_intervals(rng, n):
+    starts = rng.integers(0, 50, n).astype(float)
+    stops = starts + rng.integers(-3, 15, n)
+    return starts, stops
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_overlapping_pairs_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(200):
+        n, m = rng.integers(0, 30, 2)
+        starts, stops = random_intervals(rng, n)
+        other_starts, other_stops = random_intervals(rng, m)
+        if n > 0:
+            starts[rng.integers(n)] = np.nan
+        index, other_index = overlapping_pairs(starts, stops, other_starts,
+                                               other_stops)
+        pairs = list(zip(index.tolist(), other_index.tolist()))
+        assert len(pairs) == len(set(pairs))
+        assert set(pairs) == brute_force_pairs(starts, stops, other_starts,
+                                               other_stops)
+        assert np.all(np.diff(index) >= 0)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_overlap_indices_by_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(200):
+        n, m = rng.integers(0, 30, 2)
+        starts, stops = random_intervals(rng, n)
+        arr_starts, arr_stops = random_intervals(rng, m)
+        keys, arr_keys = rng.integers(0, 3, n), rng.integers(0, 3, m)
+        res = overlap_indices_by(starts, stops, keys, arr_starts, arr_stops,
+                                 arr_keys)
+        for i in range(n):
+            candidates = [
+                j for j in range(m) if arr_keys[j] == keys[i]
+                and arr_starts[j] < stops[i] and arr_stops[j] > starts[i]
+            ]
+            if len(candidates) == 0:
+                assert res[i] == -1
+                continue
+            # Nearest start, then the later start, then the first in arr
+            best = min(candidates,
+                       key=lambda j:
+                       (abs(arr_starts[j] - starts[i]), -arr_starts[j], j))
+            assert res[i] == best
+
+
+def test_one_long_interval_does_not_widen_the_search():
+    n = 20000
+    starts = np.arange(n) * 10**5
+    stops = starts + 10**4
+    other_starts = starts + 10**3
+    other_stops = stops + 10**3
+    # A bogus record starting at 0 overlaps every interval, the others only
+    # their own one
+    other_starts[-1] = 0
+    index, other_index = overlapping_pairs(starts, stops, other_starts,
+                                           other_stops)
+    assert len(index) == 2 * n - 1
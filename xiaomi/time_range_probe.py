@@ -0,0 +1,122 @@
+'''
+Author       : Tianzw
+Date         : 2021-03-30 10:26:14
+LastEditors  : Tianzw
+LastEditTime : 2021-03-30 16:11:39
+FilePath     : /my_github/time_range_probe.py
+'''
+from pathlib import Path
+
+import click
+
+BLOCK_SIZE = 1 << 12
+PROBE_MAX_LINES = 100
+
+
+def _decode(line: bytes) -> str:
+    return line.rstrip(b'\r').decode('utf-8', errors='replace')
+
+
+def iter_head_lines(file_path: Path, block_size=BLOCK_SIZE):
+    """Lines of a file from the first one, without line breaks"""
+    with Path(file_path).open('rb') as f:
+        rest = b''
+        while True:
+            block = f.read(block_size)
+            if len(block) == 0:
+                break
+            lines = (rest + block).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                yield _decode(line)
+        if len(rest) > 0:
+            yield _decode(rest)
+
+
+def iter_tail_lines(file_path: Path, block_size=BLOCK_SIZE):
+    """Lines of a file from the last one, without line breaks
+
+    The file is read by blocks from its end, a last line without line break
+    is yielded too.
+    """
+    with Path(file_path).open('rb') as f:
+        file_size = f.seek(0, 2)
+        pos = file_size
+        rest = b''
+        while pos > 0:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            lines = (f.read(size) + rest).split(b'\n')
+            if pos + size == file_size and len(lines[-1]) == 0:
+                # Line break at the end of the file
+                lines.pop()
+            # The first piece may be the end of a line in an earlier block
+            rest = lines.pop(0) if len(lines) > 0 else b''
+            for line in reversed(lines):
+                yield _decode(line)
+        if file_size > 0:
+            yield _decode(rest)
+
+
+def first_field_timestamp(line: str) -> int:
+    """Timestamp in the first field of a CSV, NMEA or log line
+
+    A line without a ',' is refused, it may be the last line of a file still
+    being written, cut off inside its first field.
+    """
+    timestamp, sep, _ = line.partition(',')
+    if len(sep) == 0:
+        raise ValueError(f'No field separator in line: {line!r}')
+    return int(timestamp)
+
+
+def _first_timestamp(lines, parse_timestamp, max_lines):
+    for i, line in enumerate(lines):
+        if i >= max_lines:
+            break
+        try:
+            return parse_timestamp(line)
+        except (ValueError, IndexError):
+            continue
+    return None
+
+
+def probe_time_range(file_path: Path,
+                     header_lines=0,
+                     parse_timestamp=first_field_timestamp,
+                     max_lines=PROBE_MAX_LINES) -> tuple:
+    """First and last timestamps of a sensor file, from its ends only
+
+    The header lines are skipped, then the first line parse_timestamp can
+    parse gives the first timestamp, and the last such line the last one.
+    Blank, broken or truncated lines are passed over, up to max_lines at
+    each end.
+
+    Returns
+    -------
+    tuple
+        (first, last), None for a timestamp not found
+    """
+    head_lines = iter_head_lines(file_path)
+    for _ in zip(range(header_lines), head_lines):
+        pass
+    first = _first_timestamp(head_lines, parse_timestamp, max_lines)
+    if first is None:
+        return (None, None)
+    last = _first_timestamp(iter_tail_lines(file_path), parse_timestamp,
+                            max_lines)
+    return (first, last)
+
+
+@click.command()
+@click.argument('file-paths', nargs=-1)
+@click.option('-n', '--header-lines', default=0, help='Lines to skip')
+def main(file_paths, header_lines):
+    for file_path in file_paths:
+        first, last = probe_time_range(file_path, header_lines)
+        print(f'{file_path}: {first}, {last}')
+
+
+if __name__ == '__main__':
+    main()
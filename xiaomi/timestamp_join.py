@@ -0,0 +1,186 @@
+'''
+Author       : Tianzw
+Date         : 2021-03-27 10:05:12
+LastEditors  : Tianzw
+LastEditTime : 2021-03-27 15:32:40
+FilePath     : /my_github/timestamp_join.py
+'''
+import numpy as np
+import pandas as pd
+
+DIRECTIONS = ('nearest', 'backward', 'forward')
+
+
+def asof_indices(values, arr_sorted: np.ndarray, direction='nearest',
+                 tolerance=None) -> np.ndarray:
+    """Index in arr_sorted matched by every value, -1 where unmatched
+
+    backward takes the last element <= value, forward the first one >=
+    value, and nearest the closer of both, the forward one on a tie.
+    Matches further than tolerance from the value are dropped. values need
+    not be sorted.
+    """
+    if direction not in DIRECTIONS:
+        raise ValueError(f'Unknown direction: {direction}')
+    values = np.asarray(values)
+    arr_sorted = np.asarray(arr_sorted)
+    n = len(arr_sorted)
+    if n == 0:
+        return np.full(values.shape, -1, dtype=int)
+
+    if direction == 'backward':
+        index = np.searchsorted(arr_sorted, values, side='right') - 1
+    else:
+        index = np.searchsorted(arr_sorted, values, side='left')
+        if direction == 'forward':
+            index[index == n] = -1
+        else:
+            after = np.minimum(index, n - 1)
+            before = np.maximum(index - 1, 0)
+            before_dist = np.abs(arr_sorted[before] - values)
+            after_dist = np.abs(arr_sorted[after] - values)
+            index = np.where(before_dist < after_dist, before, after)
+
+    if tolerance is not None:
+        valid = index >= 0
+        dist = np.abs(arr_sorted[np.maximum(index, 0)] - values)
+        index[valid & (dist > tolerance)] = -1
+    return index
+
+
+def asof_indices_by(values, keys, arr, arr_keys, direction='nearest',
+                    tolerance=None) -> np.ndarray:
+    """asof_indices within the rows of arr with the same key
+
+    arr needs not be sorted, the returned indices are positions in arr.
+    """
+    values = np.asarray(values)
+    arr = np.asarray(arr)
+    res = np.full(len(values), -1, dtype=int)
+    arr_groups = pd.Series(np.arange(len(arr))).groupby(
+        np.asarray(arr_keys)).indices
+    value_groups = pd.Series(np.arange(len(values))).groupby(
+        np.asarray(keys)).indices
+    for key, value_pos in value_groups.items():
+        if key not in arr_groups:
+            continue
+        arr_pos = arr_groups[key]
+        arr_pos = arr_pos[np.argsort(arr[arr_pos], kind='stable')]
+        index = asof_indices(values[value_pos], arr[arr_pos], direction,
+                             tolerance)
+        res[value_pos] = np.where(index >= 0, arr_pos[index], -1)
+    return res
+
+
+def asof_join(left: np.ndarray,
+              right: np.ndarray,
+              left_on=1,
+              right_on=1,
+              direction='nearest',
+              tolerance=None) -> tuple:
+    """Rows of right matched to rows of left on sorted timestamp columns
+
+    Returns
+    -------
+    tuple
+        (left_index, right_index) of the matched rows, unmatched rows of
+        left are left out
+    """
+    right_index = asof_indices(left[:, left_on], right[:, right_on],
+                               direction, tolerance)
+    left_index = np.nonzero(right_index >= 0)[0]
+    return left_index, right_index[left_index]
+
+
+def _expand_ranges(lo: np.ndarray, hi: np.ndarray) -> tuple:
+    """(row, position) for every position in [lo[row], hi[row])"""
+    counts = np.maximum(hi - lo, 0)
+    rows = np.repeat(np.arange(len(lo)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts, counts)
+    return rows, np.repeat(lo, counts) + offsets
+
+
+def overlapping_pairs(starts, stops, other_starts, other_stops) -> tuple:
+    """Pairs (i, j) of intervals i and other intervals j that overlap
+
+    Intervals overlap when other_starts[j] < stops[i] and
+    other_stops[j] > starts[i]. Every pair is found from one side only,
+    either the other interval starts within [starts[i], stops[i]), or
+    starts[i] falls within (other_starts[j], other_stops[j]). Both are
+    range searches in sorted starts, so the cost is O((n + m) log(n + m) +
+    k) for k pairs however long a single interval is. Intervals with a NaN
+    bound overlap nothing.
+
+    Returns
+    -------
+    tuple
+        (index, other_index) of the overlapping pairs, grouped by index and
+        by other start within a group
+    """
+    starts, stops = np.asarray(starts), np.asarray(stops)
+    other_starts = np.asarray(other_starts)
+    other_stops = np.asarray(other_stops)
+    empty = np.zeros(0, dtype=int)
+    valid = np.nonzero(~np.isnan(starts.astype(float))
+                       & ~np.isnan(stops.astype(float)))[0]
+    other_valid = np.nonzero(~np.isnan(other_starts.astype(float))
+                             & ~np.isnan(other_stops.astype(float)))[0]
+    if len(valid) == 0 or len(other_valid) == 0:
+        return empty, empty
+
+    # Other intervals starting within an interval
+    other_order = other_valid[np.argsort(other_starts[other_valid],
+                                         kind='stable')]
+    sorted_other_starts = other_starts[other_order]
+    lo = np.searchsorted(sorted_other_starts, starts[valid], side='left')
+    hi = np.searchsorted(sorted_other_starts, stops[valid], side='left')
+    rows, pos = _expand_ranges(lo, hi)
+    index_a, other_index_a = valid[rows], other_order[pos]
+
+    # Intervals starting strictly within an other interval
+    order = valid[np.argsort(starts[valid], kind='stable')]
+    sorted_starts = starts[order]
+    lo = np.searchsorted(sorted_starts,
+                         other_starts[other_valid],
+                         side='right')
+    hi = np.searchsorted(sorted_starts, other_stops[other_valid], side='left')
+    rows, pos = _expand_ranges(lo, hi)
+    index_b, other_index_b = order[pos], other_valid[rows]
+
+    index = np.concatenate((index_a, index_b))
+    other_index = np.concatenate((other_index_a, other_index_b))
+    keep = ((other_starts[other_index] < stops[index])
+            & (other_stops[other_index] > starts[index]))
+    index, other_index = index[keep], other_index[keep]
+    other_rank = np.empty(len(other_starts), dtype=int)
+    other_rank[other_order] = np.arange(len(other_order))
+    order = np.lexsort((other_rank[other_index], index))
+    return index[order], other_index[order]
+
+
+def overlap_indices_by(starts, stops, keys, arr_starts, arr_stops,
+                       arr_keys) -> np.ndarray:
+    """Interval of arr with the same key overlapping every interval, -1 if
+    none
+
+    Of several overlapping intervals the one starting nearest is taken,
+    with the ties broken like asof_indices_by. The returned indices are
+    positions in arr.
+    """
+    starts, keys = np.asarray(starts), np.asarray(keys)
+    arr_starts, arr_keys = np.asarray(arr_starts), np.asarray(arr_keys)
+    res = np.full(len(starts), -1, dtype=int)
+    index, arr_index = overlapping_pairs(starts, stops, arr_starts, arr_stops)
+    same = keys[index] == arr_keys[arr_index]
+    index, arr_index = index[same], arr_index[same]
+    if len(index) == 0:
+        return res
+
+    dist = np.abs(arr_starts[arr_index] - starts[index])
+    # Nearest start first, then the later start, then the first in arr
+    order = np.lexsort((arr_index, -arr_starts[arr_index], dist, index))
+    index, arr_index = index[order], arr_index[order]
+    first = np.unique(index, return_index=True)[1]
+    res[index[first]] = arr_index[first]
+    return res